@@ -1,15 +1,22 @@
 from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QFormLayout, 
                              QLineEdit, QDateEdit, QComboBox, QPushButton, 
                              QLabel, QGroupBox, QMessageBox, QCheckBox,
-                             QTextEdit)
-from PySide6.QtCore import QDate, Qt
-from database import Athlete, MedicalCertificate, Rank, get_session
+                             QTextEdit, QCompleter)
+from PySide6.QtCore import QDate, Qt, QStringListModel
+from database import (Athlete, MedicalCertificate, Rank, get_session, write_transaction, ConcurrentUpdateError,
+                      athlete_versions, athlete_for_update)
+from cf_utils import parse_cf, complete_comune, get_comune_codes, get_comune_name
 import datetime
 
 class AthleteDialog(QDialog):
     def __init__(self, parent=None, athlete_id=None):
         super().__init__(parent)
         self.athlete_id = athlete_id
+        # Id degli atleti creati/modificati/eliminati, per aggiornare solo quelle righe
+        self.changes = {"created": set(), "updated": set(), "deleted": set()}
+        # Versioni lette all'apertura (atleta e ultimo certificato): se al salvataggio sono
+        # cambiate, un'altra postazione ha modificato l'atleta nel frattempo. None = non controllare
+        self.loaded_versions = None
         self.setWindowTitle("Aggiungi Atleta" if not athlete_id else "Modifica Atleta")
         self.setMinimumWidth(850)
         
@@ -33,6 +40,14 @@ class AthleteDialog(QDialog):
         self.birth_date_input.setDate(QDate.currentDate().addYears(-10))
         
         self.birth_place_input = QLineEdit()
+        # Suggestions come from the comuni prefix index, one bisect per keystroke
+        self.birth_place_model = QStringListModel(self)
+        self.birth_place_completer = QCompleter(self.birth_place_model, self)
+        self.birth_place_completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.birth_place_completer.setWidget(self.birth_place_input)
+        self.birth_place_completer.activated.connect(self.birth_place_input.setText)
+        self.birth_place_input.textEdited.connect(self.update_birth_place_completions)
+        self.tax_code_input.editingFinished.connect(self.fill_birth_place_from_cf)
         
         self.address_input = QLineEdit()
         self.phone_input = QLineEdit()
@@ -148,17 +163,56 @@ class AthleteDialog(QDialog):
         if self.athlete_id:
             self.load_athlete_data()
 
+    def update_birth_place_completions(self, text):
+        names = complete_comune(text)
+        self.birth_place_model.setStringList(names)
+        if names and names != [text]:
+            self.birth_place_completer.complete()
+        else:
+            self.birth_place_completer.popup().hide()
+
+    def fill_birth_place_from_cf(self):
+        if self.birth_place_input.text().strip():
+            return
+        cf = parse_cf(self.tax_code_input.text().strip())
+        if cf:
+            name = get_comune_name(cf["comune_code"], as_of=cf["birth_date"])
+            if name != cf["comune_code"]:
+                self.birth_place_input.setText(name)
+
+    def check_birth_place(self):
+        """Messaggio se il luogo di nascita non corrisponde al comune del codice fiscale, altrimenti None"""
+        place = self.birth_place_input.text().strip()
+        cf = parse_cf(self.tax_code_input.text().strip())
+        if not place or not cf:
+            return None
+        codes = get_comune_codes(place)
+        # Unknown names (e.g. foreign countries) are not checked
+        if not codes or cf["comune_code"] in codes:
+            return None
+        expected = get_comune_name(cf["comune_code"], as_of=cf["birth_date"])
+        return f"Il luogo di nascita '{place}' non corrisponde al codice fiscale (comune: {expected})."
+
     def delete_athlete(self):
         reply = QMessageBox.question(self, "Conferma Eliminazione", 
                                    "Sei sicuro di voler eliminare definitivamente questo atleta?",
                                    QMessageBox.Yes | QMessageBox.No)
         if reply == QMessageBox.Yes:
             session = get_session()
-            athlete = session.query(Athlete).filter_by(id=self.athlete_id).first()
-            if athlete:
-                session.delete(athlete)
-                session.commit()
-            session.close()
+
+            def delete():
+                athlete = session.get(Athlete, self.athlete_id)
+                if athlete:
+                    session.delete(athlete)
+            try:
+                write_transaction(session, delete)
+            except Exception as e:
+                QMessageBox.critical(self, "Errore Eliminazione", f"Si è verificato un errore: {str(e)}")
+                return
+            finally:
+                session.close()
+            # Già eliminato da un'altra postazione: la riga va tolta comunque
+            self.changes["deleted"].add(self.athlete_id)
             self.done(2) # Custom return code for deletion
 
     def load_athlete_data(self):
@@ -192,17 +246,66 @@ class AthleteDialog(QDialog):
             if cert:
                 self.cert_type_input.setCurrentText(cert.cert_type)
                 self.cert_expiry_input.setDate(QDate(cert.expiry_date.year, cert.expiry_date.month, cert.expiry_date.day))
+            self.loaded_versions = athlete_versions(athlete)
         session.close()
 
     def save_athlete(self):
         if not self.name_input.text() or not self.surname_input.text() or not self.tax_code_input.text():
             QMessageBox.warning(self, "Errore", "Nome, Cognome e Codice Fiscale sono obbligatori.")
             return
+
+        mismatch = self.check_birth_place()
+        if mismatch:
+            reply = QMessageBox.question(self, "Verifica Luogo di Nascita", f"{mismatch}\nSalvare comunque?",
+                                         QMessageBox.Yes | QMessageBox.No)
+            if reply != QMessageBox.Yes:
+                return
             
+        while True:
+            try:
+                athlete_id = self.write_athlete()
+            except ConcurrentUpdateError as e:
+                if self.resolve_concurrent_update(e):
+                    continue
+                return
+            except Exception as e:
+                QMessageBox.critical(self, "Errore Salvataggio", f"Si è verificato un errore: {str(e)}")
+                return
+            self.changes["updated" if self.athlete_id else "created"].add(athlete_id)
+            self.accept()
+            return
+
+    def resolve_concurrent_update(self, error):
+        """Atleta cambiato da un'altra postazione: True per salvare comunque questa scheda"""
+        if error.deleted:
+            QMessageBox.warning(self, "Atleta Eliminato",
+                                "L'atleta è stato eliminato da un'altra postazione: le modifiche non possono essere salvate.")
+            self.changes["deleted"].add(self.athlete_id)
+            self.done(2)
+            return False
+        msg = QMessageBox(self)
+        msg.setIcon(QMessageBox.Warning)
+        msg.setWindowTitle("Modifica Concorrente")
+        msg.setText(f"{error}\n\nSovrascrivere con i dati di questa scheda oppure ricaricare quelli salvati "
+                    "dall'altra postazione (le modifiche di questa scheda andranno perse)?")
+        btn_overwrite = msg.addButton("Sovrascrivi", QMessageBox.AcceptRole)
+        btn_reload = msg.addButton("Ricarica", QMessageBox.ActionRole)
+        msg.addButton("Annulla", QMessageBox.RejectRole)
+        msg.exec()
+        if msg.clickedButton() == btn_overwrite:
+            self.loaded_versions = None
+            return True
+        if msg.clickedButton() == btn_reload:
+            self.load_athlete_data()
+        return False
+
+    def write_athlete(self):
+        """Salva la scheda in una transazione breve (ripetuta se il database è occupato); ritorna l'id"""
         session = get_session()
-        try:
+
+        def write():
             if self.athlete_id:
-                athlete = session.query(Athlete).filter_by(id=self.athlete_id).first()
+                athlete = athlete_for_update(session, self.athlete_id, self.loaded_versions)
             else:
                 athlete = Athlete()
                 session.add(athlete)
@@ -244,11 +347,9 @@ class AthleteDialog(QDialog):
                 else:
                     new_cert = MedicalCertificate(cert_type=cert_type, expiry_date=expiry)
                     athlete.certificates.append(new_cert)
-            
-            session.commit()
-            self.accept()
-        except Exception as e:
-            session.rollback()
-            QMessageBox.critical(self, "Errore Salvataggio", f"Si è verificato un errore: {str(e)}")
+            return athlete
+
+        try:
+            return write_transaction(session, write).id
         finally:
             session.close()
@@ -0,0 +1,338 @@
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QThreadPool, Signal
+from PySide6.QtGui import QFont, QColor
+from database import get_session
+from queries import athlete_list_query, athlete_list_columns, search_terms, use_fts, SORT_TIEBREAKERS
+from workers import QueryTask
+import datetime
+
+# Numero di righe lette dal database ad ogni fetchMore
+PAGE_SIZE = 200
+
+# Oltre questo numero di atleti modificati (es. importazione) le righe vengono rilette
+PATCH_MAX_ROWS = 500
+
+def sql_order_value(value):
+    """Chiave Python con lo stesso ordine di SQLite: NULL < numeri < testo (date in formato ISO)"""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return (2, value.isoformat())
+    return (2, str(value))
+
+class AthleteTableModel(QAbstractTableModel):
+    """Modello virtuale della tabella atleti: le righe vengono lette a pagine
+    solo quando la vista ne ha bisogno, colori e font sono calcolati in data().
+    Le pagine sono lette in background: una nuova ricerca annulla quella in corso."""
+
+    loadingChanged = Signal(bool)
+    loadFailed = Signal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.columns = []       # Configurazioni colonna visibili (key, label)
+        self.rows = []          # Tuple (athlete_id, scadenza, valori colonne...)
+        self._value_pos = {}    # Chiave colonna -> posizione nella tupla
+        self.search_text = ""
+        self.sort_key = None
+        self.sort_order = Qt.AscendingOrder
+        self._has_more = False
+        self._generation = 0    # Incrementata ad ogni nuova query: i risultati vecchi vengono scartati
+        self._task = None       # Pagina in lettura sul thread pool
+        self._suspended = False # Nessuna lettura (es. ripristino di un backup in corso)
+
+        self._bold_font = QFont()
+        self._bold_font.setBold(True)
+
+    # --- CONFIGURAZIONE ---
+
+    def set_query(self, columns, search_text=""):
+        """Imposta colonne e filtro di ricerca e riparte dalla prima pagina"""
+        self._cancel_pending()
+        self.beginResetModel()
+        self.columns = list(columns)
+        self.search_text = search_text
+        data_keys = athlete_list_columns([c["key"] for c in self.columns])
+        self._value_pos = {k: i + 2 for i, k in enumerate(data_keys)}
+        self._value_pos["scadenza"] = 1
+        if self.sort_key not in [c["key"] for c in self.columns]:
+            self.sort_key = None
+        self.rows = []
+        self._has_more = True
+        self.endResetModel()
+        # La prima pagina viene richiesta subito così la vista non resta vuota
+        if self.canFetchMore(QModelIndex()):
+            self.fetchMore(QModelIndex())
+
+    def refresh(self):
+        self.set_query(self.columns, self.search_text)
+
+    def reload(self):
+        """
+        Rilegge le righe già caricate (almeno una pagina) con una sola query e le sostituisce
+        senza azzerare il modello: selezione e riga corrente seguono l'atleta.
+        """
+        if not self.columns or self._suspended:
+            return
+        self._cancel_pending()
+        count = max(len(self.rows), PAGE_SIZE)
+        stmt = athlete_list_query([c["key"] for c in self.columns], self.search_text,
+                                  self.sort_key, self.sort_order == Qt.DescendingOrder).limit(count)
+        self._task = QueryTask(self._generation, stmt)
+        self._task.signals.finished.connect(lambda generation, rows: self._on_reloaded(generation, rows, count))
+        self._task.signals.failed.connect(self._on_page_failed)
+        self.loadingChanged.emit(True)
+        QThreadPool.globalInstance().start(self._task)
+
+    def _on_reloaded(self, generation, rows, count):
+        if generation != self._generation:
+            return
+        self._task = None
+        self.loadingChanged.emit(False)
+        self._has_more = len(rows) == count
+        self.layoutAboutToBeChanged.emit()
+        new_pos = {row[0]: i for i, row in enumerate(rows)}
+        for index in self.persistentIndexList():
+            pos = new_pos.get(self.rows[index.row()][0]) if index.row() < len(self.rows) else None
+            self.changePersistentIndex(index, self.index(pos, index.column()) if pos is not None else QModelIndex())
+        self.rows = rows
+        self.layoutChanged.emit()
+
+    # --- AGGIORNAMENTO DI SINGOLE RIGHE ---
+
+    def patch_rows(self, changed_ids=(), deleted_ids=()):
+        """
+        Aggiorna solo le righe degli atleti indicati, senza rileggere la tabella: scorrimento,
+        selezione e ordinamento della vista restano invariati. Le righe modificate vengono
+        rilette con lo stesso filtro di ricerca e spostate dove le mette l'ordinamento.
+        Ritorna False se non è possibile (troppe righe, ordine per rilevanza della ricerca,
+        pagina in lettura): in quel caso il chiamante usa reload().
+        """
+        deleted = set(deleted_ids)
+        changed = set(changed_ids) - deleted
+        if (not self.columns or self._task is not None or self._suspended
+                or len(changed) + len(deleted) > PATCH_MAX_ROWS):
+            return False
+        order = self._order_positions()
+        if order is None and changed:
+            return False
+
+        for athlete_id in deleted:
+            self._remove_row(self._row_of(athlete_id))
+        if not changed:
+            return True
+
+        stmt = athlete_list_query([c["key"] for c in self.columns], self.search_text,
+                                  self.sort_key, self.sort_order == Qt.DescendingOrder, athlete_ids=changed)
+        session = get_session()
+        try:
+            fresh = {row[0]: tuple(row) for row in session.execute(stmt)}
+        finally:
+            session.close()
+
+        keys = [self._order_key(row, order) for row in self.rows]
+        for athlete_id in sorted(changed):
+            self._place_row(athlete_id, fresh.get(athlete_id), keys, order)
+        return True
+
+    def _order_positions(self):
+        """
+        Posizioni nella tupla delle colonne di ORDER BY di athlete_list_query;
+        None se l'ordine non si ricava dalle righe (rilevanza della ricerca full-text).
+        """
+        key = self.sort_key
+        if key and key != "id" and key in self._value_pos:
+            cols = [key] + SORT_TIEBREAKERS.get(key, [])
+            if any(c not in self._value_pos for c in cols):
+                return None
+            return [self._value_pos[c] for c in cols] + [0]
+        if use_fts(search_terms(self.search_text or "")):
+            return None
+        return [0]
+
+    def _order_key(self, row, order):
+        return tuple(sql_order_value(row[p]) for p in order)
+
+    def _row_of(self, athlete_id):
+        return next((i for i, row in enumerate(self.rows) if row[0] == athlete_id), None)
+
+    def _remove_row(self, pos, keys=None):
+        if pos is None:
+            return
+        self.beginRemoveRows(QModelIndex(), pos, pos)
+        del self.rows[pos]
+        if keys is not None:
+            del keys[pos]
+        self.endRemoveRows()
+
+    def _insert_pos(self, keys, key, skip=None):
+        """Posizione della riga nell'ordinamento corrente tra le righe caricate (esclusa 'skip')"""
+        descending = self.sort_order == Qt.DescendingOrder
+        lo, hi = 0, len(keys) - (skip is not None)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            other = keys[mid + 1 if skip is not None and mid >= skip else mid]
+            if (other < key) if descending else (other > key):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def _place_row(self, athlete_id, row, keys, order):
+        old = self._row_of(athlete_id)
+        if row is None:
+            # Atleta che non corrisponde più alla ricerca
+            self._remove_row(old, keys)
+            return
+        key = self._order_key(row, order)
+        target = self._insert_pos(keys, key, skip=old)
+        others = len(self.rows) - (old is not None)
+        if target == others and self._has_more:
+            # Cade oltre le righe lette: arriverà con le pagine successive
+            self._remove_row(old, keys)
+            return
+
+        if old is None:
+            self.beginInsertRows(QModelIndex(), target, target)
+            self.rows.insert(target, row)
+            keys.insert(target, key)
+            self.endInsertRows()
+            return
+        if target != old:
+            # beginMoveRows vuole la destinazione prima dello spostamento
+            self.beginMoveRows(QModelIndex(), old, old, QModelIndex(), target + 1 if target > old else target)
+            del self.rows[old]
+            del keys[old]
+            self.rows.insert(target, row)
+            keys.insert(target, key)
+            self.endMoveRows()
+        else:
+            self.rows[old] = row
+            keys[old] = key
+        self.dataChanged.emit(self.index(target, 0), self.index(target, len(self.columns) - 1))
+
+    def athlete_id(self, row):
+        if 0 <= row < len(self.rows):
+            return self.rows[row][0]
+        return None
+
+    def column_key(self, column):
+        if 0 <= column < len(self.columns):
+            return self.columns[column]["key"]
+        return None
+
+    # --- LETTURA DAL DATABASE ---
+
+    def is_loading(self):
+        return self._task is not None
+
+    def set_suspended(self, suspended):
+        """
+        Con suspended=True annulla la pagina in lettura e non legge altro dal database
+        finché non viene chiamato con False (poi serve set_query o reload).
+        """
+        self._suspended = suspended
+        if suspended:
+            self._cancel_pending()
+
+    def _cancel_pending(self):
+        self._generation += 1
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self.loadingChanged.emit(False)
+
+    def _page_query(self, offset):
+        stmt = athlete_list_query([c["key"] for c in self.columns], self.search_text,
+                                  self.sort_key, self.sort_order == Qt.DescendingOrder)
+        return stmt.offset(offset).limit(PAGE_SIZE)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return self._has_more and bool(self.columns) and self._task is None and not self._suspended
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._task is not None or self._suspended:
+            return
+        # Tuple semplici lette da un worker con la propria sessione: la GUI non si blocca
+        self._task = QueryTask(self._generation, self._page_query(len(self.rows)))
+        self._task.signals.finished.connect(self._on_page_loaded)
+        self._task.signals.failed.connect(self._on_page_failed)
+        self.loadingChanged.emit(True)
+        QThreadPool.globalInstance().start(self._task)
+
+    def _on_page_loaded(self, generation, page):
+        if generation != self._generation:
+            return  # Risultato di una ricerca superata
+        self._task = None
+        self.loadingChanged.emit(False)
+        self._has_more = len(page) == PAGE_SIZE
+        if not page:
+            return
+        first = len(self.rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(page) - 1)
+        self.rows.extend(page)
+        self.endInsertRows()
+
+    def _on_page_failed(self, generation, message):
+        if generation != self._generation:
+            return
+        self._task = None
+        self._has_more = False
+        self.loadingChanged.emit(False)
+        self.loadFailed.emit(message)
+
+    # --- INTERFACCIA QAbstractTableModel ---
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal and 0 <= section < len(self.columns):
+            return self.columns[section]["label"]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        key = self.columns[index.column()]["key"]
+
+        if role == Qt.DisplayRole:
+            if key == "id":
+                return str(index.row() + 1)
+            val = row[self._value_pos[key]]
+            if key == "scadenza":
+                return val.strftime("%d/%m/%Y") if val else "Assente"
+            return str(val if val is not None else "")
+
+        if role == Qt.UserRole and key == "id":
+            return row[0]
+
+        # Highlight Key Fields
+        if role == Qt.FontRole and key in ["name", "surname"]:
+            return self._bold_font
+
+        if role == Qt.ForegroundRole:
+            if key in ["name", "surname"]:
+                return QColor(Qt.cyan)
+            if key == "scadenza" and row[1]:
+                today = datetime.date.today()
+                if row[1] < today:
+                    return QColor(Qt.red)
+                elif row[1] < today + datetime.timedelta(days=30):
+                    return QColor(Qt.yellow)
+        return None
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        key = self.column_key(column)
+        if key is None:
+            return
+        self.sort_key = key
+        self.sort_order = order
+        self.refresh()
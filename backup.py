@@ -0,0 +1,227 @@
+"""
+Backup a caldo del database con l'API di backup online di SQLite (sqlite3.Connection.backup).
+
+La copia avviene a blocchi di pagine con una breve pausa tra un blocco e l'altro, così chi
+scrive nel frattempo (anche da altri PC) non resta bloccato. Ogni copia viene verificata,
+compressa con gzip e conservata nella cartella dei backup; restano solo le più recenti.
+Nessuna dipendenza da Qt: usato da workers.BackupWorker, cli.py e benchmark.py.
+"""
+import datetime
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import time
+from collections import namedtuple
+
+# Cartella predefinita, accanto al file del database: su una cartella condivisa i PC
+# vedono gli stessi backup e il backup pianificato viene fatto una volta sola
+BACKUP_DIR_NAME = "backup"
+
+BACKUP_PAGES = 256          # Pagine copiate per passo (1 MB con pagine da 4 KB)
+BACKUP_STEP_SLEEP = 0.005   # Pausa tra due passi: gli altri processi possono fare commit
+# Una scrittura da un'altra connessione fa ripartire la copia da capo: dopo queste
+# ripartenze si copia in un solo passo (in WAL è solo una lettura, chi scrive non aspetta)
+BACKUP_MAX_RESTARTS = 3
+# Senza WAL (profili rete/sicuro) un passo unico bloccherebbe chi scrive per tutta la copia:
+# si riprova a blocchi dopo una pausa (raddoppiata ad ogni tentativo), poi si rinuncia
+BACKUP_ATTEMPTS = 4
+BACKUP_RETRY_WAIT = 2.0
+BUSY_TIMEOUT = 15.0         # Secondi di attesa se il database è bloccato da un altro processo
+
+DEFAULT_RETENTION = 10      # Backup conservati per database
+DEFAULT_INTERVAL_HOURS = 24
+
+# Motivo della copia, riportato nel nome del file
+REASON_MANUAL = "manuale"
+REASON_SCHEDULED = "automatico"
+REASON_IMPORT = "pre-importazione"
+REASON_RESTORE = "pre-ripristino"
+
+# path: file .db.gz; size: byte compressi; db_size: byte del database copiato; duration: secondi
+BackupResult = namedtuple("BackupResult", "path size db_size duration reason")
+BackupInfo = namedtuple("BackupInfo", "path created reason size")
+
+_BACKUP_NAME = re.compile(r"^(?P<stem>.+)-(?P<ts>\d{8}-\d{6}-\d{6})-(?P<reason>[a-z-]+)\.db\.gz$")
+
+class BackupCancelled(Exception):
+    pass
+
+class BackupBusy(Exception):
+    """Database senza WAL modificato di continuo durante la copia: backup da ripetere più tardi"""
+
+class _TooManyRestarts(Exception):
+    pass
+
+def format_size(size):
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    return f"{size / 1024:.0f} KB"
+
+def backup_dir_for(db_path, backup_dir=None):
+    return backup_dir or os.path.join(os.path.dirname(os.path.abspath(db_path)), BACKUP_DIR_NAME)
+
+def _db_stem(db_path):
+    return os.path.splitext(os.path.basename(db_path))[0]
+
+def list_backups(db_path, backup_dir=None):
+    """Backup del database presenti nella cartella, dal più recente"""
+    folder = backup_dir_for(db_path, backup_dir)
+    if not os.path.isdir(folder):
+        return []
+    stem = _db_stem(db_path)
+    backups = []
+    for name in os.listdir(folder):
+        match = _BACKUP_NAME.match(name)
+        if not match or match["stem"] != stem:
+            continue
+        path = os.path.join(folder, name)
+        created = datetime.datetime.strptime(match["ts"], "%Y%m%d-%H%M%S-%f")
+        backups.append(BackupInfo(path, created, match["reason"], os.path.getsize(path)))
+    return sorted(backups, key=lambda b: b.created, reverse=True)
+
+def backup_due(db_path, interval_hours, backup_dir=None, now=None):
+    """True se il backup pianificato è attivo e l'ultimo backup (di qualunque tipo) è troppo vecchio"""
+    if not interval_hours:
+        return False
+    backups = list_backups(db_path, backup_dir)
+    now = now or datetime.datetime.now()
+    return not backups or now - backups[0].created >= datetime.timedelta(hours=interval_hours)
+
+def prune_backups(db_path, backup_dir=None, retention=DEFAULT_RETENTION):
+    """Elimina i backup oltre i 'retention' più recenti; ritorna i file eliminati"""
+    removed = []
+    for info in list_backups(db_path, backup_dir)[max(1, retention):]:
+        try:
+            os.remove(info.path)
+            removed.append(info.path)
+        except OSError:
+            pass  # In uso da un altro PC: verrà eliminato al prossimo giro
+    return removed
+
+def _copy_pages(src, dst, pages, progress=None, should_stop=None):
+    """
+    Copia src in dst a blocchi di pagine; ritorna il numero di ripartenze.
+    Se il database è modificato di continuo: in WAL copia in un solo passo, altrimenti
+    ritenta a blocchi (BACKUP_ATTEMPTS) e poi solleva BackupBusy.
+    """
+    wal = src.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+    restarts = 0
+    last_remaining = None
+
+    def step(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if should_stop and should_stop():
+            raise BackupCancelled()
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > BACKUP_MAX_RESTARTS * (attempt + 1):
+                raise _TooManyRestarts()
+        last_remaining = remaining
+        if progress:
+            progress(total - remaining, total)
+
+    for attempt in range(BACKUP_ATTEMPTS):
+        last_remaining = None
+        try:
+            src.backup(dst, pages=pages, progress=step, sleep=BACKUP_STEP_SLEEP)
+            return restarts
+        except _TooManyRestarts:
+            pass
+        if wal:
+            # Copia completa in un solo passo: in WAL è solo una lettura
+            src.backup(dst)
+            return restarts
+        if attempt + 1 < BACKUP_ATTEMPTS:
+            # Pausa per lasciar finire le scritture in corso, poi blocchi più grandi (meno passi)
+            deadline = time.monotonic() + BACKUP_RETRY_WAIT * 2 ** attempt
+            while time.monotonic() < deadline:
+                if should_stop and should_stop():
+                    raise BackupCancelled()
+                time.sleep(0.05)
+            pages *= 2
+    raise BackupBusy("Database modificato di continuo da altre postazioni durante la copia: backup rimandato.")
+
+def _check_copy(conn):
+    result = conn.execute("PRAGMA quick_check").fetchone()[0]
+    if result != "ok":
+        raise Exception(f"Copia del database non valida: {result}")
+
+def create_backup(db_path, backup_dir=None, reason=REASON_MANUAL, retention=DEFAULT_RETENTION,
+                  progress=None, should_stop=None, pages=BACKUP_PAGES):
+    """
+    Backup a caldo di db_path, anche con l'applicazione aperta: copia a blocchi di pagine,
+    verifica (quick_check), compressione gzip e rotazione dei backup più vecchi.
+    progress(pagine copiate, pagine totali) viene chiamata a ogni blocco; se should_stop()
+    ritorna True la copia si interrompe con BackupCancelled. Ritorna un BackupResult.
+    """
+    start = time.perf_counter()
+    folder = backup_dir_for(db_path, backup_dir)
+    os.makedirs(folder, exist_ok=True)
+    name = f"{_db_stem(db_path)}-{datetime.datetime.now():%Y%m%d-%H%M%S-%f}-{reason}.db"
+    path = os.path.join(folder, name + ".gz")
+    # File temporanei con estensioni diverse: list_backups non li vede mai
+    raw_path = os.path.join(folder, name + ".part")
+    gz_path = path + ".part"
+    try:
+        src = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+        dst = sqlite3.connect(raw_path)
+        try:
+            _copy_pages(src, dst, pages, progress, should_stop)
+            # File unico senza -wal: la copia si apre anche da sola
+            dst.execute("PRAGMA journal_mode=DELETE")
+            _check_copy(dst)
+        finally:
+            dst.close()
+            src.close()
+        db_size = os.path.getsize(raw_path)
+        with open(raw_path, "rb") as f, gzip.open(gz_path, "wb", compresslevel=6) as out:
+            shutil.copyfileobj(f, out, 1024 * 1024)
+        os.replace(gz_path, path)
+    finally:
+        for tmp in (raw_path, gz_path):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    prune_backups(db_path, backup_dir, retention)
+    return BackupResult(path, os.path.getsize(path), db_size, time.perf_counter() - start, reason)
+
+def restore_backup(backup_path, db_path, backup_dir=None, retention=DEFAULT_RETENTION):
+    """
+    Riporta db_path al contenuto di un backup, dopo averne fatto una copia di sicurezza
+    (REASON_RESTORE). Il database in uso viene sovrascritto con la stessa API di backup e non
+    sostituendo il file: niente problemi con i file -wal e con gli altri processi collegati.
+    Le connessioni dell'applicazione vanno chiuse prima e riaperte dopo con
+    DatabaseManager.initialize, che aggiorna lo schema se il backup è di una versione precedente.
+    Ritorna il BackupResult della copia di sicurezza.
+    """
+    folder = backup_dir_for(db_path, backup_dir)
+    os.makedirs(folder, exist_ok=True)
+    raw_path = os.path.join(folder, os.path.basename(backup_path) + ".restore")
+    try:
+        # Prima si estrae e verifica il backup: la rotazione della copia di sicurezza
+        # potrebbe eliminare proprio il file da ripristinare
+        with gzip.open(backup_path, "rb") as f, open(raw_path, "wb") as out:
+            shutil.copyfileobj(f, out, 1024 * 1024)
+        src = sqlite3.connect(raw_path)
+        try:
+            _check_copy(src)
+            safety = create_backup(db_path, backup_dir, REASON_RESTORE, retention)
+            dst = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+            try:
+                # Un solo passo: gli altri processi aspettano la fine invece di leggere dati a metà
+                src.backup(dst)
+                if dst.execute("SELECT 1 FROM sqlite_master WHERE name = 'sync_state'").fetchone():
+                    # Chi si è già sincronizzato con questa copia ne ricorda il contatore (più alto di
+                    # quello ripristinato): con una nuova identità le prossime modifiche non vengono
+                    # scambiate per già ricevute
+                    dst.execute("UPDATE sync_state SET replica_id = lower(hex(randomblob(16)))")
+                    dst.commit()
+            finally:
+                dst.close()
+        finally:
+            src.close()
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+    return safety
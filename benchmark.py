@@ -0,0 +1,905 @@
+"""
+Benchmark delle operazioni più pesanti del gestionale su un database di prova.
+
+Uso:
+    python benchmark.py athlete-list --athletes 5000
+    python benchmark.py query-plans
+    python benchmark.py pragma-profiles --athletes 20000
+    python benchmark.py import-prep --rows 50000
+    python benchmark.py cf-batch --codes 100000
+    python benchmark.py comuni-load
+    python benchmark.py comuni-prefix
+    python benchmark.py export --athletes 50000
+    python benchmark.py startup --budget-ms 1500
+    python benchmark.py sync --athletes 5000 50000 --changes 100
+    python benchmark.py row-refresh --athletes 50000 --loaded 2000
+    python benchmark.py backup --athletes 50000
+    python benchmark.py concurrency --writers 6 --writes 100
+"""
+import argparse
+import sys
+import datetime
+import os
+import random
+import tempfile
+import time
+from sqlalchemy import event, insert, select, text
+from database import DatabaseManager, Athlete, MedicalCertificate, get_session
+
+SURNAMES = ["Rossi", "Bianchi", "Verdi", "Neri", "Russo", "Ferrari", "Esposito", "Romano", "Colombo", "Ricci"]
+NAMES = ["Marco", "Giulia", "Luca", "Sara", "Andrea", "Chiara", "Matteo", "Elena", "Paolo", "Anna"]
+
+# Dimensione pagina di AthleteTableModel (evita di importare PySide6 qui)
+PAGE_SIZE = 200
+
+def remove_db(path):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def sample_athletes(count, seed=42):
+    rnd = random.Random(seed)
+    for i in range(1, count + 1):
+        yield rnd, {
+            "id": i,
+            "name": rnd.choice(NAMES),
+            "surname": f"{rnd.choice(SURNAMES)}{i}",
+            "tax_code": f"BNCHMK{i:010d}",
+            "phone": f"333{i:07d}",
+            "current_belt": rnd.choice(["Bianca", "Gialla", "Verde", "Blu", "Nera"]),
+            "notes": "Allenamento serale" if i % 7 == 0 else None,
+        }
+
+def create_sample_db(path, athletes, certs_per_athlete=2, seed=42, profile=None):
+    """Crea (sovrascrivendo) un database con atleti e certificati casuali"""
+    remove_db(path)
+    db = DatabaseManager()
+    db.initialize(path, profile)
+
+    today = datetime.date.today()
+    athlete_rows = []
+    cert_rows = []
+    for rnd, row in sample_athletes(athletes, seed):
+        athlete_rows.append(row)
+        i = row["id"]
+        for _ in range(rnd.randint(0, certs_per_athlete)):
+            cert_rows.append({
+                "athlete_id": i,
+                "cert_type": rnd.choice(["Agonistico", "Non Agonistico"]),
+                "expiry_date": today + datetime.timedelta(days=rnd.randint(-400, 400)),
+            })
+
+    with db.engine.begin() as conn:
+        conn.execute(insert(Athlete.__table__), athlete_rows)
+        if cert_rows:
+            conn.execute(insert(MedicalCertificate.__table__), cert_rows)
+    return db
+
+class QueryCounter:
+    """Conta le istruzioni SQL eseguite dal motore nel blocco with"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+def measure(engine, func):
+    """Esegue func e ritorna (secondi, numero di query)"""
+    with QueryCounter(engine) as counter:
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+    return elapsed, counter.count
+
+def print_results(title, results):
+    print(f"\n{title}")
+    width = max(len(name) for name, _, _ in results)
+    for name, elapsed, queries in results:
+        print(f"  {name.ljust(width)}  {elapsed * 1000:9.1f} ms  {queries:7d} query")
+
+# --- SCENARI ---
+
+def bench_athlete_list(args):
+    from queries import athlete_list_query
+
+    db = create_sample_db(args.db, args.athletes)
+    keys = ["id", "surname", "name", "current_belt", "current_rank", "scadenza"]
+
+    def legacy():
+        # Percorso originale di load_athletes: oggetti ORM + latest_certificate per riga
+        session = get_session()
+        for athlete in session.query(Athlete).all():
+            cert = athlete.latest_certificate
+            _ = cert.expiry_date if cert else None
+        session.close()
+
+    def full_list():
+        session = get_session()
+        session.execute(athlete_list_query(keys)).all()
+        session.close()
+
+    def first_page():
+        session = get_session()
+        session.execute(athlete_list_query(keys).limit(PAGE_SIZE)).all()
+        session.close()
+
+    results = [
+        ("ORM + latest_certificate", *measure(db.engine, legacy)),
+        ("Query Core (lista completa)", *measure(db.engine, full_list)),
+        (f"Query Core (prima pagina {PAGE_SIZE})", *measure(db.engine, first_page)),
+    ]
+    print_results(f"Lista atleti ({args.athletes} atleti)", results)
+
+def explain(engine, stmt):
+    """Dettagli di EXPLAIN QUERY PLAN per una query Core"""
+    sql = str(stmt.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        return [row[3] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql))]
+
+def bench_query_plans(args):
+    """Verifica che le query più frequenti usino gli indici gestiti (exit code 1 se no)"""
+    from queries import (athletes, certificates, athlete_list_query, certificate_list_query,
+                         dashboard_stats_query)
+
+    db = create_sample_db(args.db, args.athletes)
+    keys = ["id", "surname", "name", "scadenza"]
+    # (descrizione, query, indice atteso nel piano)
+    checks = [
+        ("Dashboard (aggregato)", dashboard_stats_query(), "ix_medical_certificates_expiry_type"),
+        ("Certificati entro 30 giorni", certificate_list_query(0), "ix_medical_certificates_expiry_type"),
+        ("Certificati scaduti", certificate_list_query(3), "ix_medical_certificates_expiry_type"),
+        ("Ultimo certificato per atleta (import)",
+         select(certificates).where(certificates.c.athlete_id == 1)
+         .order_by(certificates.c.expiry_date.desc()).limit(1),
+         "ix_medical_certificates_athlete_expiry"),
+        ("Lista atleti (scadenze in blocco)", athlete_list_query(keys).limit(PAGE_SIZE),
+         "ix_medical_certificates_athlete_expiry"),
+        ("Lista atleti per cognome", athlete_list_query(keys, sort_key="surname").limit(PAGE_SIZE),
+         "ix_athletes_surname_name"),
+        ("Lista atleti per cognome (desc)",
+         athlete_list_query(keys, sort_key="surname", descending=True).limit(PAGE_SIZE),
+         "ix_athletes_surname_name"),
+        ("Lista atleti per nome", athlete_list_query(keys, sort_key="name").limit(PAGE_SIZE),
+         "ix_athletes_name"),
+        ("Atleta per codice fiscale", select(athletes.c.id).where(athletes.c.tax_code == "X"),
+         "sqlite_autoindex_athletes_1"),
+    ]
+
+    failures = 0
+    for title, stmt, index_name in checks:
+        plan = explain(db.engine, stmt)
+        ok = any(index_name in line for line in plan) and not any("TEMP B-TREE FOR ORDER BY" in line for line in plan)
+        failures += not ok
+        print(f"[{'OK' if ok else 'FAIL'}] {title} -> {index_name}")
+        if not ok or args.verbose:
+            for line in plan:
+                print(f"       {line}")
+
+    print(f"\n{len(checks) - failures}/{len(checks)} query usano l'indice atteso.")
+    if failures:
+        sys.exit(1)
+
+def bench_pragma_profiles(args):
+    """Import (ORM, commit a blocchi) e caricamento lista per ogni profilo PRAGMA"""
+    from database import PRAGMA_PROFILES
+    from queries import athlete_list_query
+
+    keys = ["id", "surname", "name", "current_belt", "current_rank", "scadenza"]
+    today = datetime.date.today()
+    # Confronto con le impostazioni predefinite di SQLite (nessun PRAGMA)
+    profiles = {"predefinito SQLite": {}, **PRAGMA_PROFILES}
+    results = []
+    for name, pragmas in profiles.items():
+        remove_db(args.db)
+        db = DatabaseManager()
+        db.initialize(args.db, name, pragmas=pragmas)
+
+        def bulk_import():
+            # Come l'import da file: oggetti ORM, un commit ogni args.batch righe
+            session = get_session()
+            for n, (_, row) in enumerate(sample_athletes(args.athletes), 1):
+                row.pop("id")
+                athlete = Athlete(**row)
+                athlete.certificates.append(MedicalCertificate(
+                    cert_type="Agonistico", expiry_date=today + datetime.timedelta(days=n % 400)))
+                session.add(athlete)
+                if n % args.batch == 0:
+                    session.commit()
+            session.commit()
+            session.close()
+
+        def list_load():
+            session = get_session()
+            session.execute(athlete_list_query(keys, sort_key="surname")).all()
+            session.close()
+
+        import_time, _ = measure(db.engine, bulk_import)
+        list_time, _ = measure(db.engine, list_load)
+        results.append((name, import_time, list_time))
+        db.engine.dispose()
+
+    print(f"\nProfili PRAGMA ({args.athletes} atleti, commit ogni {args.batch} righe)")
+    width = max(len(name) for name, _, _ in results)
+    for name, import_time, list_time in results:
+        rate = args.athletes / import_time if import_time else 0
+        print(f"  {name.ljust(width)}  import {import_time * 1000:9.1f} ms ({rate:8.0f} righe/s)"
+              f"  lista {list_time * 1000:8.1f} ms")
+
+def legacy_parse_cf(cf):
+    """Vecchio cf_utils.parse_cf, un codice alla volta (senza controllo né omocodia)"""
+    if not cf or len(cf) != 16:
+        return None
+    try:
+        months = {'A': 1, 'B': 2, 'C': 3, 'D': 4, 'E': 5, 'H': 6,
+                  'L': 7, 'M': 8, 'P': 9, 'R': 10, 'S': 11, 'T': 12}
+        month = months.get(cf[8].upper())
+        if not month: return None
+        day_part = int(cf[9:11])
+        gender = "M"
+        if day_part > 40:
+            gender = "F"
+            day_part -= 40
+        year_part = int(cf[6:8])
+        year = 2000 + year_part if year_part <= datetime.date.today().year % 100 else 1900 + year_part
+        return {"birth_date": datetime.date(year, month, day_part), "gender": gender,
+                "comune_code": cf[11:15].upper()}
+    except Exception:
+        return None
+
+def legacy_prepare_row(row, mapping):
+    """Preparazione riga per riga come nel vecchio ImportDialog.start_import (iterrows)"""
+    import pandas as pd
+    from cf_utils import get_comune_name
+    row_data = {}
+    for key, col in mapping.items():
+        if pd.isna(row[col]): continue
+        val = row[col]
+        if key in ["birth_date", "cert_expiry"]:
+            if not isinstance(val, (datetime.date, datetime.datetime)):
+                try: val = pd.to_datetime(val).date()
+                except: pass
+        if key == "tax_code": val = str(val).strip().upper()
+        row_data[key] = val
+    if "tax_code" in row_data:
+        cf_data = legacy_parse_cf(row_data["tax_code"])
+        if cf_data:
+            if "birth_date" not in row_data or not row_data["birth_date"]:
+                row_data["birth_date"] = cf_data["birth_date"]
+            if "birth_place" not in row_data or not row_data["birth_place"]:
+                row_data["birth_place"] = get_comune_name(cf_data["comune_code"])
+    return row_data
+
+def sample_import_file(path, rows, seed=42):
+    """CSV di prova con codici fiscali plausibili e date in formati diversi"""
+    import csv
+    rnd = random.Random(seed)
+    months = "ABCDEHLMPRST"
+    comuni = ["H501", "F205", "L219", "F839", "A944", "D612", "G273", "Z999"]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Nome", "Cognome", "Codice Fiscale", "Data di Nascita", "Telefono",
+                         "Scadenza Certificato", "Tipo Certificato"])
+        for i in range(rows):
+            day = rnd.randint(1, 28) + (40 if rnd.random() < 0.5 else 0)
+            cf = f"{rnd.choice(SURNAMES)[:3].upper()}{rnd.choice(NAMES)[:3].upper()}{rnd.randint(0, 99):02d}" \
+                 f"{rnd.choice(months)}{day:02d}{rnd.choice(comuni)}X"
+            birth = "" if i % 3 else f"{rnd.randint(1950, 2015)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}"
+            expiry = datetime.date(2026, 1, 1) + datetime.timedelta(days=rnd.randint(0, 700))
+            expiry = expiry.isoformat() if i % 2 else expiry.strftime("%d/%m/%Y")
+            writer.writerow([rnd.choice(NAMES), rnd.choice(SURNAMES), cf.lower() if i % 5 == 0 else cf,
+                             birth, f"333{i:07d}", expiry, rnd.choice(["Agonistico", "Non Agonistico"])])
+
+def bench_import_prep(args):
+    """Preparazione righe dell'import: iterrows + parsing per valore contro prepare_chunk vettoriale"""
+    import pandas as pd
+    from importer import prepare_chunk
+
+    path = os.path.join(tempfile.gettempdir(), "gestionale_benchmark_import.csv")
+    sample_import_file(path, args.rows)
+    df = pd.read_csv(path, dtype=str)
+    mapping = {"name": "Nome", "surname": "Cognome", "tax_code": "Codice Fiscale",
+               "birth_date": "Data di Nascita", "phone": "Telefono",
+               "cert_expiry": "Scadenza Certificato", "cert_type": "Tipo Certificato"}
+
+    import warnings
+    start = time.perf_counter()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # pd.to_datetime per valore avvisa sui formati gg/mm/aaaa
+        legacy = [legacy_prepare_row(row, mapping) for _, row in df.iterrows()]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = prepare_chunk(df, mapping)
+    vector_time = time.perf_counter() - start
+
+    mismatches = sum(1 for a, b in zip(legacy, vectorized) if a != b)
+    print(f"\nPreparazione import ({args.rows} righe)")
+    print(f"  iterrows + parse per riga  {legacy_time * 1000:9.1f} ms")
+    print(f"  prepare_chunk vettoriale   {vector_time * 1000:9.1f} ms  ({legacy_time / vector_time:.1f}x)")
+    print(f"  righe diverse tra i due percorsi: {mismatches}")
+    if mismatches:
+        sys.exit(1)
+
+def sample_tax_codes(count, seed=42):
+    """Codici fiscali con carattere di controllo corretto; una parte omocodici, una parte alterati"""
+    from cf_utils import MONTH_CHARS, OMOCODE_CHARS, DIGIT_POSITIONS, ODD_VALUES
+    rnd = random.Random(seed)
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    comuni = ["H501", "F205", "L219", "F839", "A944", "D612", "G273", "Z404"]
+    def check_char(code):
+        total = sum(ODD_VALUES[c] for c in code[0::2])
+        total += sum(int(c) if c.isdigit() else ord(c) - ord('A') for c in code[1::2])
+        return chr(ord('A') + total % 26)
+    codes, kinds = [], []
+    for i in range(count):
+        code = list("".join(rnd.choice(letters) for _ in range(6)) + f"{rnd.randint(0, 99):02d}"
+                    + rnd.choice(MONTH_CHARS) + f"{rnd.randint(1, 28) + rnd.choice([0, 40]):02d}" + rnd.choice(comuni))
+        kind = "ok"
+        if i % 10 == 1:
+            # Omocodia: dalla posizione più a destra
+            for pos in reversed(DIGIT_POSITIONS[-rnd.randint(1, 3):]):
+                code[pos] = OMOCODE_CHARS[int(code[pos])]
+            kind = "omocodice"
+        code = "".join(code)
+        code += check_char(code)
+        if i % 10 == 2:
+            code = code[:15] + ("A" if code[15] != "A" else "B")
+            kind = "controllo errato"
+        elif i % 10 == 3:
+            code = code[:14]
+            kind = "troppo corto"
+        codes.append(code)
+        kinds.append(kind)
+    return codes, kinds
+
+def bench_cf_batch(args):
+    """Parsing dei codici fiscali: parse_cf per codice contro parse_cf_batch vettoriale"""
+    import numpy as np
+    from cf_utils import parse_cf_batch
+
+    codes, kinds = sample_tax_codes(args.codes)
+    start = time.perf_counter()
+    legacy = [legacy_parse_cf(c) for c in codes]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = parse_cf_batch(codes)
+    batch_time = time.perf_counter() - start
+
+    # Dove il vecchio parser decodificava, i campi devono coincidere
+    mismatches = 0
+    for i, old in enumerate(legacy):
+        if old is None or kinds[i] == "omocodice":
+            continue
+        if (old["birth_date"] != batch["birth_date"][i].astype(datetime.date)
+                or old["gender"] != batch["gender"][i] or old["comune_code"] != batch["comune_code"][i]):
+            mismatches += 1
+    expected_valid = np.array([k in ("ok", "omocodice") for k in kinds])
+    wrong_validity = int((batch["valid"] != expected_valid).sum())
+    omocodes = [i for i, k in enumerate(kinds) if k == "omocodice"]
+    omocodes_decoded = int(sum(not np.isnat(batch["birth_date"][i]) for i in omocodes))
+
+    print(f"\nParsing codici fiscali ({args.codes} codici)")
+    print(f"  parse_cf per codice        {legacy_time * 1000:9.1f} ms")
+    print(f"  parse_cf_batch vettoriale  {batch_time * 1000:9.1f} ms  ({legacy_time / batch_time:.1f}x)")
+    print(f"  validi: {int(batch['valid'].sum())}, omocodici decodificati: {omocodes_decoded}/{len(omocodes)}")
+    print(f"  campi diversi dal vecchio parser: {mismatches}, validità errata: {wrong_validity}")
+    if mismatches or wrong_validity or omocodes_decoded != len(omocodes):
+        sys.exit(1)
+
+def bench_comuni_load(args):
+    """Caricamento comuni: json.load in un dizionario contro archivio compatto comuni.bin"""
+    import json
+    import tracemalloc
+    import cf_utils
+
+    def load_json():
+        with open(cf_utils.COMUNI_JSON, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def load_store():
+        cf_utils._comuni_store = None
+        store = cf_utils.load_comuni_store()
+        store.get("H501")  # Primo accesso: include la decodifica dei nomi
+        return store
+
+    if not os.path.exists(cf_utils.COMUNI_STORE):
+        print("Archivio comuni.bin assente: eseguire 'python setup_comuni.py --file comuni_map.json'.")
+        sys.exit(1)
+
+    print(f"\nCaricamento comuni ({args.repeat} ripetizioni)")
+    print(f"  {'metodo':<24} {'tempo medio':>12} {'memoria':>10}")
+    for label, loader in [("json.load (dizionario)", load_json), ("comuni.bin (compatto)", load_store)]:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            loader()
+        elapsed = (time.perf_counter() - start) / args.repeat
+        tracemalloc.start()
+        data = loader()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"  {label:<24} {elapsed * 1000:9.2f} ms {memory / 1024:7.0f} KB")
+        del data
+
+    # Ricerca di un blocco di codici (come nell'importazione)
+    comuni = load_json()
+    codes = [random.Random(i).choice(list(comuni)) for i in range(2000)] * 50
+    start = time.perf_counter()
+    by_dict = [comuni.get(c, c) for c in codes]
+    dict_time = time.perf_counter() - start
+    start = time.perf_counter()
+    by_store = cf_utils.get_comune_names(codes)
+    store_time = time.perf_counter() - start
+    print(f"\n  {len(codes)} ricerche: dizionario {dict_time * 1000:.1f} ms, archivio {store_time * 1000:.1f} ms"
+          f", risultati uguali: {list(by_store) == by_dict}")
+
+def bench_comuni_prefix(args):
+    """Completamento del luogo di nascita: scansione di tutti i nomi contro indice per prefisso"""
+    import cf_utils
+
+    start = time.perf_counter()
+    index = cf_utils.ComuniPrefixIndex(cf_utils.load_comuni_store())
+    build_time = time.perf_counter() - start
+
+    # Sequenze di tasti come nel campo Luogo di Nascita
+    rnd = random.Random(42)
+    typed = [name[:n] for name in rnd.sample(index.names, 200) for n in range(1, min(len(name), 8) + 1)]
+    names = list(index.names)
+    start = time.perf_counter()
+    scanned = [[n for n in names if cf_utils.normalize_comune_name(n).startswith(cf_utils.normalize_comune_name(t))][:20]
+               for t in typed[:args.scan]]
+    scan_time = (time.perf_counter() - start) / len(scanned)
+    start = time.perf_counter()
+    indexed = [index.complete(t) for t in typed]
+    index_time = (time.perf_counter() - start) / len(typed)
+
+    same = all(a == b for a, b in zip(scanned, indexed))
+    print(f"\nCompletamento comuni ({len(names)} nomi, {len(typed)} tasti)")
+    print(f"  costruzione indice        {build_time * 1000:8.1f} ms (una volta)")
+    print(f"  scansione lineare         {scan_time * 1e6:8.1f} us per tasto")
+    print(f"  indice per prefisso       {index_time * 1e6:8.1f} us per tasto, risultati uguali: {same}")
+    if not same:
+        sys.exit(1)
+
+def bench_export(args):
+    """Esportazione lista atleti: fetchall + scrittura contro streaming con yield_per (memoria di picco)"""
+    import tracemalloc
+    from exporter import athlete_export, run_export, write_csv, write_xlsx
+
+    create_sample_db(args.db, args.athletes)
+    keys = [c["key"] for c in __import__("queries").ATHLETE_COLUMNS]
+    spec = athlete_export(keys)
+    out_dir = tempfile.gettempdir()
+
+    def fetch_all(path, writer):
+        session = get_session()
+        try:
+            rows = session.execute(spec.stmt).all()
+            writer(path, spec, [spec.convert(i, r) for i, r in enumerate(rows, start=1)])
+        finally:
+            session.close()
+
+    def streamed(path, writer):
+        session = get_session()
+        try:
+            run_export(session, path, spec)
+        finally:
+            session.close()
+
+    print(f"\nEsportazione lista atleti ({args.athletes} atleti, {len(keys)} colonne)")
+    print(f"  {'metodo':<28} {'tempo':>10} {'memoria di picco':>18}")
+    for ext, writer in [(".csv", write_csv), (".xlsx", write_xlsx)]:
+        path = os.path.join(out_dir, "gestionale_benchmark_export" + ext)
+        for label, func in [("fetchall" + ext, fetch_all), ("yield_per" + ext, streamed)]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            func(path, writer)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  {label:<28} {elapsed * 1000:7.0f} ms {peak / 1024 / 1024:15.1f} MB")
+        os.remove(path)
+
+def bench_startup(args):
+    """Avvio a freddo (nuovo processo) fino alla prima visualizzazione; esce con 1 oltre il budget"""
+    import statistics
+    # Senza display la finestra viene disegnata fuori schermo
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from main import measure_startup, STARTUP_BUDGET_MS
+
+    create_sample_db(args.db, args.athletes)
+    budget = args.budget_ms or STARTUP_BUDGET_MS
+    # Primo avvio non misurato: genera bytecode e cache del tema come dopo l'installazione
+    measure_startup(args.db)
+
+    print(f"\nAvvio a freddo fino alla prima visualizzazione ({args.repeat} avvii, {args.athletes} atleti)")
+    times = []
+    heavy_loaded = set()
+    for i in range(args.repeat):
+        wall, in_process, modules = measure_startup(args.db)
+        times.append(wall)
+        heavy_loaded |= {name for name, _ in modules if name.split(".")[0] in ("pandas", "numpy", "openpyxl", "cf_utils")}
+        print(f"  avvio {i + 1}: {wall:6.0f} ms")
+    median = statistics.median(times)
+    print(f"  mediana: {median:.0f} ms (budget {budget} ms)")
+
+    if heavy_loaded:
+        print(f"ERRORE: moduli pesanti importati all'avvio: {', '.join(sorted(heavy_loaded))}")
+        sys.exit(1)
+    if median > budget:
+        print(f"ERRORE: avvio oltre il budget di {median - budget:.0f} ms")
+        sys.exit(1)
+
+def bench_sync(args):
+    """Sincronizzazione incrementale: il tempo dipende dalle righe modificate, non dagli atleti totali"""
+    import sync
+
+    print(f"\nSincronizzazione con una copia remota ({args.changes} atleti modificati per giro)")
+    print(f"  {'atleti':>8} {'prima (completa)':>18} {'incrementale':>14} {'nessuna modifica':>18}")
+    for count in args.athletes:
+        db = create_sample_db(args.db, count)
+        remote_path = args.db + ".remote"
+        remove_db(remote_path)
+        remote = sync.SqliteRemote(remote_path)
+
+        def run():
+            start = time.perf_counter()
+            result = sync.synchronize(remote, strategy=sync.STRATEGY_OVERWRITE_ALL)
+            return time.perf_counter() - start, result
+
+        full, _ = run()
+        ids = random.Random(1).sample(range(1, count + 1), min(args.changes, count))
+        with db.engine.begin() as conn:
+            conn.execute(text("UPDATE athletes SET phone = :phone WHERE id = :id"),
+                         [{"phone": f"33{i:08d}", "id": i} for i in ids])
+        incremental, result = run()
+        idle, _ = run()
+        remote.dispose()
+        remove_db(remote_path)
+        if result["sent"] != len(ids):
+            print(f"ERRORE: inviate {result['sent']} righe invece di {len(ids)}")
+            sys.exit(1)
+        print(f"  {count:>8} {full * 1000:15.0f} ms {incremental * 1000:11.1f} ms {idle * 1000:15.1f} ms")
+
+def bench_row_refresh(args):
+    """Dopo la modifica di un atleta: rilettura completa della tabella contro aggiornamento della riga"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtCore import QCoreApplication, QThreadPool
+    from athlete_model import AthleteTableModel
+    from queries import ATHLETE_COLUMNS, DEFAULT_VISIBLE_COLUMNS
+    import stats
+
+    app = QCoreApplication.instance() or QCoreApplication([])
+    db = create_sample_db(args.db, args.athletes)
+    model = AthleteTableModel()
+    columns = [c for c in ATHLETE_COLUMNS if c["key"] in DEFAULT_VISIBLE_COLUMNS]
+
+    def wait():
+        while model.is_loading():
+            QThreadPool.globalInstance().waitForDone()
+            app.processEvents()
+
+    def load(count):
+        model.set_query(columns)
+        wait()
+        while len(model.rows) < count and model.canFetchMore():
+            model.fetchMore()
+            wait()
+
+    load(args.loaded)
+    rng = random.Random(1)
+    full_times, patch_times = [], []
+    for i in range(args.repeat):
+        athlete_id = rng.choice(model.rows)[0]
+        before = stats.athlete_snapshot([athlete_id])
+        with db.engine.begin() as conn:
+            conn.execute(text("UPDATE athletes SET current_rank = :rank WHERE id = :id"),
+                         {"rank": f"{i + 1} kyu", "id": athlete_id})
+
+        start = time.perf_counter()
+        model.patch_rows([athlete_id])
+        after = stats.athlete_snapshot([athlete_id])
+        stats.adjust_dashboard_stats(before, after, stats.snapshot_cursor(before, after))
+        stats.get_dashboard_stats()
+        patch_times.append(time.perf_counter() - start)
+        patched = list(model.rows)
+
+        start = time.perf_counter()
+        load(len(patched))
+        stats.invalidate_stats()
+        stats.get_dashboard_stats()
+        full_times.append(time.perf_counter() - start)
+        if model.rows != patched:
+            print("ERRORE: le righe aggiornate non coincidono con la rilettura completa")
+            sys.exit(1)
+
+    print(f"\nModifica di un atleta con {len(model.rows)} righe caricate su {args.athletes} (mediana di {args.repeat})")
+    print(f"  {'rilettura completa (load_athletes + load_stats)'.ljust(48)} {sorted(full_times)[len(full_times) // 2] * 1000:8.1f} ms")
+    print(f"  {'aggiornamento della riga e contatori per delta'.ljust(48)} {sorted(patch_times)[len(patch_times) // 2] * 1000:8.1f} ms")
+
+def bench_backup(args):
+    """Backup a caldo: durata, dimensione e attesa di chi scrive mentre la copia è in corso"""
+    import shutil
+    import sqlite3
+    import threading
+    import backup
+
+    create_sample_db(args.db, args.athletes).engine.dispose()
+    backup_dir = args.db + ".backup"
+    shutil.rmtree(backup_dir, ignore_errors=True)
+
+    def writer_latencies(action):
+        """Commit di un altro processo (connessione separata) ogni 5 ms mentre gira action()"""
+        latencies, stop = [], threading.Event()
+
+        def write():
+            conn = sqlite3.connect(args.db, timeout=30)
+            i = 0
+            while not stop.is_set():
+                start = time.perf_counter()
+                conn.execute("UPDATE athletes SET phone = ? WHERE id = ?", (f"33{i:08d}", i % args.athletes + 1))
+                conn.commit()
+                latencies.append(time.perf_counter() - start)
+                i += 1
+                time.sleep(0.005)
+            conn.close()
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        try:
+            result = action()
+        finally:
+            stop.set()
+            thread.join()
+        return result, latencies
+
+    def report(name, latencies):
+        latencies = sorted(latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"  {name.ljust(34)} {len(latencies):6d} commit  p99 {p99 * 1000:6.1f} ms  max {latencies[-1] * 1000:7.1f} ms")
+
+    _, idle = writer_latencies(lambda: time.sleep(1.0))
+    result, during = writer_latencies(lambda: backup.create_backup(args.db, backup_dir, backup.REASON_MANUAL))
+    print(f"\nBackup a caldo di {args.athletes} atleti")
+    print(f"  durata {result.duration:.2f} s, database {backup.format_size(result.db_size)}, "
+          f"compresso {backup.format_size(result.size)} ({result.size / result.db_size:.0%})")
+    print("\nAttesa di chi scrive (commit ogni 5 ms da un'altra connessione)")
+    report("senza backup (1 s)", idle)
+    report("durante il backup", during)
+    shutil.rmtree(backup_dir, ignore_errors=True)
+
+def _concurrency_writer(task):
+    """
+    Processo scrittore di bench_concurrency: legge il contatore (notes) di un atleta,
+    attende come un utente con la scheda aperta e salva il valore + 1: con una sessione
+    semplice, come la scheda atleta (athlete_for_update) o come l'importazione (write_plan).
+    Ritorna i contatori del processo.
+    """
+    import contextlib
+    import io
+    from sqlalchemy import update
+    from sqlalchemy.exc import OperationalError
+    from database import (ConcurrentUpdateError, is_busy_error, write_transaction,
+                          athlete_versions, athlete_for_update)
+    import importer
+
+    db_path, profile, busy_ms, mode, writes, hot, think, start_at, seed = task
+    with contextlib.redirect_stdout(io.StringIO()):
+        db = DatabaseManager()
+        db.initialize(db_path, profile)
+    if busy_ms is not None:
+        # busy_timeout più corto del profilo: mette alla prova i nuovi tentativi di write_transaction
+        db.engine.dispose()
+        event.listen(db.engine, "connect", lambda conn, record: conn.execute(f"PRAGMA busy_timeout={busy_ms}"))
+    rnd = random.Random(seed)
+    stats = {"commits": 0, "busy": 0, "conflicts": 0, "retries": 0, "latencies": []}
+
+    def count_begin(conn, cursor, statement, *args):
+        # Ogni BEGIN IMMEDIATE oltre il primo di una write_transaction è un nuovo tentativo
+        if statement == "BEGIN IMMEDIATE":
+            stats["retries"] += 1
+    event.listen(db.engine, "before_cursor_execute", count_begin)
+    time.sleep(max(0.0, start_at - time.time()))  # Tutti i processi partono insieme
+
+    def naive(session, athlete_id):
+        # Sessione semplice: nessun controllo di versione né nuovi tentativi
+        value = session.execute(select(Athlete.notes).where(Athlete.id == athlete_id)).scalar()
+        time.sleep(think)
+        start = time.perf_counter()
+        session.execute(update(Athlete.__table__).where(Athlete.id == athlete_id)
+                        .values(notes=str(int(value) + 1)))
+        session.commit()
+        return start
+
+    def protected(session, athlete_id):
+        # Come AthleteDialog.write_athlete: versioni lette all'apertura, controllate nella
+        # transazione di scrittura; in caso di conflitto si ricarica e si ripete
+        while True:
+            athlete = session.get(Athlete, athlete_id)
+            loaded_versions, value = athlete_versions(athlete), athlete.notes
+            session.close()
+            time.sleep(think)
+            start = time.perf_counter()
+
+            def write():
+                athlete_for_update(session, athlete_id, loaded_versions).notes = str(int(value) + 1)
+
+            stats["retries"] -= 1
+            try:
+                write_transaction(session, write)
+                return start
+            except ConcurrentUpdateError:
+                stats["conflicts"] += 1
+                session.close()
+
+    def imported(session, athlete_id):
+        # Come run_import per un blocco di una riga: le righe degli atleti cambiati dopo
+        # la lettura vengono saltate da write_plan; si rilegge e si ripete
+        tax_code = session.execute(select(Athlete.tax_code).where(Athlete.id == athlete_id)).scalar()
+        while True:
+            existing = importer.fetch_existing_athletes(session, [tax_code])
+            current = existing[tax_code]
+            rows = [{"tax_code": tax_code, "name": current.name, "surname": current.surname,
+                     "notes": str(int(current.notes) + 1)}]
+            plan = importer.plan_rows(rows, existing, importer.find_conflicts(rows, existing),
+                                      importer.STRATEGY_OVERWRITE_ALL)
+            session.rollback()
+            time.sleep(think)
+            start = time.perf_counter()
+            stats["retries"] -= 1
+            result = write_transaction(session, lambda: importer.write_plan(session, plan, existing))
+            if result["imported"]:
+                return start
+            stats["conflicts"] += 1
+
+    modes = {"ingenuo": naive, "protetto": protected, "import": imported}
+    for _ in range(writes):
+        athlete_id = rnd.randint(1, hot)
+        session = db.get_session()
+        try:
+            start = modes[mode](session, athlete_id)
+            stats["commits"] += 1
+            stats["latencies"].append(time.perf_counter() - start)
+        except OperationalError as e:
+            # Database ancora occupato (in lettura o dopo i tentativi): modifica non salvata
+            session.rollback()
+            if not is_busy_error(e):
+                raise
+            stats["busy"] += 1
+        finally:
+            session.close()
+    db.engine.dispose()
+    return stats
+
+def bench_concurrency(args):
+    """Più processi che modificano gli stessi atleti: sessioni semplici contro blocco ottimistico"""
+    import multiprocessing
+
+    hot = min(args.hot, args.athletes)
+    db = create_sample_db(args.db, args.athletes, profile=args.profile)
+    context = multiprocessing.get_context("spawn")
+    think = args.think_ms / 1000
+
+    print(f"\nScritture concorrenti: {args.writers} processi x {args.writes} modifiche "
+          f"su {hot} atleti (profilo {args.profile}, attesa {args.think_ms} ms tra lettura e scrittura)")
+    print(f"  {'modalità'.ljust(9)} {'commit':>7} {'persi':>6} {'conflitti':>9} {'tentativi':>9} "
+          f"{'busy':>5} {'p50':>8} {'p99':>8} {'totale':>8}")
+    failures = []
+    for mode in ("ingenuo", "protetto", "import"):
+        with db.engine.begin() as conn:
+            conn.execute(text("UPDATE athletes SET notes = '0' WHERE id <= :hot"), {"hot": hot})
+        db.engine.dispose()  # Nessuna connessione aperta da questo processo durante la prova
+
+        start_at = time.time() + 1.0
+        tasks = [(args.db, args.profile, args.busy_ms, mode, args.writes, hot, think, start_at, seed)
+                 for seed in range(args.writers)]
+        with context.Pool(args.writers) as pool:
+            results = pool.map(_concurrency_writer, tasks)
+        elapsed = time.time() - start_at
+
+        with db.engine.connect() as conn:
+            total = conn.execute(text("SELECT sum(CAST(notes AS INTEGER)) FROM athletes WHERE id <= :hot"),
+                                 {"hot": hot}).scalar()
+        commits = sum(r["commits"] for r in results)
+        latencies = sorted(x for r in results for x in r["latencies"]) or [0.0]
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        # Modifiche confermate dal commit ma sovrascritte da un'altra postazione
+        lost = commits - total
+        print(f"  {mode.ljust(9)} {commits:7d} {lost:6d} {sum(r['conflicts'] for r in results):9d} "
+              f"{sum(r['retries'] for r in results):9d} {sum(r['busy'] for r in results):5d} "
+              f"{p50 * 1000:6.1f} ms {p99 * 1000:6.1f} ms {elapsed:6.2f} s")
+        busy = sum(r["busy"] for r in results)
+        if mode != "ingenuo" and (lost or busy):
+            failures.append(f"{mode}: {lost} modifiche perse, {busy} non salvate (database occupato)")
+
+    if failures:
+        for failure in failures:
+            print(f"ERRORE: {failure}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Gestionale Karate")
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "gestionale_benchmark.db"),
+                        help="File database di prova (viene sovrascritto)")
+    sub = parser.add_subparsers(dest="scenario", required=True)
+
+    p = sub.add_parser("athlete-list", help="Lista atleti: ORM + N+1 contro query Core")
+    p.add_argument("--athletes", type=int, default=5000)
+    p.set_defaults(func=bench_athlete_list)
+
+    p = sub.add_parser("query-plans", help="Verifica con EXPLAIN QUERY PLAN l'uso degli indici")
+    p.add_argument("--athletes", type=int, default=2000)
+    p.add_argument("-v", "--verbose", action="store_true", help="Mostra sempre il piano completo")
+    p.set_defaults(func=bench_query_plans)
+
+    p = sub.add_parser("pragma-profiles", help="Effetto dei profili PRAGMA su import e lista")
+    p.add_argument("--athletes", type=int, default=20000)
+    p.add_argument("--batch", type=int, default=100, help="Righe per commit durante l'import")
+    p.set_defaults(func=bench_pragma_profiles)
+
+    p = sub.add_parser("import-prep", help="Preparazione righe import: per riga contro vettoriale")
+    p.add_argument("--rows", type=int, default=50000)
+    p.set_defaults(func=bench_import_prep)
+
+    p = sub.add_parser("cf-batch", help="Parsing codici fiscali: per codice contro vettoriale")
+    p.add_argument("--codes", type=int, default=100000)
+    p.set_defaults(func=bench_cf_batch)
+
+    p = sub.add_parser("comuni-load", help="Caricamento comuni: JSON contro archivio compatto")
+    p.add_argument("--repeat", type=int, default=20)
+    p.set_defaults(func=bench_comuni_load)
+
+    p = sub.add_parser("comuni-prefix", help="Completamento comuni: scansione contro indice per prefisso")
+    p.add_argument("--scan", type=int, default=100, help="Tasti misurati con la scansione lineare (lenta)")
+    p.set_defaults(func=bench_comuni_prefix)
+
+    p = sub.add_parser("export", help="Esportazione: fetchall contro streaming (memoria)")
+    p.add_argument("--athletes", type=int, default=50000)
+    p.set_defaults(func=bench_export)
+
+    p = sub.add_parser("startup", help="Tempo di avvio a freddo contro il budget")
+    p.add_argument("--athletes", type=int, default=5000)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--budget-ms", type=int, help="Budget in millisecondi (predefinito: main.STARTUP_BUDGET_MS)")
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser("sync", help="Sincronizzazione: completa contro incrementale")
+    p.add_argument("--athletes", type=int, nargs="+", default=[5000, 50000])
+    p.add_argument("--changes", type=int, default=100)
+    p.set_defaults(func=bench_sync)
+
+    p = sub.add_parser("row-refresh", help="Dopo una modifica: rilettura completa contro riga aggiornata")
+    p.add_argument("--athletes", type=int, default=50000)
+    p.add_argument("--loaded", type=int, default=2000, help="Righe già caricate nella vista")
+    p.add_argument("--repeat", type=int, default=9)
+    p.set_defaults(func=bench_row_refresh)
+
+    p = sub.add_parser("backup", help="Backup a caldo: durata, dimensione e attesa degli scrittori")
+    p.add_argument("--athletes", type=int, default=50000)
+    p.set_defaults(func=bench_backup)
+
+    p = sub.add_parser("concurrency", help="Più processi scrittori sullo stesso file: modifiche perse e attese")
+    p.add_argument("--athletes", type=int, default=1000)
+    p.add_argument("--hot", type=int, default=10, help="Atleti modificati da tutti i processi")
+    p.add_argument("--writers", type=int, default=6, help="Processi scrittori")
+    p.add_argument("--writes", type=int, default=100, help="Modifiche per processo")
+    p.add_argument("--think-ms", type=float, default=2.0, help="Attesa tra lettura e scrittura")
+    p.add_argument("--profile", default="rete", help="Profilo PRAGMA (rete = cartella condivisa)")
+    p.add_argument("--busy-ms", type=int, help="busy_timeout al posto di quello del profilo")
+    p.set_defaults(func=bench_concurrency)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
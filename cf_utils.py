@@ -1,90 +1,397 @@
 import datetime
 import json
 import os
+import struct
+import unicodedata
+from bisect import bisect_left
+import numpy as np
 
-# Globale per memorizzare la mappatura dei comuni carichi dal file JSON
+# --- ARCHIVIO COMUNI ---
+
+COMUNI_JSON = os.path.join(os.path.dirname(__file__), 'comuni_map.json')
+COMUNI_STORE = os.path.join(os.path.dirname(__file__), 'comuni.bin')
+
+# Formato compatto generato da setup_comuni.py, un record per periodo di validità:
+# intestazione (magic, versione, numero record), codici catastali da 4 byte,
+# inizio e fine validità (int32, giorni ordinali), offset di fine di ogni nome (uint32),
+# nomi UTF-8 concatenati. I record sono ordinati per codice e inizio validità.
+STORE_MAGIC = b"COMU"
+STORE_VERSION = 2
+STORE_HEADER = struct.Struct("<4sHI")
+
+# Estremi aperti dei periodi di validità (ordinali di datetime.date)
+OPEN_START = 0
+OPEN_END = datetime.date.max.toordinal()
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# Usati se né l'archivio né il file JSON sono disponibili
+FALLBACK_COMUNI = {
+    "H501": "ROMA",
+    "F205": "MILANO",
+    "L219": "TORINO",
+    "F839": "NAPOLI",
+    "A944": "BOLOGNA",
+    "D612": "FIRENZE",
+    "B157": "BRESCIA",
+    "H575": "SASSARI",
+    "G273": "PALERMO",
+    "D969": "GENOVA",
+    "G388": "PAVIA"
+}
+
+class ComuniStore:
+    """
+    Tabella dei comuni in sola lettura: ricerca binaria (searchsorted) su codice e
+    inizio validità; ogni nome viene decodificato solo quando richiesto.
+    Un codice può avere più periodi (comuni rinominati, soppressi o fusi).
+    """
+
+    def __init__(self, codes, valid_from, valid_to, ends, names_blob):
+        self.codes = codes            # array NumPy 'S4'
+        self.valid_from = valid_from  # array int32 di ordinali
+        self.valid_to = valid_to
+        self.ends = ends              # array uint32: fine del nome i-esimo nel blob
+        self.names_blob = names_blob
+        self._table = None
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, count = STORE_HEADER.unpack_from(data)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError(f"Formato archivio comuni non riconosciuto (versione {version})")
+        start = STORE_HEADER.size
+        arrays = []
+        for dtype in ("S4", "<i4", "<i4", "<u4"):
+            arrays.append(np.frombuffer(data, dtype=dtype, count=count, offset=start))
+            start += 4 * count
+        return cls(*arrays, data[start:])
+
+    @classmethod
+    def from_records(cls, records):
+        """records: tuple (codice, inizio, fine, nome) con inizio/fine ordinali"""
+        items = sorted((code.upper(), start, end, name) for code, start, end, name in records)
+        names = [name.encode("utf-8") for *_, name in items]
+        return cls(np.array([i[0] for i in items], dtype="S4"),
+                   np.array([i[1] for i in items], dtype="<i4"),
+                   np.array([i[2] for i in items], dtype="<i4"),
+                   np.cumsum([len(n) for n in names], dtype="<u4") if names else np.zeros(0, "<u4"),
+                   b"".join(names))
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """Solo comuni attuali (es. comuni_map.json): validità senza estremi"""
+        return cls.from_records((code, OPEN_START, OPEN_END, name) for code, name in mapping.items())
+
+    def to_bytes(self):
+        return (STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, len(self.codes))
+                + self.codes.tobytes() + self.valid_from.astype("<i4").tobytes()
+                + self.valid_to.astype("<i4").tobytes() + self.ends.astype("<u4").tobytes() + self.names_blob)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def name_at(self, i):
+        start = int(self.ends[i - 1]) if i else 0
+        return self.names_blob[start:int(self.ends[i])].decode("utf-8")
+
+    def records(self):
+        """Tutti i record come tuple (codice, inizio, fine, nome)"""
+        ends = self.ends.tolist()
+        blob = self.names_blob
+        return [(code.decode("ascii"), start, end, blob[begin:stop].decode("utf-8"))
+                for code, start, end, begin, stop in zip(self.codes.tolist(), self.valid_from.tolist(),
+                                                         self.valid_to.tolist(), [0] + ends[:-1], ends)]
+
+    @staticmethod
+    def _keys(codes):
+        """
+        Codici come interi a 32 bit (4 caratteri ASCII big-endian): stesso ordinamento
+        dei codici in byte, ma il confronto su interi è molto più rapido.
+        """
+        chars = np.asarray(codes, dtype="U4").view(np.uint32).reshape(-1, 4)
+        chars = np.where((chars >= ord('a')) & (chars <= ord('z')), chars - 32, chars)
+        chars = np.where(chars > 127, ord('?'), chars).astype(np.uint64)
+        return (chars[:, 0] << 24) | (chars[:, 1] << 16) | (chars[:, 2] << 8) | chars[:, 3]
+
+    @staticmethod
+    def _ordinals(as_of, count):
+        """Date di riferimento come ordinali; None/NaT = periodo più recente"""
+        if as_of is None:
+            return np.full(count, OPEN_END, dtype=np.uint64)
+        if isinstance(as_of, datetime.date):
+            return np.full(count, as_of.toordinal(), dtype=np.uint64)
+        days = np.asarray(as_of).astype("datetime64[D]")
+        ordinals = days.astype(np.int64) + EPOCH_ORDINAL
+        ordinals[np.isnat(days)] = OPEN_END
+        return ordinals.astype(np.uint64)
+
+    def _find(self, keys, as_of=None):
+        """Record valido alla data per ogni chiave e maschera delle chiavi presenti"""
+        if not len(self.codes):
+            return np.zeros(len(keys), dtype=np.intp), np.zeros(len(keys), dtype=bool)
+        if self._table is None:
+            # Chiave composta (codice, inizio validità), già ordinata come i record
+            self._table = (self.codes.view(">u4").astype(np.uint64) << 32) | self.valid_from.astype(np.uint64)
+        codes = self._table >> 32
+        # Ultimo periodo iniziato entro la data; se la data precede tutti i periodi, il primo
+        idx = np.searchsorted(self._table, (keys << 32) | self._ordinals(as_of, len(keys)), "right") - 1
+        first = np.minimum(np.searchsorted(self._table, keys << 32), len(self._table) - 1)
+        idx = np.where((idx >= 0) & (codes[np.maximum(idx, 0)] == keys), idx, first)
+        return idx, codes[idx] == keys
+
+    def get(self, code, default=None, as_of=None):
+        idx, found = self._find(self._keys([code]), as_of)
+        return self.name_at(int(idx[0])) if found[0] else default
+
+    def lookup(self, codes, as_of=None):
+        """
+        Nomi per un array di codici in un solo searchsorted; None dove il codice non esiste.
+        as_of: data (o array di date allineato ai codici) a cui risolvere il nome.
+        """
+        idx, found = self._find(self._keys(codes), as_of)
+        names = np.full(len(idx), None, dtype=object)
+        # Ogni comune distinto viene decodificato una volta sola
+        unique, inverse = np.unique(idx[found], return_inverse=True)
+        names[found] = np.array([self.name_at(i) for i in unique], dtype=object)[inverse]
+        return names
+
+    def to_dict(self):
+        """Nome più recente di ogni codice"""
+        return {self.codes[i].decode("ascii"): self.name_at(i) for i in range(len(self.codes))}
+
+def write_comuni_store(store, path=COMUNI_STORE):
+    """
+    Scrive l'archivio su un file temporaneo nella stessa cartella e lo sostituisce
+    con os.replace: chi legge trova sempre il file vecchio o quello nuovo, mai a metà.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(store.to_bytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def normalize_comune_name(name):
+    """Maiuscolo, senza accenti e spazi ripetuti: 'Cantù' e 'CANTU' hanno la stessa chiave"""
+    text = name.upper()
+    if not text.isascii():
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return " ".join(text.split())
+
+class ComuniPrefixIndex:
+    """
+    Nomi dei comuni normalizzati e ordinati, costruito una volta dall'archivio:
+    la ricerca per prefisso è una bisect (nessuna scansione di tutti i nomi).
+    """
+
+    def __init__(self, store):
+        entries = {}
+        for code, start, end, name in store.records():
+            key = normalize_comune_name(name)
+            names, codes = entries.setdefault(key, ({}, []))
+            current = end == OPEN_END
+            names[current] = name
+            # Prima i codici dei comuni ancora esistenti
+            if current:
+                codes.insert(0, code)
+            else:
+                codes.append(code)
+        self.keys = sorted(entries)
+        self.names = [entries[k][0].get(True) or entries[k][0][False] for k in self.keys]
+        self.codes = [tuple(dict.fromkeys(entries[k][1])) for k in self.keys]
+
+    def _range(self, prefix):
+        key = normalize_comune_name(prefix)
+        return bisect_left(self.keys, key), bisect_left(self.keys, key + "\uffff")
+
+    def complete(self, prefix, limit=20):
+        """Primi nomi (in ordine alfabetico) che iniziano con il prefisso"""
+        if not prefix.strip():
+            return []
+        start, end = self._range(prefix)
+        return self.names[start:min(end, start + limit)]
+
+    def codes_for(self, name):
+        key = normalize_comune_name(name)
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.codes[i]
+        return ()
+
+# Globale per memorizzare l'archivio dei comuni, caricato al primo utilizzo
+_comuni_store = None
+# Dizionario completo, costruito solo se richiesto da load_comuni()
 _comuni_cache = None
+# Indice per prefisso dei nomi, costruito al primo completamento o ricerca per nome
+_comuni_index = None
 
-def load_comuni():
-    global _comuni_cache
-    if _comuni_cache is not None:
-        return _comuni_cache
-        
-    map_path = os.path.join(os.path.dirname(__file__), 'comuni_map.json')
-    if os.path.exists(map_path):
+def load_comuni_store():
+    global _comuni_store
+    if _comuni_store is not None:
+        return _comuni_store
+
+    if os.path.exists(COMUNI_STORE):
+        try:
+            with open(COMUNI_STORE, 'rb') as f:
+                _comuni_store = ComuniStore.from_bytes(f.read())
+            return _comuni_store
+        except Exception as e:
+            print(f"Errore nel caricamento dell'archivio comuni: {e}")
+
+    # Archivio non ancora generato: si ripiega sul file JSON
+    if os.path.exists(COMUNI_JSON):
         try:
-            with open(map_path, 'r', encoding='utf-8') as f:
-                _comuni_cache = json.load(f)
-            return _comuni_cache
+            with open(COMUNI_JSON, 'r', encoding='utf-8') as f:
+                _comuni_store = ComuniStore.from_mapping(json.load(f))
+            return _comuni_store
         except Exception as e:
             print(f"Errore nel caricamento dei comuni: {e}")
-    
+
     # Fallback se il file non esiste
+    return ComuniStore.from_mapping(FALLBACK_COMUNI)
+
+def reset_comuni_cache():
+    """Dopo un aggiornamento dell'archivio: il prossimo accesso rilegge il file"""
+    global _comuni_store, _comuni_cache, _comuni_index
+    _comuni_store = None
+    _comuni_cache = None
+    _comuni_index = None
+
+def load_comuni():
+    """Mappatura completa codice -> nome (il più recente) come dizionario"""
+    global _comuni_cache
+    if _comuni_cache is None:
+        _comuni_cache = load_comuni_store().to_dict()
+    return _comuni_cache
+
+def get_comune_name(code, as_of=None):
+    """Nome del comune; con as_of (es. data di nascita) quello valido a quella data"""
+    return load_comuni_store().get(code, code.upper(), as_of)
+
+def load_comuni_index():
+    global _comuni_index
+    if _comuni_index is None:
+        _comuni_index = ComuniPrefixIndex(load_comuni_store())
+    return _comuni_index
+
+def complete_comune(prefix, limit=20):
+    return load_comuni_index().complete(prefix, limit)
+
+def get_comune_codes(name):
+    """Tutti i codici catastali con questo nome (omonimi, comuni soppressi), i vigenti per primi"""
+    return load_comuni_index().codes_for(name)
+
+def get_comune_code(name):
+    """Codice catastale dal nome del comune, None se sconosciuto"""
+    codes = get_comune_codes(name)
+    return codes[0] if codes else None
+
+def get_comune_names(codes, as_of=None):
+    """Come get_comune_name per un array di codici (il codice resta dove il comune è sconosciuto)"""
+    codes = np.asarray(codes, dtype=object)
+    names = load_comuni_store().lookup(codes, as_of)
+    missing = np.equal(names, None)
+    names[missing] = [c.upper() for c in codes[missing]]
+    return names
+
+# --- TABELLE PER IL PARSING VETTORIALE ---
+
+MONTH_CHARS = "ABCDEHLMPRST"
+# Omocodia: lettere che sostituiscono le cifre 0-9 nelle posizioni numeriche
+OMOCODE_CHARS = "LMNPQRSTUV"
+# Posizioni (0-based) delle cifre, possibili sostituzioni per omocodia
+DIGIT_POSITIONS = [6, 7, 9, 10, 12, 13, 14]
+LETTER_POSITIONS = [0, 1, 2, 3, 4, 5, 8, 11, 15]
+
+# Valori del carattere di controllo per le posizioni dispari (1a, 3a, ...)
+ODD_VALUES = dict(zip("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+                      [1, 0, 5, 7, 9, 13, 15, 17, 19, 21,
+                       1, 0, 5, 7, 9, 13, 15, 17, 19, 21, 2, 4, 18, 20, 11, 3, 6, 8, 12, 14, 16, 10, 22, 25, 24, 23]))
+
+def _byte_table(values, default=-1):
+    """Tabella di lookup indicizzata per codice ASCII"""
+    table = np.full(256, default, dtype=np.int16)
+    for char, value in values.items():
+        table[ord(char)] = value
+    return table
+
+DIGIT_TABLE = _byte_table({**{str(d): d for d in range(10)}, **{c: d for d, c in enumerate(OMOCODE_CHARS)}})
+MONTH_TABLE = _byte_table({c: m for m, c in enumerate(MONTH_CHARS, start=1)})
+LETTER_TABLE = _byte_table({chr(c): 1 for c in range(ord('A'), ord('Z') + 1)}, default=0)
+ODD_TABLE = _byte_table(ODD_VALUES)
+EVEN_TABLE = _byte_table({**{str(d): d for d in range(10)}, **{chr(ord('A') + i): i for i in range(26)}})
+
+def parse_cf_batch(codes):
+    """
+    Analizza in blocco una serie di codici fiscali (Series, array o lista).
+    Ritorna un dict di array NumPy allineati all'input:
+    - birth_date: datetime64[D], NaT se data o struttura non decodificabili
+    - gender: 'M', 'F' o ''
+    - comune_code: codice catastale con l'omocodia già risolta, '' se non decodificabile
+    - valid: struttura corretta, data esistente e carattere di controllo esatto
+    """
+    normalized = [c.strip().upper() if isinstance(c, str) else "" for c in np.asarray(codes, dtype=object).ravel()]
+    n = len(normalized)
+    # Matrice n x 16 di byte ASCII: i codici di lunghezza errata diventano righe vuote
+    fixed = np.array([c if len(c) == 16 and c.isascii() else "" for c in normalized], dtype="S16")
+    chars = fixed.view(np.uint8).reshape(n, 16)
+    well_formed = chars[:, 15] != 0
+
+    digits = DIGIT_TABLE[chars[:, DIGIT_POSITIONS]]
+    decodable = well_formed & (digits >= 0).all(axis=1)
+    year_part = digits[:, 0] * 10 + digits[:, 1]
+    day_part = digits[:, 2] * 10 + digits[:, 3]
+    month = MONTH_TABLE[chars[:, 8]]
+
+    female = day_part > 40
+    day = np.where(female, day_part - 40, day_part)
+    # Anno (assumiamo 1900 o 2000)
+    current_year = datetime.date.today().year % 100
+    year = np.where(year_part <= current_year, 2000 + year_part, 1900 + year_part)
+
+    decodable &= (month > 0) & (day >= 1) & (day <= 31) & LETTER_TABLE[chars[:, 11]].astype(bool)
+    # Data costruita come mese + giorni: se sfora nel mese successivo non esiste
+    months = np.where(decodable, (year - 1970) * 12 + month - 1, 0).astype("datetime64[M]")
+    birth = months.astype("datetime64[D]") + np.where(decodable, day - 1, 0)
+    decodable &= birth.astype("datetime64[M]") == months
+    birth[~decodable] = np.datetime64("NaT")
+
+    # Codice catastale con le cifre omocodiche riportate a cifre
+    comune = chars[:, 11:15].copy()
+    comune[:, 1:] = (digits[:, 4:] + ord('0')).astype(np.uint8)
+    comune_code = np.where(decodable, comune.copy().view("S4").ravel().astype("U4"), "")
+
+    # Carattere di controllo: somma dei valori delle posizioni dispari e pari, modulo 26
+    total = ODD_TABLE[chars[:, 0:15:2]].sum(axis=1) + EVEN_TABLE[chars[:, 1:15:2]].sum(axis=1)
+    letters_ok = LETTER_TABLE[chars[:, LETTER_POSITIONS]].all(axis=1)
+    odd_ok = (ODD_TABLE[chars[:, 0:15:2]] >= 0).all(axis=1)
+    even_ok = (EVEN_TABLE[chars[:, 1:15:2]] >= 0).all(axis=1)
+    check_ok = chars[:, 15] == (total % 26 + ord('A'))
+    valid = decodable & letters_ok & odd_ok & even_ok & check_ok
+
     return {
-        "H501": "ROMA",
-        "F205": "MILANO",
-        "L219": "TORINO",
-        "F839": "NAPOLI",
-        "A944": "BOLOGNA",
-        "D612": "FIRENZE",
-        "B157": "BRESCIA",
-        "H575": "SASSARI",
-        "G273": "PALERMO",
-        "D969": "GENOVA",
-        "G388": "PAVIA"
+        "birth_date": birth,
+        "gender": np.where(decodable, np.where(female, "F", "M"), ""),
+        "comune_code": comune_code,
+        "valid": valid,
     }
 
-def get_comune_name(code):
-    comuni = load_comuni()
-    return comuni.get(code.upper(), code.upper())
-
 def parse_cf(cf):
     """
     Estratto base da Codice Fiscale Italiano:
     - Data di nascita
     - Sesso
     - Comune di nascita (codice catastale)
+    Ritorna None se il codice non è decodificabile.
     """
-    if not cf or len(cf) != 16:
+    if not cf:
         return None
-
-    try:
-        # 1. Data di Nascita
-        year_part = int(cf[6:8])
-        month_char = cf[8].upper()
-        day_part = int(cf[9:11])
-
-        # Mappatura Mese
-        months = {
-            'A': 1, 'B': 2, 'C': 3, 'D': 4, 'E': 5, 'H': 6,
-            'L': 7, 'M': 8, 'P': 9, 'R': 10, 'S': 11, 'T': 12
-        }
-        month = months.get(month_char)
-        if not month: return None
-
-        # Sesso e Giorno
-        gender = "M"
-        if day_part > 40:
-            gender = "F"
-            day_part -= 40
-        
-        # Anno (assumiamo 1900 o 2000)
-        current_year = datetime.date.today().year % 100
-        if year_part <= current_year:
-            year = 2000 + year_part
-        else:
-            year = 1900 + year_part
-
-        birth_date = datetime.date(year, month, day_part)
-
-        # 2. Comune di Nascita (Codice Catastale)
-        comune_code = cf[11:15].upper()
-
-        return {
-            "birth_date": birth_date,
-            "gender": gender,
-            "comune_code": comune_code
-        }
-    except Exception as e:
-        print(f"Errore parsing CF {cf}: {e}")
+    data = parse_cf_batch([cf])
+    if np.isnat(data["birth_date"][0]):
         return None
+    return {
+        "birth_date": data["birth_date"][0].astype(datetime.date),
+        "gender": str(data["gender"][0]),
+        "comune_code": str(data["comune_code"][0]),
+        "valid": bool(data["valid"][0]),
+    }
@@ -0,0 +1,271 @@
+"""
+Riga di comando senza interfaccia grafica, per le operazioni pianificate (es. notturne).
+Non importa PySide6: avvio rapido e nessun display richiesto.
+
+    python cli.py stats
+    python cli.py import atleti.xlsx --strategia overwrite_all
+    python cli.py export certificati.csv --vista certificati --filtro scaduti
+    python cli.py vacuum
+    python cli.py reindex
+    python cli.py sync //nas/karate/gestionale_sync.db --strategia keep_current
+    python cli.py backup --se-necessario
+    python cli.py restore backup/karate_data-20260101-020000-000000-automatico.db.gz
+
+Il database è quello delle impostazioni dell'applicazione (app_settings.json),
+oppure quello indicato con --db. Con --json l'esito è un oggetto JSON su stdout
+(i messaggi informativi vanno su stderr). Codice di uscita 0 = successo.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import sys
+
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app_settings.json')
+
+# Strategie non interattive per i conflitti (come in GlobalConflictDialog)
+CLI_STRATEGIES = ["overwrite_all", "keep_current"]
+
+# Filtri della vista certificati (come combo_cert_filter)
+CERT_FILTERS = {"30": 0, "60": 1, "90": 2, "scaduti": 3}
+
+class CliError(Exception):
+    """Errore da riportare; result: esito di quanto già salvato, incluso nell'output (anche --json)"""
+
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.result = result or {}
+
+def load_settings():
+    if os.path.exists(SETTINGS_FILE):
+        try:
+            with open(SETTINGS_FILE, 'r') as f:
+                return json.load(f)
+        except Exception:
+            pass
+    return {}
+
+def open_database(args):
+    from database import DatabaseManager
+    settings = load_settings()
+    db_path = args.db or settings.get("db_path")
+    if not db_path:
+        raise CliError("Nessun database configurato: indicare --db oppure avviare prima l'applicazione.")
+    if not os.path.exists(db_path) and not args.crea:
+        raise CliError(f"Database non trovato: {db_path} (usare --crea per crearne uno nuovo)")
+    db = DatabaseManager()
+    db.initialize(db_path, args.profilo or settings.get("db_profile"))
+    return db
+
+def backup_options(args):
+    """Cartella e numero di backup conservati: da riga di comando o dalle impostazioni"""
+    from backup import DEFAULT_RETENTION
+    settings = load_settings()
+    return {"backup_dir": getattr(args, "cartella", None) or settings.get("backup_dir"),
+            "retention": getattr(args, "conserva", None) or settings.get("backup_retention", DEFAULT_RETENTION)}
+
+def _backup_result(result):
+    return {"file": result.path, "size": result.size, "db_size": result.db_size,
+            "duration_s": round(result.duration, 3), "reason": result.reason}
+
+# --- COMANDI ---
+
+def cmd_stats(args, db):
+    from stats import get_dashboard_stats
+    return dict(get_dashboard_stats())
+
+def cmd_import(args, db):
+    from importer import auto_mapping, read_header, run_import, ImportFailed
+
+    columns = read_header(args.file)
+    mapping = auto_mapping(columns)
+    for item in args.mappa or []:
+        key, _, col = item.partition("=")
+        if col not in columns:
+            raise CliError(f"Colonna '{col}' non presente nel file")
+        mapping[key] = col
+    if "name" not in mapping or "surname" not in mapping:
+        raise CliError("Le colonne Nome e Cognome sono obbligatorie (usare --mappa name=... surname=...)")
+
+    def ask_strategy(conflict_count):
+        print(f"{conflict_count} atleti già presenti con dati diversi.", file=sys.stderr)
+        return None  # Nessuna strategia: importazione interrotta
+
+    backup = None
+    if not args.senza_backup:
+        from backup import create_backup, REASON_IMPORT
+        backup = create_backup(db.db_path, reason=REASON_IMPORT, **backup_options(args))
+        print(f"Backup prima dell'importazione: {backup.path}", file=sys.stderr)
+
+    def summary(result):
+        return {"imported": result["imported"], "errors": result["errors"], "skipped": result["skipped"],
+                "created": len(result["created_ids"]), "updated": len(result["updated_ids"]),
+                "backup": backup.path if backup else None, "messages": result["messages"]}
+
+    session = db.get_session()
+    try:
+        # Senza --strategia i conflitti dell'intero file vengono cercati prima di salvare
+        result = run_import(session, args.file, mapping, ask_strategy, strategy=args.strategia)
+    except ImportFailed as e:
+        raise CliError(f"{e} (atleti importati/aggiornati prima dell'errore, già salvati: {e.partial['imported']})",
+                       summary(e.partial)) from e
+    finally:
+        session.close()
+    for msg in result["messages"]:
+        print(f"Errore importazione {msg}", file=sys.stderr)
+    if result["cancelled"]:
+        message = "Conflitti con atleti esistenti: indicare --strategia overwrite_all o keep_current"
+        if result["imported"]:
+            # Conflitti comparsi durante l'importazione: i blocchi precedenti sono salvati
+            message += f" (atleti importati/aggiornati prima dell'interruzione, già salvati: {result['imported']})"
+        raise CliError(message, summary(result))
+    return summary(result)
+
+def cmd_export(args, db):
+    from exporter import athlete_export, certificate_export, run_export
+    if args.vista == "certificati":
+        export = certificate_export(CERT_FILTERS[args.filtro])
+    else:
+        keys = args.colonne.split(",") if args.colonne else None
+        export = athlete_export(keys, args.cerca or "")
+    session = db.get_session()
+    try:
+        rows = run_export(session, args.file, export)
+    finally:
+        session.close()
+    return {"file": os.path.abspath(args.file), "rows": rows}
+
+def cmd_sync(args, db):
+    def ask_strategy(conflict_count):
+        print(f"{conflict_count} atleti modificati su entrambe le copie con dati diversi.", file=sys.stderr)
+        return None  # Nessuna strategia: sincronizzazione annullata
+    # Con --strategia vale anche per i conflitti su certificati e gradi
+    result = db.sync_manual(args.remoto, strategy=args.strategia,
+                            ask_strategy=None if args.strategia else ask_strategy)
+    if result["cancelled"]:
+        raise CliError("Conflitti con la copia remota: indicare --strategia overwrite_all o keep_current")
+    return result
+
+def cmd_backup(args, db):
+    from backup import create_backup, backup_due, DEFAULT_INTERVAL_HOURS, REASON_MANUAL, REASON_SCHEDULED
+    options = backup_options(args)
+    if args.se_necessario:
+        interval = load_settings().get("backup_interval_hours", DEFAULT_INTERVAL_HOURS) or DEFAULT_INTERVAL_HOURS
+        if not backup_due(db.db_path, interval, options["backup_dir"]):
+            return {"skipped": True}
+    reason = REASON_SCHEDULED if args.se_necessario else REASON_MANUAL
+    return _backup_result(create_backup(db.db_path, reason=reason, **options))
+
+def cmd_restore(args, db):
+    from backup import restore_backup
+    if not os.path.exists(args.file):
+        raise CliError(f"Backup non trovato: {args.file}")
+    db.engine.dispose()
+    safety = restore_backup(args.file, db.db_path, **backup_options(args))
+    # Schema aggiornato se il backup è di una versione precedente
+    db.initialize(db.db_path, db.pragma_profile)
+    return {"restored": os.path.abspath(args.file), "safety_backup": safety.path}
+
+def cmd_vacuum(args, db):
+    before = os.path.getsize(db.db_path)
+    # Registro modifiche: una sola voce per riga (nessun cursore perde modifiche)
+    compacted = db.compact_change_log()
+    with db.engine.connect() as conn:
+        # VACUUM non può essere eseguito dentro una transazione
+        conn.exec_driver_sql("VACUUM")
+        conn.exec_driver_sql("PRAGMA optimize")
+    return {"size_before": before, "size_after": os.path.getsize(db.db_path), "change_log_removed": compacted}
+
+def cmd_reindex(args, db):
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("REINDEX")
+    return {"fts": db.rebuild_search_index()}
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Gestionale Karate - comandi senza interfaccia grafica")
+    parser.add_argument("--db", help="File database (predefinito: quello delle impostazioni)")
+    parser.add_argument("--profilo", help="Profilo PRAGMA (bilanciato, prestazioni, sicuro, rete)")
+    parser.add_argument("--crea", action="store_true", help="Crea il database se non esiste")
+    parser.add_argument("--json", action="store_true", help="Esito in formato JSON su stdout")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("stats", help="Contatori della dashboard").set_defaults(func=cmd_stats)
+
+    p = sub.add_parser("import", help="Importa atleti da CSV/XLSX/XLS")
+    p.add_argument("file")
+    p.add_argument("--strategia", choices=CLI_STRATEGIES,
+                   help="Per gli atleti già presenti con dati diversi (senza: interrompe se ci sono conflitti)")
+    p.add_argument("--mappa", nargs="*", metavar="CAMPO=COLONNA",
+                   help="Mappatura esplicita, es. tax_code='Cod. Fiscale' (le altre colonne per nome)")
+    p.add_argument("--senza-backup", action="store_true", help="Non fare il backup del database prima di importare")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("export", help="Esporta la lista atleti o i certificati (CSV, XLSX o Parquet)")
+    p.add_argument("file", help="Il formato dipende dall'estensione: .csv, .xlsx, .parquet")
+    p.add_argument("--vista", choices=["atleti", "certificati"], default="atleti")
+    p.add_argument("--colonne", help="Chiavi delle colonne atleti separate da virgola, nell'ordine voluto")
+    p.add_argument("--cerca", help="Testo di ricerca come nella vista atleti")
+    p.add_argument("--filtro", choices=list(CERT_FILTERS), default="30", help="Scadenze entro N giorni o scaduti")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("sync", help="Sincronizza con un'altra copia (solo le modifiche)")
+    p.add_argument("remoto", help="File .db della copia remota o cartella condivisa")
+    p.add_argument("--strategia", choices=CLI_STRATEGIES,
+                   help="Per gli atleti modificati su entrambe le copie: overwrite_all = vince la copia remota")
+    p.set_defaults(func=cmd_sync)
+
+    p = sub.add_parser("backup", help="Backup a caldo compresso, con rotazione dei più vecchi")
+    p.add_argument("--cartella", help="Cartella dei backup (predefinita: 'backup' accanto al database)")
+    p.add_argument("--conserva", type=int, help="Numero di backup da conservare")
+    p.add_argument("--se-necessario", action="store_true",
+                   help="Solo se l'ultimo backup è più vecchio dell'intervallo pianificato (per i job notturni)")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("restore", help="Ripristina un backup (prima salva una copia di sicurezza)")
+    p.add_argument("file", help="File .db.gz creato dal comando backup o dall'applicazione")
+    p.add_argument("--cartella", help="Cartella dei backup per la copia di sicurezza")
+    p.add_argument("--conserva", type=int, help="Numero di backup da conservare")
+    p.set_defaults(func=cmd_restore)
+
+    sub.add_parser("vacuum", help="Compatta il database (VACUUM + PRAGMA optimize)").set_defaults(func=cmd_vacuum)
+    sub.add_parser("reindex", help="Ricostruisce indici e indice di ricerca").set_defaults(func=cmd_reindex)
+    return parser
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, set):
+        return sorted(value)
+    return str(value)
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    stdout = sys.stdout
+    try:
+        # Con --json su stdout va solo il risultato
+        with contextlib.redirect_stdout(sys.stderr) if args.json else contextlib.nullcontext():
+            db = open_database(args)
+            result = args.func(args, db)
+    except Exception as e:
+        partial = getattr(e, "result", {})
+        if args.json:
+            print(json.dumps({"ok": False, "error": str(e), **partial}, default=_json_default), file=stdout)
+        else:
+            print(f"Errore: {e}", file=sys.stderr)
+            for key, value in partial.items():
+                if key != "messages":
+                    print(f"{key}: {value}", file=sys.stderr)
+        return 1
+
+    if args.json:
+        print(json.dumps({"ok": True, "command": args.command, **result}, default=_json_default), file=stdout)
+    else:
+        for key, value in result.items():
+            if key == "messages":
+                continue
+            print(f"{key}: {value}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,13 @@
-from sqlalchemy import create_engine, Column, Integer, String, Date, ForeignKey, desc
+from sqlalchemy import create_engine, event, Column, Integer, String, Date, ForeignKey, Index, desc, select, text
+from collections import namedtuple
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import relationship, sessionmaker, scoped_session
+from sqlalchemy.orm.exc import StaleDataError
 import datetime
 import os
+import random
+import time
 
 Base = declarative_base()
 
@@ -24,11 +29,29 @@ class Athlete(Base):
     asc_number = Column(String)  # Numero tessera ASC
     roles = Column(String)      # Ruoli selezionati (separati da virgola)
     notes = Column(String)      # Note aggiuntive
+
+    # Sincronizzazione tra copie del database (vedi sync.py), valorizzati dai trigger
+    sync_uid = Column(String)     # Identificativo globale della riga
+    sync_seq = Column(Integer)    # Versione locale: valore di sync_state.clock all'ultima modifica
+    updated_at = Column(String)   # Ultima modifica (UTC, 'YYYY-MM-DD HH:MM:SS.SSS')
+
+    # Blocco ottimistico: l'ORM aggiorna con WHERE version = <letta> e la incrementa,
+    # le scritture Core (importazione, sincronizzazione) la incrementano tramite trigger
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
     
     # Relationships
     certificates = relationship("MedicalCertificate", back_populates="athlete", cascade="all, delete-orphan", order_by="desc(MedicalCertificate.expiry_date)")
     ranks = relationship("Rank", back_populates="athlete", cascade="all, delete-orphan", order_by="desc(Rank.attainment_date)")
 
+    # Ordinamento della lista per cognome/nome
+    __table_args__ = (
+        Index('ix_athletes_surname_name', 'surname', 'name'),
+        Index('ix_athletes_name', 'name'),
+        Index('ix_athletes_sync_uid', 'sync_uid', unique=True),
+        Index('ix_athletes_sync_seq', 'sync_seq'),
+    )
+
     @property
     def latest_certificate(self):
         return self.certificates[0] if self.certificates else None
@@ -40,9 +63,24 @@ class MedicalCertificate(Base):
     athlete_id = Column(Integer, ForeignKey('athletes.id'))
     cert_type = Column(String)
     expiry_date = Column(Date, nullable=False)
+
+    sync_uid = Column(String)
+    sync_seq = Column(Integer)
+    updated_at = Column(String)
+
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
     
     athlete = relationship("Athlete", back_populates="certificates")
 
+    # Scadenze (dashboard, vista certificati) e certificato più recente per atleta
+    __table_args__ = (
+        Index('ix_medical_certificates_expiry_type', 'expiry_date', 'cert_type'),
+        Index('ix_medical_certificates_athlete_expiry', 'athlete_id', desc('expiry_date')),
+        Index('ix_medical_certificates_sync_uid', 'sync_uid', unique=True),
+        Index('ix_medical_certificates_sync_seq', 'sync_seq'),
+    )
+
 class Rank(Base):
     __tablename__ = 'ranks'
     
@@ -51,9 +89,310 @@ class Rank(Base):
     belt_color = Column(String, nullable=False)
     rank_name = Column(String)
     attainment_date = Column(Date, default=datetime.date.today)
+
+    sync_uid = Column(String)
+    sync_seq = Column(Integer)
+    updated_at = Column(String)
     
     athlete = relationship("Athlete", back_populates="ranks")
 
+    __table_args__ = (
+        Index('ix_ranks_sync_uid', 'sync_uid', unique=True),
+        Index('ix_ranks_sync_seq', 'sync_seq'),
+    )
+
+class SyncTombstone(Base):
+    """Righe cancellate, da propagare alle altre copie"""
+    __tablename__ = 'sync_tombstones'
+
+    table_name = Column(String, primary_key=True)
+    sync_uid = Column(String, primary_key=True)
+    sync_seq = Column(Integer, nullable=False)
+    deleted_at = Column(String)
+
+    __table_args__ = (
+        Index('ix_sync_tombstones_sync_seq', 'sync_seq'),
+    )
+
+class SyncState(Base):
+    """Riga unica: identificativo di questa copia e contatore delle modifiche"""
+    __tablename__ = 'sync_state'
+
+    id = Column(Integer, primary_key=True)
+    replica_id = Column(String, nullable=False)
+    clock = Column(Integer, nullable=False, default=0)
+    change_log_floor = Column(Integer, nullable=False, server_default="0")  # Voci di change_log eliminate fino a qui
+
+class ChangeLog(Base):
+    """
+    Registro delle modifiche (change data capture), scritto dai trigger di CHANGE_LOG_SCHEMA.
+    seq è AUTOINCREMENT: cresce sempre, anche dopo la compattazione del registro.
+    """
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        Index('ix_change_log_row', 'table_name', 'row_id', 'seq'),
+        {'sqlite_autoincrement': True},
+    )
+
+    seq = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)
+    row_id = Column(Integer, nullable=False)
+    op = Column(String(1), nullable=False)   # 'I' inserimento, 'U' modifica, 'D' cancellazione
+
+class SyncPeer(Base):
+    """Versioni già scambiate con ogni copia remota"""
+    __tablename__ = 'sync_peers'
+
+    peer_id = Column(String, primary_key=True)
+    last_sent = Column(Integer, nullable=False, default=0)       # Nostro clock all'ultima sincronizzazione
+    last_received = Column(Integer, nullable=False, default=0)   # Clock della copia remota
+    synced_at = Column(String)
+
+# Indice full-text (FTS5, tokenizer trigram) per la ricerca atleti.
+# Tabella "external content": i testi restano in 'athletes', i trigger tengono allineato l'indice.
+FTS_COLUMNS = ["name", "surname", "tax_code", "asc_number", "notes"]
+
+def _fts_values(prefix):
+    return ", ".join(f"{prefix}.{c}" for c in FTS_COLUMNS)
+
+FTS_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS athletes_fts USING fts5(
+        {", ".join(FTS_COLUMNS)}, content='athletes', content_rowid='id', tokenize='trigram')""",
+    f"""CREATE TRIGGER IF NOT EXISTS athletes_fts_ai AFTER INSERT ON athletes BEGIN
+        INSERT INTO athletes_fts(rowid, {", ".join(FTS_COLUMNS)}) VALUES (new.id, {_fts_values("new")});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS athletes_fts_ad AFTER DELETE ON athletes BEGIN
+        INSERT INTO athletes_fts(athletes_fts, rowid, {", ".join(FTS_COLUMNS)}) VALUES ('delete', old.id, {_fts_values("old")});
+    END""",
+    # Solo se cambia una colonna indicizzata (non per telefono, note di sincronizzazione, ...)
+    f"""CREATE TRIGGER IF NOT EXISTS athletes_fts_au AFTER UPDATE OF {", ".join(FTS_COLUMNS)} ON athletes BEGIN
+        INSERT INTO athletes_fts(athletes_fts, rowid, {", ".join(FTS_COLUMNS)}) VALUES ('delete', old.id, {_fts_values("old")});
+        INSERT INTO athletes_fts(rowid, {", ".join(FTS_COLUMNS)}) VALUES (new.id, {_fts_values("new")});
+    END""",
+]
+
+# Trigger di sincronizzazione: ogni inserimento o modifica riceve un nuovo valore del
+# contatore (sync_seq) e l'ora della modifica; le cancellazioni lasciano una tombstone.
+# Le righe ricevute da un'altra copia mantengono sync_uid e updated_at di origine.
+SYNC_TABLES = ["athletes", "medical_certificates", "ranks"]
+SYNC_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# Tabelle con colonna version: gli UPDATE che non la cambiano (non ORM) la incrementano
+VERSIONED_TABLES = ["athletes", "medical_certificates"]
+
+def _version_bump(table):
+    if table not in VERSIONED_TABLES:
+        return ""
+    return ",\n                version = CASE WHEN new.version IS old.version THEN old.version + 1 ELSE new.version END"
+
+def _sync_triggers(table):
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_sync_ai AFTER INSERT ON {table} BEGIN
+            UPDATE sync_state SET clock = clock + 1;
+            UPDATE {table} SET sync_seq = (SELECT clock FROM sync_state),
+                sync_uid = coalesce(new.sync_uid, lower(hex(randomblob(16)))),
+                updated_at = coalesce(new.updated_at, {SYNC_NOW})
+            WHERE id = new.id;
+        END""",
+        # La condizione esclude l'UPDATE eseguito dal trigger stesso (cambia sync_seq)
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_sync_au AFTER UPDATE ON {table}
+        WHEN new.sync_seq IS old.sync_seq BEGIN
+            UPDATE sync_state SET clock = clock + 1;
+            UPDATE {table} SET sync_seq = (SELECT clock FROM sync_state),
+                updated_at = CASE WHEN new.updated_at IS old.updated_at THEN {SYNC_NOW} ELSE new.updated_at END{_version_bump(table)}
+            WHERE id = new.id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_sync_ad AFTER DELETE ON {table}
+        WHEN old.sync_uid IS NOT NULL BEGIN
+            UPDATE sync_state SET clock = clock + 1;
+            INSERT OR REPLACE INTO sync_tombstones(table_name, sync_uid, sync_seq, deleted_at)
+            VALUES ('{table}', old.sync_uid, (SELECT clock FROM sync_state), {SYNC_NOW});
+        END""",
+    ]
+
+SYNC_SCHEMA = [ddl for table in SYNC_TABLES for ddl in _sync_triggers(table)]
+
+# Trigger del registro modifiche. Gli UPDATE interni dei trigger di sincronizzazione
+# (cambiano solo sync_seq) non vengono registrati.
+CHANGE_LOG_TABLES = SYNC_TABLES
+
+def _change_log_triggers(table):
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_log_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO change_log(table_name, row_id, op) VALUES ('{table}', new.id, 'I');
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_log_au AFTER UPDATE ON {table}
+        WHEN new.sync_seq IS old.sync_seq BEGIN
+            INSERT INTO change_log(table_name, row_id, op) VALUES ('{table}', new.id, 'U');
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_log_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO change_log(table_name, row_id, op) VALUES ('{table}', old.id, 'D');
+        END""",
+    ]
+
+CHANGE_LOG_SCHEMA = [ddl for table in CHANGE_LOG_TABLES for ddl in _change_log_triggers(table)]
+
+# Voce del registro modifiche restituita da DatabaseManager.changes_since
+Change = namedtuple("Change", "seq table_name row_id op")
+
+# Compattazione pianificata (compact_change_log_if_needed): quando il registro copre più
+# del doppio di queste voci, restano solo le più recenti
+CHANGE_LOG_KEEP = 50000
+
+class ChangeLogGap(Exception):
+    """Il cursore precede la parte di registro eliminata da compact_change_log: serve una rilettura completa"""
+    pass
+
+def coalesce_changes(changes):
+    """
+    Riduce una sequenza di Change all'effetto netto per riga: {tabella: {row_id: op}}.
+    I+U = I, I+D = nessuna modifica, U+D = D, D+I = U (id riutilizzato).
+    """
+    result = {}
+    for change in changes:
+        rows = result.setdefault(change.table_name, {})
+        previous = rows.get(change.row_id)
+        op = change.op
+        if previous == 'I' and op == 'U':
+            op = 'I'
+        elif previous == 'I' and op == 'D':
+            del rows[change.row_id]
+            continue
+        elif previous == 'D' and op == 'I':
+            op = 'U'
+        rows[change.row_id] = op
+    return result
+
+# Profili PRAGMA applicati ad ogni nuova connessione SQLite
+PRAGMA_PROFILES = {
+    # WAL + synchronous NORMAL: letture e scritture concorrenti, commit veloci
+    "bilanciato": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,          # 64 MB (valori negativi = KiB)
+        "mmap_size": 268435456,        # 256 MB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+        "foreign_keys": "ON",
+    },
+    # Più cache e mmap per database molto grandi su disco locale
+    "prestazioni": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -262144,         # 256 MB
+        "mmap_size": 1073741824,       # 1 GB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+        "foreign_keys": "ON",
+    },
+    # Massima durabilità: ogni commit è sincronizzato su disco
+    "sicuro": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "cache_size": -16384,          # 16 MB
+        "mmap_size": 0,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+        "foreign_keys": "ON",
+    },
+    # Cartelle di rete (NAS): WAL e mmap non sono affidabili su filesystem condivisi
+    "rete": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "cache_size": -16384,
+        "mmap_size": 0,
+        "temp_store": "MEMORY",
+        "busy_timeout": 15000,
+        "foreign_keys": "ON",
+    },
+}
+DEFAULT_PRAGMA_PROFILE = "bilanciato"
+
+def set_pragmas(dbapi_connection, pragmas):
+    """Esegue PRAGMA nome=valore per ogni voce del dict"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def apply_pragmas(dbapi_connection, profile):
+    set_pragmas(dbapi_connection, PRAGMA_PROFILES[profile])
+
+# --- SCRITTURE CONCORRENTI ---
+# Più PC possono usare lo stesso file (cartella condivisa): le transazioni di scrittura
+# prendono subito il lock (BEGIN IMMEDIATE) e durano solo il tempo delle istruzioni.
+# Se il lock non arriva entro busy_timeout la transazione viene ripetuta da capo.
+WRITE_RETRIES = 4          # Tentativi ulteriori dopo il primo
+WRITE_BACKOFF = 0.2        # Secondi prima del secondo tentativo, raddoppiati ad ogni tentativo
+
+SQLITE_BUSY = 5
+SQLITE_LOCKED = 6
+
+class ConcurrentUpdateError(Exception):
+    """La riga è stata modificata (o eliminata, deleted=True) da un'altra postazione dopo essere stata letta"""
+
+    def __init__(self, message, deleted=False):
+        super().__init__(message)
+        self.deleted = deleted
+
+def is_busy_error(exc):
+    """Database bloccato da un altro processo oltre busy_timeout (SQLITE_BUSY/SQLITE_LOCKED)"""
+    orig = getattr(exc, "orig", exc)
+    code = getattr(orig, "sqlite_errorcode", None)  # Python 3.11+; codici estesi nei bit alti
+    if code is not None:
+        return (code & 0xff) in (SQLITE_BUSY, SQLITE_LOCKED)
+    message = str(orig).lower()
+    return "database is locked" in message or "database is busy" in message
+
+def write_transaction(session, func, retries=WRITE_RETRIES, backoff=WRITE_BACKOFF):
+    """
+    Esegue func() in una transazione di scrittura della sessione e fa il commit; ritorna
+    il valore di func. La transazione inizia con BEGIN IMMEDIATE: con WAL una transazione
+    che prima legge e poi scrive fallirebbe subito (SQLITE_BUSY) se un altro processo ha
+    scritto nel frattempo. Se il database resta occupato la transazione viene annullata e
+    ripetuta fino a 'retries' volte, con attese crescenti: func deve quindi rileggere ciò
+    che scrive. Le letture lunghe e le domande all'utente vanno fatte prima.
+    Un UPDATE/DELETE ORM su una versione superata solleva ConcurrentUpdateError.
+    """
+    for attempt in range(retries + 1):
+        try:
+            session.connection().exec_driver_sql("BEGIN IMMEDIATE")
+            result = func()
+            session.commit()
+            return result
+        except OperationalError as e:
+            session.rollback()
+            if not is_busy_error(e) or attempt == retries:
+                raise
+        except StaleDataError as e:
+            session.rollback()
+            raise ConcurrentUpdateError("Dati modificati da un'altra postazione: ricaricare e riprovare.") from e
+        except BaseException:
+            session.rollback()
+            raise
+        # Attesa casuale: le postazioni in coda non riprovano tutte nello stesso istante
+        time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+def athlete_versions(athlete):
+    """Versioni di atleta e certificato più recente, lette all'apertura della scheda"""
+    cert = athlete.latest_certificate
+    return (athlete.version, cert.id if cert else None, cert.version if cert else None)
+
+def athlete_for_update(session, athlete_id, loaded_versions):
+    """
+    Atleta da modificare dentro write_transaction. ConcurrentUpdateError se nel frattempo
+    è stato eliminato o se le versioni non sono più loaded_versions (None: nessun controllo).
+    """
+    athlete = session.get(Athlete, athlete_id)
+    if athlete is None:
+        raise ConcurrentUpdateError("L'atleta è stato eliminato da un'altra postazione.", deleted=True)
+    if loaded_versions is not None and athlete_versions(athlete) != loaded_versions:
+        raise ConcurrentUpdateError("L'atleta è stato modificato da un'altra postazione "
+                                    "dopo l'apertura di questa scheda.")
+    return athlete
+
 class DatabaseManager:
     _instance = None
     
@@ -62,63 +401,126 @@ class DatabaseManager:
             cls._instance = super(DatabaseManager, cls).__new__(cls)
             cls._instance.engine = None
             cls._instance.SessionFactory = None
+            cls._instance.fts_available = False
+            cls._instance.pragma_profile = DEFAULT_PRAGMA_PROFILE
         return cls._instance
 
-    def initialize(self, db_path):
+    def initialize(self, db_path, profile=None, pragmas=None):
+        """pragmas: dict di PRAGMA al posto di quelli del profilo (es. {} = valori predefiniti di SQLite)"""
         if self.engine:
             self.engine.dispose()
             
         self.db_path = db_path
+        self.pragma_profile = profile if profile in PRAGMA_PROFILES else DEFAULT_PRAGMA_PROFILE
+        self.pragmas = PRAGMA_PROFILES[self.pragma_profile] if pragmas is None else pragmas
         self.engine = create_engine(f'sqlite:///{db_path}')
-        Base.metadata.create_all(self.engine)
+        event.listen(self.engine, "connect", self._apply_pragmas)
         
-        # Migrazione manuale per colonne aggiunte
-        self._migrate_columns()
+        # Migrazioni versionate: nessuna ispezione dello schema se già aggiornato
+        from migrations import migrate
+        migrate(self.engine)
+        self._setup_search_index()
         
         self.SessionFactory = scoped_session(sessionmaker(bind=self.engine))
-        print(f"Database inizializzato correttamente: {db_path}")
+        print(f"Database inizializzato correttamente: {db_path} (profilo: {self.pragma_profile})")
 
-    def _migrate_columns(self):
-        """Aggiunge colonne mancanti alla tabella athletes senza resettare il DB"""
-        from sqlalchemy import text, inspect
-        inspector = inspect(self.engine)
-        columns = [c['name'] for c in inspector.get_columns('athletes')]
-        
+    def _apply_pragmas(self, dbapi_connection, connection_record):
+        """Applica il profilo PRAGMA selezionato ad ogni nuova connessione"""
+        set_pragmas(dbapi_connection, self.pragmas)
+
+    def _setup_search_index(self):
+        """Rileva l'indice FTS5; se SQLite non supporta FTS5 la ricerca usa LIKE"""
+        from migrations import fts_supported, table_exists, create_search_index
+        if not fts_supported():
+            self.fts_available = False
+            return
+        with self.engine.begin() as conn:
+            if not table_exists(conn, 'athletes_fts'):
+                # Database migrato con una versione di SQLite senza FTS5
+                create_search_index(conn)
+        self.fts_available = True
+
+    def rebuild_search_index(self):
+        """Ricostruisce da zero l'indice full-text degli atleti"""
+        if not self.fts_available:
+            return False
+        from sqlalchemy import text
+        with self.engine.begin() as conn:
+            conn.execute(text("INSERT INTO athletes_fts(athletes_fts) VALUES ('rebuild')"))
+        return True
+
+    # --- REGISTRO MODIFICHE ---
+
+    def last_change(self):
+        """Cursore attuale del registro modifiche (0 se vuoto): punto di partenza per changes_since"""
         with self.engine.connect() as conn:
-            if 'asc_number' not in columns:
-                try:
-                    conn.execute(text("ALTER TABLE athletes ADD COLUMN asc_number VARCHAR"))
-                    conn.commit()
-                    print("Aggiunta colonna 'asc_number' con successo.")
-                except Exception as e:
-                    print(f"Errore migrazione asc_number: {e}")
-            
-            if 'roles' not in columns:
-                try:
-                    conn.execute(text("ALTER TABLE athletes ADD COLUMN roles VARCHAR"))
-                    conn.commit()
-                    print("Aggiunta colonna 'roles' con successo.")
-                except Exception as e:
-                    print(f"Errore migrazione roles: {e}")
-
-            if 'notes' not in columns:
-                try:
-                    conn.execute(text("ALTER TABLE athletes ADD COLUMN notes VARCHAR"))
-                    conn.commit()
-                    print("Aggiunta colonna 'notes' con successo.")
-                except Exception as e:
-                    print(f"Errore migrazione notes: {e}")
+            return conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")).scalar() or 0
+
+    def changes_since(self, cursor, tables=None, limit=None):
+        """
+        Modifiche registrate dopo il cursore, in ordine: (lista di Change, nuovo cursore).
+        Solleva ChangeLogGap se le voci successive al cursore sono state compattate via.
+        """
+        stmt = select(ChangeLog.seq, ChangeLog.table_name, ChangeLog.row_id, ChangeLog.op) \
+            .where(ChangeLog.seq > cursor).order_by(ChangeLog.seq)
+        if tables:
+            stmt = stmt.where(ChangeLog.table_name.in_(tables))
+        if limit:
+            stmt = stmt.limit(limit)
+        with self.engine.connect() as conn:
+            floor = conn.execute(select(SyncState.change_log_floor)).scalar() or 0
+            if cursor < floor:
+                raise ChangeLogGap(f"Registro modifiche compattato fino a {floor} (cursore {cursor})")
+            changes = [Change(*row) for row in conn.execute(stmt)]
+        return changes, (changes[-1].seq if changes else cursor)
+
+    def compact_change_log(self, before=None):
+        """
+        Compatta il registro: per ogni riga resta solo la voce più recente, così chi legge
+        da un qualunque cursore vede ancora tutte le righe cambiate. Con before elimina anche
+        tutte le voci con seq < before (i cursori precedenti riceveranno ChangeLogGap).
+        Ritorna il numero di voci eliminate.
+        """
+        with self.engine.begin() as conn:
+            removed = conn.execute(text(
+                "DELETE FROM change_log WHERE seq NOT IN "
+                "(SELECT max(seq) FROM change_log GROUP BY table_name, row_id)")).rowcount
+            if before:
+                removed += conn.execute(text("DELETE FROM change_log WHERE seq < :before"),
+                                        {"before": before}).rowcount
+                conn.execute(text("UPDATE sync_state SET change_log_floor = max(change_log_floor, :floor)"),
+                             {"floor": before - 1})
+        return removed
+
+    def compact_change_log_if_needed(self, keep=CHANGE_LOG_KEEP):
+        """
+        Compattazione periodica (anche senza la CLI): se il registro copre più di 2 * keep
+        voci elimina quelle prima delle ultime keep. Controllo su min/max(seq), senza scansioni.
+        Ritorna il numero di voci eliminate.
+        """
+        with self.engine.connect() as conn:
+            low, high = conn.execute(text("SELECT min(seq), max(seq) FROM change_log")).first()
+        if high is None or high - low < 2 * keep:
+            return 0
+        return self.compact_change_log(before=high - keep + 1)
 
     def get_session(self):
         if not self.SessionFactory:
             raise Exception("Database non inizializzato. Chiamare initialize() prima di get_session().")
         return self.SessionFactory()
 
-    def sync_manual(self):
-        """Previsione per sincronizzazione cloud futura"""
-        print("Sincronizzazione manuale avviata (mock)...")
-        # Qui andrebbe la logica di confronto con un server remoto
-        return True
+    def sync_manual(self, remote_path, strategy=None, ask_strategy=None, resolve_conflict=None):
+        """
+        Sincronizza con la copia in remote_path (file .db o cartella condivisa), scambiando
+        solo le righe modificate dall'ultima sincronizzazione. Ritorna il dict di sync.synchronize.
+        """
+        from sync import SqliteRemote, synchronize
+        remote = SqliteRemote(remote_path)
+        try:
+            return synchronize(remote, strategy=strategy, ask_strategy=ask_strategy,
+                               resolve_conflict=resolve_conflict)
+        finally:
+            remote.dispose()
 
 # Helper per mantenere compatibilità col codice esistente
 def get_session():
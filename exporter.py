@@ -0,0 +1,153 @@
+"""
+Esportazione delle viste atleti e certificati in CSV, XLSX o Parquet, senza dipendenze da Qt.
+
+Le righe arrivano dal database a blocchi (yield_per) e vengono scritte subito sul file:
+la memoria usata resta costante qualunque sia il numero di atleti.
+"""
+import csv
+import datetime
+import os
+from collections import namedtuple
+from sqlalchemy import select, func
+from queries import (athlete_list_query, athlete_list_columns, certificate_list_query,
+                     ATHLETE_COLUMNS, DEFAULT_VISIBLE_COLUMNS)
+
+# Righe lette dal cursore (e scritte) per ogni blocco
+EXPORT_BATCH_ROWS = 1000
+
+CERTIFICATE_HEADERS = ["Nome", "Cognome", "Tipo", "Scadenza", "Telefono", "Email"]
+CERTIFICATE_TYPES = ["str", "str", "str", "date", "str", "str"]
+
+# Colonne atleti con valori data o numerici (le altre sono testo)
+ATHLETE_COLUMN_TYPES = {"id": "int", "birth_date": "date", "scadenza": "date"}
+
+# headers: intestazioni; stmt: query; convert(numero, riga) -> valori; types: "int"/"date"/"str"
+ExportSpec = namedtuple("ExportSpec", "headers stmt convert types")
+
+class ExportCancelled(Exception):
+    pass
+
+def athlete_export(keys=None, search_text="", sort_key=None, descending=False):
+    """Lista atleti con le colonne indicate, nell'ordine dato, filtrata e ordinata come nella vista"""
+    labels = {col["key"]: col["label"] for col in ATHLETE_COLUMNS}
+    keys = [k for k in (keys or DEFAULT_VISIBLE_COLUMNS) if k in labels]
+    stmt = athlete_list_query(keys, search_text, sort_key, descending)
+    # Posizione di ogni colonna nella tupla (id, scadenza, <colonne dati>)
+    positions = {"scadenza": 1}
+    positions.update({k: i + 2 for i, k in enumerate(athlete_list_columns(keys))})
+
+    def convert(number, row):
+        # "#" è il numero di riga, come nella vista
+        return [number if k == "id" else row[positions[k]] for k in keys]
+    return ExportSpec([labels[k] for k in keys], stmt, convert,
+                      [ATHLETE_COLUMN_TYPES.get(k, "str") for k in keys])
+
+def certificate_export(filter_idx, today=None):
+    """Vista certificati con il filtro scelto"""
+    return ExportSpec(CERTIFICATE_HEADERS, certificate_list_query(filter_idx, today),
+                      lambda number, row: list(row), CERTIFICATE_TYPES)
+
+def count_rows(session, stmt):
+    """Numero di righe dell'esportazione (per l'avanzamento), senza leggerle"""
+    return session.execute(select(func.count()).select_from(stmt.order_by(None).subquery())).scalar()
+
+def stream_rows(session, stmt, batch=EXPORT_BATCH_ROWS):
+    """Righe dal cursore a blocchi di 'batch', senza caricare l'intero risultato"""
+    result = session.execute(stmt.execution_options(yield_per=batch))
+    for partition in result.partitions():
+        yield from partition
+
+# --- FORMATI ---
+
+def _cell(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return "" if value is None else value
+
+def write_csv(path, spec, rows):
+    # utf-8-sig: Excel riconosce la codifica e mostra correttamente le lettere accentate
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(spec.headers)
+        for values in rows:
+            writer.writerow([_cell(v) for v in values])
+
+def write_xlsx(path, spec, rows):
+    from openpyxl import Workbook
+    # write_only: le righe vengono scritte in streaming, senza tenere il foglio in memoria
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Esportazione")
+    ws.append(spec.headers)
+    for values in rows:
+        ws.append(values)
+    wb.save(path)
+
+def write_parquet(path, spec, rows):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("Esportazione Parquet non disponibile: installare il pacchetto 'pyarrow'.")
+    arrow_types = {"int": pa.int64(), "date": pa.date32(), "str": pa.string()}
+    schema = pa.schema([(h, arrow_types[t]) for h, t in zip(spec.headers, spec.types)])
+
+    def columns(batch):
+        values = [[row[i] for row in batch] for i in range(len(spec.headers))]
+        # Valori testuali non stringa (es. numeri importati) convertiti come nelle altre esportazioni
+        return [col if t != "str" else [None if v is None else str(v) for v in col]
+                for col, t in zip(values, spec.types)]
+
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = []
+        for values in rows:
+            batch.append(values)
+            if len(batch) == EXPORT_BATCH_ROWS:
+                writer.write_batch(pa.record_batch(columns(batch), schema=schema))
+                batch = []
+        if batch:
+            writer.write_batch(pa.record_batch(columns(batch), schema=schema))
+
+EXPORT_FORMATS = {".csv": write_csv, ".xlsx": write_xlsx, ".parquet": write_parquet}
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def run_export(session, path, spec, progress=None, should_stop=None):
+    """
+    Scrive l'esportazione nel formato indicato dall'estensione del file.
+    progress(righe scritte) viene chiamata a ogni blocco; se should_stop() ritorna True
+    l'esportazione si interrompe con ExportCancelled e il file parziale viene eliminato.
+    Ritorna il numero di righe scritte.
+    """
+    writer = EXPORT_FORMATS.get(os.path.splitext(path)[1].lower())
+    if writer is None:
+        raise Exception(f"Formato non supportato: {path} (usare {', '.join(EXPORT_FORMATS)})")
+    written = 0
+
+    def rows():
+        nonlocal written
+        for number, row in enumerate(stream_rows(session, spec.stmt), start=1):
+            yield spec.convert(number, row)
+            written = number
+            if number % EXPORT_BATCH_ROWS == 0:
+                if should_stop and should_stop():
+                    raise ExportCancelled()
+                if progress:
+                    progress(number)
+
+    # Scrittura su un file temporaneo: in caso di errore o annullamento il file scelto non viene toccato
+    tmp_path = path + ".part"
+    try:
+        writer(tmp_path, spec, rows())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if progress:
+        progress(written)
+    return written
@@ -1,38 +1,26 @@
-import pandas as pd
 from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QPushButton, 
                              QLabel, QFileDialog, QTableWidget, QTableWidgetItem, 
                              QComboBox, QFormLayout, QGroupBox, QMessageBox, QProgressBar)
 from PySide6.QtCore import Qt
-import datetime
-from database import get_session, Athlete, MedicalCertificate, DatabaseManager
-from cf_utils import parse_cf, get_comune_name
+from importer import IGNORE_COLUMN, IMPORT_FIELDS, auto_mapping, read_header, estimate_row_count
+from workers import ImportWorker
 from conflict_dialog import ConflictDialog
 from global_conflict_dialog import GlobalConflictDialog
 
 class ImportDialog(QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, backup_options=None):
         super().__init__(parent)
         self.setWindowTitle("Importa Dati Atleti")
         self.setMinimumSize(600, 500)
         
-        self.df = None
+        self.file_path = None
+        self.backup_options = backup_options  # Backup del database prima di importare (None = no)
+        self.columns = []
+        self.worker = None
         self.mapping = {}
-        self.db_fields = {
-            "Nome": "name",
-            "Cognome": "surname",
-            "Codice Fiscale": "tax_code",
-            "Data di Nascita": "birth_date",
-            "Luogo di Nascita": "birth_place",
-            "Indirizzo": "address",
-            "Telefono": "phone",
-            "Email": "email",
-            "Tipo Certificato": "cert_type",
-            "Scadenza Certificato": "cert_expiry",
-            "Colore Cintura": "current_belt",
-            "Grado": "current_rank",
-            "Numero Tessera ASC": "asc_number",
-            "Ruoli": "roles"
-        }
+        self.db_fields = IMPORT_FIELDS
+        # Id degli atleti creati/aggiornati dall'importazione (come in AthleteDialog)
+        self.changes = {"created": set(), "updated": set(), "deleted": set()}
         
         self.setup_ui()
 
@@ -55,7 +43,7 @@ class ImportDialog(QDialog):
         
         for label, key in self.db_fields.items():
             combo = QComboBox()
-            combo.addItem("- Non Importare -")
+            combo.addItem(IGNORE_COLUMN)
             self.mapping_form.addRow(label, combo)
             self.combos[key] = combo
             
@@ -66,6 +54,9 @@ class ImportDialog(QDialog):
         self.progress = QProgressBar()
         self.progress.setVisible(False)
         layout.addWidget(self.progress)
+        self.lbl_status = QLabel("")
+        self.lbl_status.setVisible(False)
+        layout.addWidget(self.lbl_status)
         
         # Buttons
         btn_layout = QHBoxLayout()
@@ -73,12 +64,12 @@ class ImportDialog(QDialog):
         self.btn_import.setEnabled(False)
         self.btn_import.clicked.connect(self.start_import)
         
-        btn_cancel = QPushButton("Chiudi")
-        btn_cancel.clicked.connect(self.reject)
+        self.btn_close = QPushButton("Chiudi")
+        self.btn_close.clicked.connect(self.reject)
         
         btn_layout.addStretch()
         btn_layout.addWidget(self.btn_import)
-        btn_layout.addWidget(btn_cancel)
+        btn_layout.addWidget(self.btn_close)
         layout.addLayout(btn_layout)
 
     def browse_file(self):
@@ -89,10 +80,9 @@ class ImportDialog(QDialog):
             return
             
         try:
-            if file_path.endswith('.csv'):
-                self.df = pd.read_csv(file_path)
-            else:
-                self.df = pd.read_excel(file_path)
+            # Only the header is read here: rows are streamed during the import
+            self.columns = read_header(file_path)
+            self.file_path = file_path
             
             self.lbl_file.setText(file_path.split('/')[-1])
             self.populate_combos()
@@ -103,22 +93,32 @@ class ImportDialog(QDialog):
             QMessageBox.critical(self, "Errore", f"Impossibile leggere il file: {str(e)}")
 
     def populate_combos(self):
-        columns = self.df.columns.tolist()
+        columns = self.columns
+        # Try auto-mapping by name
+        mapping = auto_mapping(columns)
         for key, combo in self.combos.items():
             combo.clear()
-            combo.addItem("- Non Importare -")
+            combo.addItem(IGNORE_COLUMN)
             combo.addItems(columns)
-            
-            # Try auto-mapping by name
-            for col in columns:
-                if col.lower() in [key.lower(), self.get_label_for_key(key).lower()]:
-                    combo.setCurrentText(col)
-                    break
+            if key in mapping:
+                combo.setCurrentText(mapping[key])
+
+    def get_mapping(self):
+        """Campo db -> colonna del file, solo per i campi da importare"""
+        return {key: combo.currentText() for key, combo in self.combos.items()
+                if combo.currentText() != IGNORE_COLUMN}
 
-    def get_label_for_key(self, key):
-        for label, k in self.db_fields.items():
-            if k == key: return label
-        return ""
+    def resolve_conflict(self, athlete, row_data):
+        diag = ConflictDialog(f"{athlete.name} {athlete.surname}", athlete, row_data, self)
+        if diag.exec() == QDialog.Accepted:
+            return diag.get_final_data()
+        return None
+
+    def ask_strategy(self, conflict_count):
+        global_diag = GlobalConflictDialog(conflict_count, self)
+        if global_diag.exec() == QDialog.Accepted:
+            return global_diag.strategy
+        return None # User cancelled
 
     def start_import(self):
         # Validate critical fields
@@ -126,124 +126,102 @@ class ImportDialog(QDialog):
             QMessageBox.warning(self, "Attenzione", "Le colonne Nome e Cognome sono obbligatorie per l'importazione.")
             return
 
+        total = estimate_row_count(self.file_path)
         self.progress.setVisible(True)
-        self.progress.setMaximum(len(self.df))
-        
-        session = get_session()
-        
-        # 0. PRE-CHECK FOR CONFLICTS
-        conflicts_found = []
-        rows_to_process = []
-        
-        for index, row in self.df.iterrows():
-            # Prepare row data
-            row_data = {}
-            for key, combo in self.combos.items():
-                col = combo.currentText()
-                if col == "- Non Importare -" or pd.isna(row[col]): continue
-                val = row[col]
-                if key in ["birth_date", "cert_expiry"]:
-                    if not isinstance(val, (datetime.date, datetime.datetime)):
-                        try: val = pd.to_datetime(val).date()
-                        except: pass
-                if key == "tax_code": val = str(val).strip().upper()
-                row_data[key] = val
-            
-            # Extract from CF
-            if "tax_code" in row_data:
-                cf_data = parse_cf(row_data["tax_code"])
-                if cf_data:
-                    if "birth_date" not in row_data or not row_data["birth_date"]:
-                        row_data["birth_date"] = cf_data["birth_date"]
-                    if "birth_place" not in row_data or not row_data["birth_place"]:
-                        row_data["birth_place"] = get_comune_name(cf_data["comune_code"])
-
-            rows_to_process.append(row_data)
-            
-            # Identify conflict
-            if "tax_code" in row_data:
-                athlete = session.query(Athlete).filter_by(tax_code=row_data["tax_code"]).first()
-                if athlete:
-                    has_diff = False
-                    for k, v in row_data.items():
-                        if k in ["cert_type", "cert_expiry"]: continue
-                        db_val = getattr(athlete, k, None)
-                        if str(db_val or "").strip().lower() != str(v or "").strip().lower() and str(v or "").strip() != "":
-                            has_diff = True
-                            break
-                    if has_diff:
-                        conflicts_found.append((index, athlete, row_data))
-
-        strategy = "manual"
-        if len(conflicts_found) > 0:
-            global_diag = GlobalConflictDialog(len(conflicts_found), self)
-            if global_diag.exec() == QDialog.Accepted:
-                strategy = global_diag.strategy
-            else:
-                return # User cancelled
-
-        # 1. ACTUAL IMPORT LOOP
-        count = 0
-        errors = 0
-        
-        for index, row_data in enumerate(rows_to_process):
-            try:
-                athlete = None
-                if "tax_code" in row_data:
-                    athlete = session.query(Athlete).filter_by(tax_code=row_data["tax_code"]).first()
-                
-                is_conflict = any(c[0] == index for c in conflicts_found)
-                
-                if athlete and is_conflict:
-                    if strategy == "overwrite_all":
-                        for k, v in row_data.items():
-                            if k not in ["cert_type", "cert_expiry"] and hasattr(athlete, k):
-                                setattr(athlete, k, v)
-                    elif strategy == "keep_current":
-                        pass # Don't update athlete fields
-                    else: # manual
-                        diag = ConflictDialog(f"{athlete.name} {athlete.surname}", athlete, row_data, self)
-                        if diag.exec() == QDialog.Accepted:
-                            merged = diag.get_final_data()
-                            for k, v in merged.items():
-                                setattr(athlete, k, v)
-                        else:
-                            self.progress.setValue(index + 1)
-                            continue
-                elif not athlete:
-                    athlete = Athlete()
-                    session.add(athlete)
-                    for k, v in row_data.items():
-                        if k not in ["cert_type", "cert_expiry"] and hasattr(athlete, k):
-                            setattr(athlete, k, v)
-                
-                # Certificate handling (same logic as before)
-                ctype = row_data.get("cert_type", "Agonistico")
-                expiry = row_data.get("cert_expiry")
-                if expiry:
-                    session.flush()
-                    existing_cert = session.query(MedicalCertificate).filter_by(athlete_id=athlete.id).order_by(MedicalCertificate.expiry_date.desc()).first()
-                    if existing_cert:
-                        if existing_cert.expiry_date < expiry:
-                            existing_cert.cert_type = ctype
-                            existing_cert.expiry_date = expiry
-                    else:
-                        new_cert = MedicalCertificate(cert_type=ctype, expiry_date=expiry, athlete_id=athlete.id)
-                        session.add(new_cert)
-
-                count += 1
-            except Exception as e:
-                print(f"Error importing row {index}: {e}")
-                errors += 1
-            
-            self.progress.setValue(index + 1)
-            
-        try:
-            session.commit()
-            QMessageBox.information(self, "Fine Importazione", f"Completato! Importati/Aggiornati {count} atleti.\nErrori: {errors}")
-            self.accept()
-        except Exception as e:
-            session.rollback()
-            QMessageBox.critical(self, "Errore", f"Errore durante il salvataggio: {e}")
-        finally:
-            session.close()
+        self.progress.setMaximum(total)
+        self.progress.setValue(0)
+        self.lbl_status.setText("Backup di sicurezza del database..." if self.backup_options is not None
+                                else "Avvio importazione...")
+        self.lbl_status.setVisible(True)
+        self.set_running(True)
+
+        # The import runs on its own thread and session: the dialog only shows progress
+        self.worker = ImportWorker(self.file_path, self.get_mapping(), total,
+                                   backup_options=self.backup_options, parent=self)
+        self.worker.progressChanged.connect(self.on_progress)
+        self.worker.strategyRequested.connect(self.on_strategy_requested, Qt.BlockingQueuedConnection)
+        self.worker.conflictRequested.connect(self.on_conflict_requested, Qt.BlockingQueuedConnection)
+        self.worker.completed.connect(self.on_import_completed)
+        self.worker.failed.connect(self.on_import_failed)
+        self.worker.start()
+
+    def set_running(self, running):
+        self.group_mapping.setEnabled(not running)
+        self.btn_import.setEnabled(not running)
+        self.btn_close.setText("Annulla" if running else "Chiudi")
+        self.btn_close.setEnabled(True)
+
+    def is_running(self):
+        return self.worker is not None and self.worker.isRunning()
+
+    def reject(self):
+        if self.is_running():
+            # Il blocco in corso viene annullato, quelli già salvati restano
+            self.worker.cancel()
+            self.btn_close.setEnabled(False)
+            self.lbl_status.setText("Annullamento in corso...")
+            return
+        super().reject()
+
+    def on_progress(self, done, total, rate, eta):
+        self.progress.setMaximum(total)
+        self.progress.setValue(done)
+        status = f"{done} / {total} righe - {rate:.0f} righe/s"
+        if eta >= 0:
+            minutes, seconds = divmod(int(eta), 60)
+            status += f" - tempo stimato {minutes}:{seconds:02d}"
+        self.lbl_status.setText(status)
+
+    def on_strategy_requested(self, conflict_count):
+        self.worker.answer = self.ask_strategy(conflict_count)
+
+    def on_conflict_requested(self, athlete, row_data):
+        self.worker.answer = self.resolve_conflict(athlete, row_data)
+
+    def finish_worker(self):
+        self.worker.wait()
+        self.worker = None
+        self.set_running(False)
+
+    def collect_changes(self, result):
+        self.changes["created"] |= set(result["created_ids"])
+        self.changes["updated"] |= set(result["updated_ids"])
+
+    def show_result(self, icon, title, text, messages):
+        """Esito dell'importazione; le righe non importate sono nei dettagli del messaggio"""
+        box = QMessageBox(icon, title, text, QMessageBox.Ok, self)
+        if messages:
+            box.setText(f"{text}\n\nRighe con errori o saltate: vedere i dettagli.")
+            box.setDetailedText("\n".join(messages))
+        box.exec()
+
+    def on_import_completed(self, result):
+        self.finish_worker()
+        self.collect_changes(result)
+        if result["cancelled"] and not result["imported"]:
+            self.lbl_status.setText("Importazione annullata.")
+            return
+        if result["cancelled"]:
+            self.show_result(QMessageBox.Information, "Importazione Interrotta",
+                             f"Importazione interrotta: {result['imported']} atleti importati/aggiornati "
+                             f"prima dell'interruzione restano nel database.\nErrori: {result['errors']}",
+                             result["messages"])
+        else:
+            self.show_result(QMessageBox.Information, "Fine Importazione",
+                             f"Completato! Importati/Aggiornati {result['imported']} atleti.\nErrori: {result['errors']}",
+                             result["messages"])
+        self.accept()
+
+    def on_import_failed(self, error, partial):
+        self.finish_worker()
+        self.lbl_status.setText("")
+        if not partial or not (partial["created_ids"] or partial["updated_ids"]):
+            QMessageBox.critical(self, "Errore", f"Errore durante il salvataggio: {error}")
+            return
+        # I blocchi salvati prima dell'errore restano nel database: la finestra principale
+        # deve aggiornare quelle righe
+        self.collect_changes(partial)
+        self.show_result(QMessageBox.Critical, "Errore", f"Errore durante il salvataggio: {error}\n\n"
+                         f"Prima dell'errore sono stati importati/aggiornati {partial['imported']} atleti, "
+                         "che restano nel database.", partial["messages"])
+        self.accept()
@@ -0,0 +1,543 @@
+"""
+Logica di importazione atleti indipendente dall'interfaccia Qt.
+
+Le letture sul database sono fatte a blocchi con IN (...) e le scritture con
+istruzioni bulk (INSERT ... ON CONFLICT(tax_code) DO UPDATE, UPDATE/INSERT
+in executemany), invece di una query per riga.
+
+I file vengono letti a blocchi (run_import): ogni blocco è validato, controllato
+per i conflitti e salvato prima di leggere il successivo, così la memoria resta
+costante anche per file con centinaia di migliaia di righe.
+"""
+import datetime
+from collections import namedtuple
+import pandas as pd
+from sqlalchemy import select, func, update, insert, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import Athlete, MedicalCertificate, write_transaction
+from cf_utils import get_comune_names, parse_cf_batch
+
+athletes = Athlete.__table__
+certificates = MedicalCertificate.__table__
+
+IGNORE_COLUMN = "- Non Importare -"
+
+# Campi importabili: etichetta mostrata -> campo del database
+IMPORT_FIELDS = {
+    "Nome": "name",
+    "Cognome": "surname",
+    "Codice Fiscale": "tax_code",
+    "Data di Nascita": "birth_date",
+    "Luogo di Nascita": "birth_place",
+    "Indirizzo": "address",
+    "Telefono": "phone",
+    "Email": "email",
+    "Tipo Certificato": "cert_type",
+    "Scadenza Certificato": "cert_expiry",
+    "Colore Cintura": "current_belt",
+    "Grado": "current_rank",
+    "Numero Tessera ASC": "asc_number",
+    "Ruoli": "roles"
+}
+
+# Strategie di risoluzione dei conflitti (vedi GlobalConflictDialog)
+STRATEGY_MANUAL = "manual"
+STRATEGY_OVERWRITE_ALL = "overwrite_all"
+STRATEGY_KEEP_CURRENT = "keep_current"
+
+CERT_KEYS = ("cert_type", "cert_expiry")
+DATE_KEYS = ("birth_date", "cert_expiry")
+DEFAULT_CERT_TYPE = "Agonistico"
+
+# Parametri per ogni IN (...): ampiamente sotto il limite di variabili di SQLite
+CHUNK_SIZE = 500
+
+# Righe del file lette, controllate e salvate per ogni transazione
+STREAM_CHUNK_ROWS = 5000
+
+class ImportFailed(Exception):
+    """Errore durante run_import: i blocchi già salvati restano, partial ne riporta i risultati"""
+
+    def __init__(self, message, partial):
+        super().__init__(message)
+        self.partial = partial
+
+def chunked(items, size=CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+# --- LETTURA FILE A BLOCCHI ---
+
+def _is_csv(path):
+    return path.lower().endswith('.csv')
+
+def _is_xlsx(path):
+    return path.lower().endswith(('.xlsx', '.xlsm'))
+
+def auto_mapping(columns):
+    """Campo db -> colonna del file, per le colonne che si chiamano come il campo o la sua etichetta"""
+    mapping = {}
+    for label, key in IMPORT_FIELDS.items():
+        for col in columns:
+            if str(col).lower() in [key.lower(), label.lower()]:
+                mapping[key] = col
+                break
+    return mapping
+
+def read_header(path):
+    """Solo l'intestazione del file, per la mappatura delle colonne"""
+    if _is_csv(path):
+        return pd.read_csv(path, nrows=0).columns.tolist()
+    if _is_xlsx(path):
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            header = next(wb.active.iter_rows(max_row=1, values_only=True), ())
+            return [str(c) for c in header if c is not None]
+        finally:
+            wb.close()
+    return pd.read_excel(path, nrows=0).columns.tolist()
+
+def estimate_row_count(path):
+    """Numero di righe dati (stima per la barra di avanzamento, 0 se ignoto)"""
+    if _is_csv(path):
+        lines = 0
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                lines += block.count(b'\n')
+        return max(lines - 1, 0)
+    if _is_xlsx(path):
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True)
+        try:
+            return max((wb.active.max_row or 1) - 1, 0)
+        finally:
+            wb.close()
+    return 0
+
+def iter_file_chunks(path, chunksize=STREAM_CHUNK_ROWS):
+    """DataFrame successivi di al massimo chunksize righe"""
+    if _is_csv(path):
+        # dtype=str: i tipi non vengono dedotti blocco per blocco (es. telefoni come float)
+        yield from pd.read_csv(path, chunksize=chunksize, dtype=str)
+    elif _is_xlsx(path):
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = [str(c) if c is not None else f"_col{i}" for i, c in enumerate(next(rows, ()))]
+            buffer = []
+            for values in rows:
+                if not any(v is not None for v in values):
+                    continue # Riga vuota
+                buffer.append(values[:len(header)])
+                if len(buffer) >= chunksize:
+                    yield pd.DataFrame(buffer, columns=header)
+                    buffer = []
+            if buffer:
+                yield pd.DataFrame(buffer, columns=header)
+        finally:
+            wb.close()
+    else:
+        # .xls (xlrd) non supporta la lettura in streaming
+        df = pd.read_excel(path)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize]
+
+# --- PREPARAZIONE RIGHE ---
+
+def _to_dates(series):
+    """
+    Converte una colonna in datetime.date con to_datetime vettoriale.
+    I valori non interpretabili restano come sono (la riga verrà segnalata come errore).
+    """
+    present = series.notna()
+    parsed = pd.to_datetime(series, errors="coerce")
+    # Formati misti: solo i valori non riconosciuti al primo passaggio vengono rianalizzati
+    retry = present & parsed.isna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(series[retry].astype(str), errors="coerce", format="mixed")
+    dates = pd.Series(parsed.dt.date, index=series.index, dtype=object)
+    return dates.where(parsed.notna(), series.where(present, None))
+
+def _decode_cf(tax_codes):
+    """Data di nascita e codice comune dai codici fiscali, per l'intera colonna"""
+    data = parse_cf_batch(tax_codes)
+    birth = pd.Series(pd.to_datetime(data["birth_date"]), index=tax_codes.index)
+    comune = pd.Series(data["comune_code"], index=tax_codes.index, dtype=object)
+    return birth, comune.where(birth.notna())
+
+def prepare_chunk(df, mapping):
+    """
+    Converte un blocco del file nei campi del database, colonna per colonna.
+    mapping: campo db -> nome colonna del file (solo i campi da importare).
+    Ritorna una lista di dict senza i campi vuoti.
+    """
+    # Mapped columns renamed in one pass (a file column may feed more than one field)
+    frame = pd.DataFrame({key: df[col] for key, col in mapping.items()}, index=df.index)
+
+    for key in DATE_KEYS:
+        if key in frame:
+            frame[key] = _to_dates(frame[key])
+
+    if "tax_code" in frame:
+        codes = frame["tax_code"]
+        frame["tax_code"] = codes.where(codes.isna(), codes.astype(str).str.strip().str.upper())
+
+        # Extract from CF
+        birth, comune = _decode_cf(frame["tax_code"])
+        if "birth_date" not in frame:
+            frame["birth_date"] = None
+        missing_date = frame["birth_date"].isna() & birth.notna()
+        frame.loc[missing_date, "birth_date"] = pd.Series(birth[missing_date].dt.date, dtype=object)
+
+        if "birth_place" not in frame:
+            frame["birth_place"] = None
+        place = frame["birth_place"]
+        missing_place = (place.isna() | (place.astype(str) == "")) & comune.notna()
+        if missing_place.any():
+            # Nome del comune valido alla data di nascita (comuni soppressi o rinominati)
+            frame.loc[missing_place, "birth_place"] = get_comune_names(comune[missing_place].to_numpy(),
+                                                                       as_of=birth[missing_place].to_numpy())
+
+    # Records emitted only at the end, without empty fields
+    frame = frame.astype(object).where(frame.notna(), None)
+    return [{k: v for k, v in record.items() if v is not None}
+            for record in frame.to_dict("records")]
+
+def validate_row(row_data):
+    """Ritorna un messaggio di errore se la riga non può essere importata"""
+    if not row_data.get("tax_code"):
+        return "Codice Fiscale mancante"
+    for key in DATE_KEYS:
+        if key in row_data and not isinstance(row_data[key], datetime.date):
+            return f"Data non valida in '{key}': {row_data[key]}"
+    return None
+
+# --- LETTURE IN BLOCCO ---
+
+def fetch_existing_athletes(session, tax_codes):
+    """Atleti già presenti, indicizzati per codice fiscale (letti a blocchi)"""
+    existing = {}
+    for chunk in chunked(set(tax_codes)):
+        for row in session.execute(select(athletes).where(athletes.c.tax_code.in_(chunk))):
+            existing[row.tax_code] = row
+    return existing
+
+def fetch_latest_certificates(session, athlete_ids):
+    """Certificato più recente per atleta: athlete_id -> dict(id, cert_type, expiry_date)"""
+    latest = {}
+    for chunk in chunked(set(athlete_ids)):
+        ranked = (select(certificates.c.id, certificates.c.athlete_id, certificates.c.cert_type,
+                         certificates.c.expiry_date,
+                         func.row_number().over(partition_by=certificates.c.athlete_id,
+                                                order_by=certificates.c.expiry_date.desc()).label("rn"))
+                  .where(certificates.c.athlete_id.in_(chunk))
+                  .subquery())
+        stmt = select(ranked.c.id, ranked.c.athlete_id, ranked.c.cert_type, ranked.c.expiry_date).where(ranked.c.rn == 1)
+        for row in session.execute(stmt):
+            latest[row.athlete_id] = {"id": row.id, "cert_type": row.cert_type, "expiry_date": row.expiry_date}
+    return latest
+
+# --- CONFLITTI ---
+
+def has_differences(existing, row_data):
+    for k, v in row_data.items():
+        if k in CERT_KEYS: continue
+        db_val = getattr(existing, k, None)
+        if str(db_val or "").strip().lower() != str(v or "").strip().lower() and str(v or "").strip() != "":
+            return True
+    return False
+
+def find_conflicts(rows, existing, seen=None):
+    """
+    Indice riga -> atleta esistente, per le righe che modificherebbero dati presenti.
+    seen: codici fiscali delle righe valide già incontrate nel file, aggiornato qui (run_import
+    lo conserva tra i blocchi). Un codice ripetuto non è un conflitto: i campi dell'atleta
+    vengono dalla sua prima riga, le successive aggiungono solo il certificato.
+    """
+    seen = set() if seen is None else seen
+    conflicts = {}
+    for index, row_data in enumerate(rows):
+        cf = row_data.get("tax_code")
+        if cf in seen:
+            continue
+        athlete = existing.get(cf)
+        if athlete is not None and has_differences(athlete, row_data):
+            conflicts[index] = athlete
+        if validate_row(row_data) is None:
+            seen.add(cf)
+    return conflicts
+
+# --- SCRITTURA ---
+
+def athlete_fields(row_data):
+    return {k: v for k, v in row_data.items() if k not in CERT_KEYS and k in athletes.c and k != "id"}
+
+def _upsert_athletes(session, values, columns):
+    """
+    INSERT ... ON CONFLICT(tax_code) DO UPDATE in executemany.
+    I valori None non sovrascrivono quelli presenti (COALESCE), così righe con
+    campi diversi possono condividere la stessa istruzione.
+    """
+    if not values:
+        return
+    columns = sorted(columns | {"tax_code"})
+    params = [{c: v.get(c) for c in columns} for v in values]
+    stmt = sqlite_insert(athletes)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[athletes.c.tax_code],
+        set_={c: func.coalesce(stmt.excluded[c], athletes.c[c]) for c in columns if c != "tax_code"},
+    )
+    session.execute(stmt, params)
+
+# Scritture di un blocco preparate da plan_rows, senza accessi al database.
+# athlete_values: valori per l'upsert; lines: codice fiscale -> righe del file importate
+WritePlan = namedtuple("WritePlan", "result athlete_values upsert_columns touched cert_rows lines")
+
+def plan_rows(rows, existing, conflicts, strategy, resolve_conflict=None, progress=None, row_offset=0):
+    """
+    Prepara le scritture del blocco: validazione e scelte sui conflitti, senza scrivere.
+    resolve_conflict(athlete, row_data) è usato con la strategia manuale e ritorna i campi
+    da sovrascrivere (dict) o None per saltare la riga.
+    row_offset: righe del file già elaborate nei blocchi precedenti (per messaggi e avanzamento).
+    """
+    result = {"imported": 0, "errors": 0, "skipped": 0, "messages": [],
+              "created_ids": set(), "updated_ids": set()}
+    athlete_values = []        # Righe per l'upsert
+    upsert_columns = set()
+    touched = set()            # Codici fiscali già scritti in questa importazione
+    cert_rows = []             # (tax_code, cert_type, expiry)
+    lines = {}
+
+    for index, row_data in enumerate(rows):
+        line = row_offset + index + 1
+        error = validate_row(row_data)
+        if error:
+            result["errors"] += 1
+            result["messages"].append(f"Riga {line}: {error}")
+            if progress: progress(line)
+            continue
+
+        cf = row_data["tax_code"]
+        athlete = existing.get(cf)
+        values = None
+
+        if athlete is not None and index in conflicts:
+            # Solo la prima riga di un codice fiscale ripetuto nel file è tra i conflitti
+            # (find_conflicts): le successive aggiungono solo il certificato
+            if strategy == STRATEGY_OVERWRITE_ALL:
+                values = athlete_fields(row_data)
+            elif strategy == STRATEGY_KEEP_CURRENT:
+                pass # Don't update athlete fields
+            else: # manual
+                chosen = resolve_conflict(athlete, row_data) if resolve_conflict else None
+                if chosen is None:
+                    result["skipped"] += 1
+                    if progress: progress(line)
+                    continue
+                # Valori tipizzati della riga per i soli campi scelti
+                values = {k: row_data[k] for k in chosen if k in row_data}
+                values = athlete_fields(values)
+            if values:
+                # NOT NULL viene verificato prima dell'ON CONFLICT: riporta i valori attuali
+                # (ancora validi alla scrittura: lo garantisce il controllo di versione)
+                values.setdefault("name", athlete.name)
+                values.setdefault("surname", athlete.surname)
+                result["updated_ids"].add(athlete.id)
+        elif athlete is None and cf not in touched:
+            values = athlete_fields(row_data)
+            if not values.get("name") or not values.get("surname"):
+                result["errors"] += 1
+                result["messages"].append(f"Riga {line}: Nome e Cognome obbligatori per un nuovo atleta")
+                if progress: progress(line)
+                continue
+
+        if values:
+            values["tax_code"] = cf
+            athlete_values.append(values)
+            upsert_columns.update(values.keys())
+            touched.add(cf)
+
+        if row_data.get("cert_expiry"):
+            cert_rows.append((cf, row_data.get("cert_type", DEFAULT_CERT_TYPE), row_data["cert_expiry"]))
+
+        lines.setdefault(cf, []).append(line)
+        result["imported"] += 1
+        if progress: progress(line)
+
+    return WritePlan(result, athlete_values, upsert_columns, touched, cert_rows, lines)
+
+def find_stale(session, plan, existing):
+    """
+    Codici fiscali cambiati da un'altra postazione dopo la lettura di 'existing':
+    atleti da scrivere con una versione diversa (o creati nel frattempo), oppure
+    eliminati mentre se ne importava il certificato.
+    """
+    tax_codes = plan.touched | {c[0] for c in plan.cert_rows}
+    current = {}
+    for chunk in chunked(tax_codes):
+        for cf, version in session.execute(select(athletes.c.tax_code, athletes.c.version)
+                                           .where(athletes.c.tax_code.in_(chunk))):
+            current[cf] = version
+    stale = set()
+    for cf in tax_codes:
+        read = existing.get(cf)
+        if cf in plan.touched:
+            if (read.version if read is not None else None) != current.get(cf):
+                stale.add(cf)
+        elif read is not None and cf not in current:
+            stale.add(cf)
+    return stale
+
+def write_plan(session, plan, existing):
+    """
+    Esegue le scritture preparate da plan_rows. Va chiamata dentro la transazione di
+    scrittura (database.write_transaction): le righe degli atleti cambiati nel frattempo
+    (find_stale) non vengono scritte e sono contate tra le saltate, senza perdere le
+    modifiche dell'altra postazione. Può essere ripetuta: 'plan' non viene modificato.
+    Ritorna un dict con i contatori e gli id creati/aggiornati. Il commit è a carico del chiamante.
+    """
+    result = dict(plan.result, messages=list(plan.result["messages"]),
+                  created_ids=set(plan.result["created_ids"]), updated_ids=set(plan.result["updated_ids"]))
+    athlete_values, cert_rows = plan.athlete_values, plan.cert_rows
+    stale = find_stale(session, plan, existing)
+    if stale:
+        for cf in sorted(stale, key=lambda c: plan.lines[c][0]):
+            result["imported"] -= len(plan.lines[cf])
+            result["skipped"] += len(plan.lines[cf])
+            result["messages"].append(f"Riga {plan.lines[cf][0]}: atleta {cf} modificato da un'altra "
+                                      "postazione durante l'importazione, riga non importata")
+            if cf in existing:
+                result["updated_ids"].discard(existing[cf].id)
+        athlete_values = [v for v in athlete_values if v["tax_code"] not in stale]
+        cert_rows = [c for c in cert_rows if c[0] not in stale]
+
+    _upsert_athletes(session, athlete_values, plan.upsert_columns)
+
+    # Id degli atleti appena creati
+    ids = {cf: a.id for cf, a in existing.items()}
+    new_cfs = [cf for cf in (plan.touched - stale) | {c[0] for c in cert_rows} if cf not in ids]
+    for chunk in chunked(new_cfs):
+        for athlete_id, cf in session.execute(select(athletes.c.id, athletes.c.tax_code).where(athletes.c.tax_code.in_(chunk))):
+            ids[cf] = athlete_id
+            result["created_ids"].add(athlete_id)
+
+    _write_certificates(session, cert_rows, ids, result)
+    return result
+
+def _write_certificates(session, cert_rows, ids, result):
+    """Aggiorna il certificato più recente se la nuova scadenza è successiva, altrimenti lo crea"""
+    if not cert_rows:
+        return
+    latest = fetch_latest_certificates(session, [ids[cf] for cf, _, _ in cert_rows if cf in ids])
+    updates = {}
+    inserts = []
+    for cf, ctype, expiry in cert_rows:
+        athlete_id = ids.get(cf)
+        if athlete_id is None:
+            continue
+        current = latest.get(athlete_id)
+        if current is None:
+            current = {"id": None, "athlete_id": athlete_id, "cert_type": ctype, "expiry_date": expiry}
+            inserts.append(current)
+            latest[athlete_id] = current
+        elif current["expiry_date"] < expiry:
+            current["cert_type"] = ctype
+            current["expiry_date"] = expiry
+            if current["id"] is not None:
+                updates[current["id"]] = current
+        else:
+            continue
+        if athlete_id not in result["created_ids"]:
+            result["updated_ids"].add(athlete_id)
+
+    if updates:
+        stmt = (update(certificates).where(certificates.c.id == bindparam("cert_id"))
+                .values(cert_type=bindparam("cert_type"), expiry_date=bindparam("expiry_date")))
+        session.execute(stmt, [{"cert_id": cid, "cert_type": c["cert_type"], "expiry_date": c["expiry_date"]}
+                               for cid, c in updates.items()])
+    if inserts:
+        session.execute(insert(certificates), [{"athlete_id": c["athlete_id"], "cert_type": c["cert_type"],
+                                                "expiry_date": c["expiry_date"]} for c in inserts])
+
+# --- IMPORTAZIONE COMPLETA ---
+
+def count_conflicts(session, path, mapping, chunksize=STREAM_CHUNK_ROWS, should_stop=None):
+    """
+    Righe in conflitto in tutto il file, lette a blocchi come in run_import ma senza
+    scrivere: la strategia viene chiesta una volta, con il totale, prima del primo salvataggio.
+    """
+    count = 0
+    seen = set()
+    for df in iter_file_chunks(path, chunksize):
+        if should_stop and should_stop():
+            break
+        rows = prepare_chunk(df, mapping)
+        existing = fetch_existing_athletes(session, [r["tax_code"] for r in rows if r.get("tax_code")])
+        count += len(find_conflicts(rows, existing, seen))
+    return count
+
+def run_import(session, path, mapping, ask_strategy, resolve_conflict=None, progress=None,
+               chunksize=STREAM_CHUNK_ROWS, should_stop=None, strategy=None):
+    """
+    Importa il file a blocchi, con un commit per blocco.
+    strategy: strategia per tutto il file, se già scelta. Altrimenti, prima di scrivere, i
+    conflitti dell'intero file vengono contati (count_conflicts) e ask_strategy(conflict_count)
+    ritorna la strategia, oppure None per annullare senza aver salvato nulla. Se un blocco ha
+    conflitti non previsti (atleti cambiati nel frattempo da un'altra postazione) e nessuna
+    strategia è stata scelta, la domanda viene ripetuta per quel blocco.
+    Le domande all'utente avvengono prima della scrittura: il database resta bloccato
+    solo per le istruzioni del blocco (write_transaction, ripetuta se occupato).
+    should_stop() viene consultata tra un blocco e l'altro e prima di ogni scrittura:
+    se ritorna True il blocco in corso non viene scritto.
+    Ritorna il dict dei risultati cumulati ("cancelled" = True se interrotta); in caso di
+    errore solleva ImportFailed con i risultati dei blocchi già salvati.
+    """
+    totals = {"imported": 0, "errors": 0, "skipped": 0, "messages": [],
+              "created_ids": set(), "updated_ids": set(), "cancelled": False}
+    offset = 0
+    seen = set()  # Codici fiscali delle righe già elaborate, in tutti i blocchi
+
+    if strategy is None:
+        conflict_count = count_conflicts(session, path, mapping, chunksize, should_stop)
+        if conflict_count:
+            strategy = ask_strategy(conflict_count)
+            if strategy is None:
+                totals["cancelled"] = True
+                return totals
+
+    try:
+        for df in iter_file_chunks(path, chunksize):
+            if should_stop and should_stop():
+                totals["cancelled"] = True
+                break
+            rows = prepare_chunk(df, mapping)
+            existing = fetch_existing_athletes(session, [r["tax_code"] for r in rows if r.get("tax_code")])
+            conflicts = find_conflicts(rows, existing, seen)
+
+            if conflicts and strategy is None:
+                strategy = ask_strategy(len(conflicts))
+                if strategy is None:
+                    totals["cancelled"] = True
+                    break
+
+            plan = plan_rows(rows, existing, conflicts, strategy or STRATEGY_MANUAL,
+                             resolve_conflict=resolve_conflict, progress=progress, row_offset=offset)
+            if should_stop and should_stop():
+                totals["cancelled"] = True
+                break
+            result = write_transaction(session, lambda: write_plan(session, plan, existing))
+
+            for key in ("imported", "errors", "skipped"):
+                totals[key] += result[key]
+            totals["messages"].extend(result["messages"])
+            totals["created_ids"] |= result["created_ids"]
+            totals["updated_ids"] |= result["updated_ids"] - totals["created_ids"]
+            offset += len(rows)
+    except Exception as e:
+        # I blocchi precedenti sono già salvati: chi chiama deve poterne aggiornare le viste
+        raise ImportFailed(str(e), totals) from e
+
+    return totals
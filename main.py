@@ -1,20 +1,85 @@
+import time
+# Riferimento per --profile-startup: istante in cui inizia il caricamento del programma
+STARTUP_T0 = time.perf_counter()
+
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QPushButton, QLabel, QTableWidget, 
-                             QTableWidgetItem, QHeaderView, QLineEdit, QFrame, 
+                             QTableWidgetItem, QTableView, QHeaderView, QLineEdit, QFrame, 
                              QMessageBox, QStackedWidget, QGridLayout, QComboBox,
                              QFormLayout, QGroupBox)
-from PySide6.QtCore import Qt, QSize
+from PySide6.QtCore import Qt, QSize, QTimer, QObject, QEvent
 from PySide6.QtGui import QFont
-from qt_material import apply_stylesheet
-from database import get_session, Athlete, MedicalCertificate, DatabaseManager
-from athlete_dialog import AthleteDialog
-from import_dialog import ImportDialog
+from database import get_session, DatabaseManager, PRAGMA_PROFILES, DEFAULT_PRAGMA_PROFILE
+from athlete_model import AthleteTableModel
+from queries import certificate_list_query, tax_code_list_query, athletes, ATHLETE_COLUMNS, DEFAULT_VISIBLE_COLUMNS
+from stats import get_dashboard_stats, invalidate_stats, athlete_snapshot, snapshot_cursor, adjust_dashboard_stats
+import bisect
 import datetime
 import sys
 import os
 
+# Moduli pesanti (pandas, NumPy, openpyxl, elenco comuni, qt_material) caricati al primo
+# utilizzo e non all'avvio: la maggior parte delle sessioni non importa né esporta nulla.
+# Tempo massimo di avvio a freddo fino alla prima visualizzazione (benchmark.py startup)
+STARTUP_BUDGET_MS = 1500
+
+# Controllo periodico del backup pianificato; il primo lontano dalla prima visualizzazione
+BACKUP_CHECK_MS = 15 * 60 * 1000
+BACKUP_FIRST_CHECK_MS = 30 * 1000
+
+THEME_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'theme_cache')
+
+def _theme_stamp(qt_material, theme):
+    """Versione di qt_material e date di template e tema, per il nome del file in cache"""
+    version = getattr(qt_material, "__version__", None)
+    if version is None:
+        from importlib.metadata import version as dist_version, PackageNotFoundError
+        try:
+            version = dist_version("qt-material")
+        except PackageNotFoundError:
+            version = "0"
+    theme_file = theme if os.path.exists(theme) else os.path.join(
+        os.path.dirname(os.path.abspath(qt_material.__file__)), "themes", theme)
+    theme_stamp = int(os.path.getmtime(theme_file)) if os.path.exists(theme_file) else 0
+    return f"{version}-{int(os.path.getmtime(qt_material.TEMPLATE_FILE))}-{theme_stamp}"
+
+def apply_theme(theme):
+    """
+    Applica il tema qt_material. Il foglio di stile generato dal template (jinja2, la parte
+    più lenta dell'avvio) viene salvato in theme_cache e riusato agli avvii successivi;
+    il file dipende dal tema, dalla versione di qt_material e dalle date del template e
+    del file XML del tema: un aggiornamento di qt_material rigenera il foglio di stile.
+    """
+    import qt_material
+    from PySide6.QtGui import QGuiApplication, QPalette, QColor
+    app = QApplication.instance()
+    cache_path = os.path.join(THEME_CACHE_DIR, f"{os.path.splitext(theme)[0]}-{_theme_stamp(qt_material, theme)}.qss")
+    if not os.path.exists(cache_path):
+        try:
+            os.makedirs(THEME_CACHE_DIR, exist_ok=True)
+            qt_material.apply_stylesheet(app, theme=theme, save_as=cache_path)
+        except OSError:
+            # Cartella non scrivibile: il tema viene generato a ogni avvio
+            qt_material.apply_stylesheet(app, theme=theme)
+        return
+
+    # Copia dei passi di qt_material.apply_stylesheet/build_stylesheet (font, icone, palette)
+    # senza il template: va ricontrollata quando si aggiorna qt_material
+    colors = qt_material.get_theme(theme)
+    if colors is None:
+        return
+    app.setStyle("Fusion")
+    qt_material.add_fonts()
+    qt_material.set_icons_theme(colors)
+    palette = QGuiApplication.palette()
+    color = QColor(*[int(colors["primaryColor"][i:i + 2], 16) for i in range(1, 6, 2)] + [92])
+    palette.setColor(QPalette.ColorRole.Text, color)
+    QGuiApplication.setPalette(palette)
+    with open(cache_path, encoding="utf-8") as f:
+        app.setStyleSheet(f.read())
+
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, db_path=None):
         super().__init__()
         self.setWindowTitle("Gestionale Karate ASD")
         self.setMinimumSize(1100, 750)
@@ -25,16 +90,26 @@ class MainWindow(QMainWindow):
         
         # Database Initialization
         self.db_manager = DatabaseManager()
-        db_path = self.settings.get("db_path")
+        # Database indicato con --db: solo per questa sessione, mai salvato nelle impostazioni
+        self.session_db_path = db_path
+        db_path = self.session_db_path or self.settings.get("db_path")
         
         if not db_path or not os.path.exists(db_path):
             db_path = self.prompt_select_database()
             if not db_path:
                 sys.exit(0) # Utente ha annullato
-            self.settings["db_path"] = db_path
-            self.save_settings_to_file()
+            if self.session_db_path:
+                self.session_db_path = db_path
+            else:
+                self.settings["db_path"] = db_path
+                self.save_settings_to_file()
             
-        self.db_manager.initialize(db_path)
+        self.db_manager.initialize(db_path, self.settings.get("db_profile"))
+        self.sync_worker = None
+        self.restore_progress = None
+        self.backup_worker = None
+        # (database, filtro, giorno, cursore del registro modifiche) della vista certificati caricata
+        self.cert_view_key = None
         
         # Main Layout
         central_widget = QWidget()
@@ -84,6 +159,11 @@ class MainWindow(QMainWindow):
         self.load_initial_theme()
         self.switch_view(0)
 
+        self.backup_timer = QTimer(self)
+        self.backup_timer.timeout.connect(self.run_scheduled_backup)
+        self.backup_timer.start(BACKUP_CHECK_MS)
+        QTimer.singleShot(BACKUP_FIRST_CHECK_MS, self.run_scheduled_backup)
+
     def switch_view(self, index):
         self.stack.setCurrentIndex(index)
         buttons = [self.btn_dashboard, self.btn_athletes, self.btn_certificates, self.btn_settings]
@@ -92,7 +172,8 @@ class MainWindow(QMainWindow):
         
         if index == 0: self.load_stats()
         elif index == 1: self.load_athletes()
-        elif index == 2: self.load_certificates_filter()
+        elif index == 2 and self.cert_view_key != self.current_cert_view_key():
+            self.load_certificates_filter()
 
     # --- VIEW SETUP METHODS ---
 
@@ -118,19 +199,89 @@ class MainWindow(QMainWindow):
         db_group = QGroupBox("Gestione Database")
         db_layout = QVBoxLayout(db_group)
         
-        self.lbl_current_db = QLabel(f"Percorso Attuale: <b>{self.settings.get('db_path')}</b>")
+        self.lbl_current_db = QLabel(f"Percorso Attuale: <b>{self.db_manager.db_path}</b>")
         self.lbl_current_db.setWordWrap(True)
         db_layout.addWidget(self.lbl_current_db)
         
+        profile_layout = QFormLayout()
+        self.combo_db_profile = QComboBox()
+        profile_labels = {
+            "bilanciato": "Bilanciato (WAL, consigliato)",
+            "prestazioni": "Prestazioni (database molto grandi)",
+            "sicuro": "Sicuro (massima durabilità)",
+            "rete": "Cartella di rete / NAS",
+        }
+        for key in PRAGMA_PROFILES:
+            self.combo_db_profile.addItem(profile_labels.get(key, key), key)
+        current_profile = self.settings.get("db_profile", DEFAULT_PRAGMA_PROFILE)
+        self.combo_db_profile.setCurrentIndex(max(0, self.combo_db_profile.findData(current_profile)))
+        profile_layout.addRow("Profilo Prestazioni:", self.combo_db_profile)
+
+        # Copia con cui sincronizzare (file .db, anche su una cartella condivisa)
+        sync_row = QHBoxLayout()
+        self.lbl_sync_remote = QLabel(self.settings.get("sync_remote") or "Non configurata")
+        self.lbl_sync_remote.setWordWrap(True)
+        btn_sync_remote = QPushButton("Scegli...")
+        btn_sync_remote.clicked.connect(self.prompt_sync_remote)
+        sync_row.addWidget(self.lbl_sync_remote, 1)
+        sync_row.addWidget(btn_sync_remote)
+        profile_layout.addRow("Copia Sincronizzazione:", sync_row)
+
+        # Backup a caldo (backup.py): pianificato, prima delle importazioni e manuale
+        from PySide6.QtWidgets import QSpinBox, QCheckBox
+        from backup import DEFAULT_INTERVAL_HOURS, DEFAULT_RETENTION
+        self.combo_backup_interval = QComboBox()
+        for label, hours in [("Disattivato", 0), ("Ogni 6 ore", 6), ("Ogni giorno", 24), ("Ogni settimana", 168)]:
+            self.combo_backup_interval.addItem(label, hours)
+        interval = self.settings.get("backup_interval_hours", DEFAULT_INTERVAL_HOURS)
+        self.combo_backup_interval.setCurrentIndex(max(0, self.combo_backup_interval.findData(interval)))
+        profile_layout.addRow("Backup Automatico:", self.combo_backup_interval)
+        self.spin_backup_retention = QSpinBox()
+        self.spin_backup_retention.setRange(1, 100)
+        self.spin_backup_retention.setValue(self.settings.get("backup_retention", DEFAULT_RETENTION))
+        profile_layout.addRow("Backup Conservati:", self.spin_backup_retention)
+        self.chk_backup_import = QCheckBox("Backup prima di ogni importazione")
+        self.chk_backup_import.setChecked(self.settings.get("backup_before_import", True))
+        profile_layout.addRow("", self.chk_backup_import)
+        backup_row = QHBoxLayout()
+        self.lbl_backup_dir = QLabel(self.settings.get("backup_dir") or "Accanto al database (cartella 'backup')")
+        self.lbl_backup_dir.setWordWrap(True)
+        btn_backup_dir = QPushButton("Scegli...")
+        btn_backup_dir.clicked.connect(self.prompt_backup_dir)
+        backup_row.addWidget(self.lbl_backup_dir, 1)
+        backup_row.addWidget(btn_backup_dir)
+        profile_layout.addRow("Cartella Backup:", backup_row)
+        self.lbl_last_backup = QLabel()
+        profile_layout.addRow("Ultimo Backup:", self.lbl_last_backup)
+        self.update_last_backup_label()
+        db_layout.addLayout(profile_layout)
+        
         db_btn_layout = QHBoxLayout()
         btn_change_db = QPushButton("Cambia / Ricollega Database")
         btn_change_db.clicked.connect(self.change_database)
         btn_sync_db = QPushButton("Sincronizza Ora (Cloud)")
         btn_sync_db.clicked.connect(self.sync_database)
         
+        btn_reindex = QPushButton("Ricostruisci Indice Ricerca")
+        btn_reindex.clicked.connect(self.rebuild_search_index)
+        
+        btn_check_cf = QPushButton("Verifica Codici Fiscali")
+        btn_check_cf.clicked.connect(self.validate_tax_codes)
+        
         db_btn_layout.addWidget(btn_change_db)
         db_btn_layout.addWidget(btn_sync_db)
+        db_btn_layout.addWidget(btn_reindex)
+        db_btn_layout.addWidget(btn_check_cf)
         db_layout.addLayout(db_btn_layout)
+
+        backup_btn_layout = QHBoxLayout()
+        btn_backup = QPushButton("Backup Ora")
+        btn_backup.clicked.connect(self.backup_database)
+        btn_restore = QPushButton("Ripristina Backup...")
+        btn_restore.clicked.connect(self.restore_database)
+        backup_btn_layout.addWidget(btn_backup)
+        backup_btn_layout.addWidget(btn_restore)
+        db_layout.addLayout(backup_btn_layout)
         layout.addWidget(db_group)
         
         btn_save = QPushButton("Salva Impostazioni")
@@ -163,27 +314,261 @@ class MainWindow(QMainWindow):
     def change_database(self):
         new_path = self.prompt_select_database()
         if new_path:
+            # Scelta esplicita: diventa il database predefinito anche se la sessione era con --db
+            self.session_db_path = None
             self.settings["db_path"] = new_path
-            self.db_manager.initialize(new_path)
+            self.db_manager.initialize(new_path, self.settings.get("db_profile"))
             self.lbl_current_db.setText(f"Percorso Attuale: <b>{new_path}</b>")
             self.save_settings_to_file()
+            self.update_last_backup_label()
             self.load_stats()
             self.load_athletes()
             QMessageBox.information(self, "Successo", "Database ricollegato con successo!")
 
+    def prompt_sync_remote(self):
+        from PySide6.QtWidgets import QFileDialog
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Copia di Sincronizzazione", self.settings.get("sync_remote") or "gestionale_sync.db",
+            "Database Files (*.db)", options=QFileDialog.DontConfirmOverwrite)
+        if not path:
+            return None
+        if os.path.abspath(path) == os.path.abspath(self.db_manager.db_path):
+            QMessageBox.warning(self, "Sincronizzazione", "Scegliere un file diverso dal database in uso.")
+            return None
+        self.settings["sync_remote"] = path
+        self.save_settings_to_file()
+        self.lbl_sync_remote.setText(path)
+        return path
+
     def sync_database(self):
-        if self.db_manager.sync_manual():
-            QMessageBox.information(self, "Sincronizzazione", "Sincronizzazione completata! (Modalità: Locale)")
+        from workers import SyncWorker
+        remote = self.settings.get("sync_remote") or self.prompt_sync_remote()
+        if not remote or self.sync_worker is not None:
+            return
+        self.sync_worker = SyncWorker(remote, self)
+        self.sync_worker.strategyRequested.connect(self.on_sync_strategy_requested, Qt.BlockingQueuedConnection)
+        self.sync_worker.conflictRequested.connect(self.on_sync_conflict_requested, Qt.BlockingQueuedConnection)
+        self.sync_worker.completed.connect(self.on_sync_finished)
+        self.sync_worker.failed.connect(lambda error: self.on_sync_finished(None, error))
+        QApplication.setOverrideCursor(Qt.BusyCursor)
+        self.sync_worker.start()
+
+    def on_sync_strategy_requested(self, conflict_count):
+        from PySide6.QtWidgets import QDialog
+        from global_conflict_dialog import GlobalConflictDialog
+        QApplication.restoreOverrideCursor()
+        dialog = GlobalConflictDialog(conflict_count, self)
+        self.sync_worker.answer = dialog.strategy if dialog.exec() == QDialog.Accepted else None
+        QApplication.setOverrideCursor(Qt.BusyCursor)
+
+    def on_sync_conflict_requested(self, athlete, remote_data):
+        from PySide6.QtWidgets import QDialog
+        from conflict_dialog import ConflictDialog
+        QApplication.restoreOverrideCursor()
+        dialog = ConflictDialog(f"{athlete.name} {athlete.surname}", athlete, remote_data, self)
+        self.sync_worker.answer = dialog.get_final_data() if dialog.exec() == QDialog.Accepted else None
+        QApplication.setOverrideCursor(Qt.BusyCursor)
+
+    def on_sync_finished(self, result, error=None):
+        self.sync_worker.wait()
+        self.sync_worker = None
+        QApplication.restoreOverrideCursor()
+        if error:
+            QMessageBox.warning(self, "Errore", f"Impossibile completare la sincronizzazione: {error}")
+        elif result["cancelled"]:
+            QMessageBox.information(self, "Sincronizzazione", "Sincronizzazione annullata: nessuna modifica applicata.")
+        else:
+            if result["received"]:
+                # Many rows may have changed: re-read them, keeping selection and scroll position
+                self.athlete_model.reload()
+                self.load_stats()
+            QMessageBox.information(self, "Sincronizzazione",
+                                    f"Sincronizzazione completata!\nRicevute {result['received']} modifiche, "
+                                    f"inviate {result['sent']}, conflitti {result['conflicts']}.")
+
+    # --- BACKUP ---
+
+    def backup_options(self):
+        from backup import DEFAULT_RETENTION
+        return {"backup_dir": self.settings.get("backup_dir"),
+                "retention": self.settings.get("backup_retention", DEFAULT_RETENTION)}
+
+    def prompt_backup_dir(self):
+        from PySide6.QtWidgets import QFileDialog
+        from backup import backup_dir_for
+        folder = QFileDialog.getExistingDirectory(
+            self, "Cartella Backup", backup_dir_for(self.db_manager.db_path, self.settings.get("backup_dir")))
+        if folder:
+            self.settings["backup_dir"] = folder
+            self.save_settings_to_file()
+            self.lbl_backup_dir.setText(folder)
+            self.update_last_backup_label()
+
+    def update_last_backup_label(self, result=None):
+        from backup import list_backups, format_size
+        backups = list_backups(self.db_manager.db_path, self.settings.get("backup_dir"))
+        if not backups:
+            self.lbl_last_backup.setText("Nessuno")
+            return
+        last = backups[0]
+        text = f"{last.created:%d/%m/%Y %H:%M} ({last.reason}, {format_size(last.size)})"
+        if result is not None and result.path == last.path:
+            text += f" in {result.duration:.1f} s"
+        self.lbl_last_backup.setText(text)
+
+    def run_scheduled_backup(self):
+        from sqlalchemy.exc import OperationalError
+        from backup import backup_due, DEFAULT_INTERVAL_HOURS, REASON_SCHEDULED
+        if self.backup_worker is not None or not self.db_manager.db_path:
+            return
+        # Anche il registro delle modifiche va compattato senza la CLI (vacuum)
+        try:
+            self.db_manager.compact_change_log_if_needed()
+        except OperationalError:
+            pass  # Database occupato da un'altra postazione: al prossimo controllo
+        interval = self.settings.get("backup_interval_hours", DEFAULT_INTERVAL_HOURS)
+        if backup_due(self.db_manager.db_path, interval, self.settings.get("backup_dir")):
+            self.start_backup(REASON_SCHEDULED)
+
+    def backup_database(self):
+        from backup import REASON_MANUAL
+        if self.backup_worker is None:
+            self.start_backup(REASON_MANUAL)
+
+    def restore_database(self):
+        from PySide6.QtWidgets import QFileDialog, QInputDialog
+        from backup import list_backups, backup_dir_for, format_size, REASON_RESTORE
+        if self.backup_worker is not None or self.sync_worker is not None:
+            QMessageBox.information(self, "Ripristina Backup", "Attendere la fine del backup o della sincronizzazione in corso.")
+            return
+        backup_dir = self.settings.get("backup_dir")
+        backups = list_backups(self.db_manager.db_path, backup_dir)
+        other = "Altro file..."
+        labels = [f"{b.created:%d/%m/%Y %H:%M:%S} - {b.reason} ({format_size(b.size)})" for b in backups]
+        label, ok = QInputDialog.getItem(self, "Ripristina Backup", "Backup da ripristinare:",
+                                         labels + [other], 0, False)
+        if not ok:
+            return
+        if label == other:
+            path, _ = QFileDialog.getOpenFileName(self, "Ripristina Backup",
+                                                  backup_dir_for(self.db_manager.db_path, backup_dir),
+                                                  "Backup (*.db.gz)")
+            if not path:
+                return
+        else:
+            path = backups[labels.index(label)].path
+        reply = QMessageBox.question(self, "Ripristina Backup",
+                                     f"I dati attuali verranno sostituiti con quelli del backup:\n{os.path.basename(path)}\n\n"
+                                     "Prima del ripristino viene fatta una copia di sicurezza del database. Continuare?",
+                                     QMessageBox.Yes | QMessageBox.No)
+        if reply != QMessageBox.Yes:
+            return
+        from PySide6.QtCore import QThreadPool
+        from PySide6.QtWidgets import QProgressDialog
+        # Finestra modale fino alla fine: nessuna lettura (pagine della lista, statistiche,
+        # certificati, backup pianificato) può riaprire connessioni durante la copia
+        self.restore_progress = QProgressDialog("Ripristino del backup in corso...", None, 0, 0, self)
+        self.restore_progress.setWindowTitle("Ripristina Backup")
+        self.restore_progress.setWindowModality(Qt.ApplicationModal)
+        self.restore_progress.setMinimumDuration(0)
+        self.restore_progress.rejected.connect(self.restore_progress.show)  # Esc non la chiude
+        self.restore_progress.show()
+        self.backup_timer.stop()
+        self.search_timer.stop()
+        self.athlete_model.set_suspended(True)
+        QThreadPool.globalInstance().waitForDone()  # Pagina annullata: la sua sessione viene chiusa
+        # Connessioni dell'applicazione chiuse: vengono riaperte (con le migrazioni) dopo il ripristino
+        self.db_manager.engine.dispose()
+        self.start_backup(REASON_RESTORE, restore_from=path)
+
+    def start_backup(self, reason, restore_from=None):
+        from backup import REASON_SCHEDULED
+        from workers import BackupWorker
+        self.backup_worker = BackupWorker(self.db_manager.db_path, reason, self.backup_options(),
+                                          restore_from=restore_from, parent=self)
+        self.backup_worker.progressChanged.connect(
+            lambda done, total: self.lbl_last_backup.setText(f"Backup in corso... {done * 100 // max(total, 1)}%"))
+        self.backup_worker.completed.connect(lambda result: self.on_backup_finished(result, reason, restore_from))
+        self.backup_worker.failed.connect(lambda error: self.on_backup_finished(None, reason, restore_from, error))
+        if restore_from or reason != REASON_SCHEDULED:
+            QApplication.setOverrideCursor(Qt.BusyCursor)
+        self.lbl_last_backup.setText("Ripristino in corso..." if restore_from else "Backup in corso...")
+        self.backup_worker.start()
+
+    def on_backup_finished(self, result, reason, restore_from, error=None):
+        from backup import format_size, REASON_SCHEDULED
+        self.backup_worker.wait()
+        self.backup_worker = None
+        if restore_from or reason != REASON_SCHEDULED:
+            QApplication.restoreOverrideCursor()
+        self.update_last_backup_label(result)
+
+        if restore_from:
+            # Nuove connessioni sul contenuto ripristinato (schema aggiornato se il backup è più vecchio)
+            self.db_manager.initialize(self.db_manager.db_path, self.db_manager.pragma_profile)
+            self.restore_progress.close()
+            self.restore_progress = None
+            self.athlete_model.set_suspended(False)
+            self.backup_timer.start(BACKUP_CHECK_MS)
+            invalidate_stats()
+            self.cert_view_key = None
+            self.load_athletes()
+            self.load_stats()
+            if error:
+                QMessageBox.warning(self, "Ripristina Backup", f"Ripristino non riuscito, dati invariati: {error}")
+            else:
+                QMessageBox.information(self, "Ripristina Backup",
+                                        f"Database ripristinato!\nCopia di sicurezza dei dati precedenti:\n{result.path}")
+        elif error:
+            # Anche per il backup pianificato: un backup che fallisce non deve passare inosservato
+            QMessageBox.warning(self, "Backup", f"Backup non riuscito: {error}")
+        elif result is not None and reason != REASON_SCHEDULED:
+            QMessageBox.information(self, "Backup",
+                                    f"Backup completato in {result.duration:.1f} s\n{result.path}\n"
+                                    f"{format_size(result.size)} compressi (database {format_size(result.db_size)})")
+
+    def rebuild_search_index(self):
+        if self.db_manager.rebuild_search_index():
+            QMessageBox.information(self, "Indice Ricerca", "Indice di ricerca ricostruito con successo!")
         else:
-            QMessageBox.warning(self, "Errore", "Impossibile completare la sincronizzazione.")
+            QMessageBox.warning(self, "Indice Ricerca", "Ricerca full-text (FTS5) non disponibile: viene usata la ricerca semplice.")
+
+    def validate_tax_codes(self):
+        from cf_utils import parse_cf_batch
+        session = get_session()
+        try:
+            rows = session.execute(tax_code_list_query()).all()
+        finally:
+            session.close()
+        # Un solo passaggio vettoriale su tutti i codici (struttura, data, carattere di controllo)
+        valid = parse_cf_batch([r.tax_code for r in rows])["valid"]
+        invalid = [r for r, ok in zip(rows, valid) if not ok]
+        if not invalid:
+            QMessageBox.information(self, "Verifica Codici Fiscali", f"Tutti i {len(rows)} codici fiscali sono validi.")
+            return
+        msg = QMessageBox(self)
+        msg.setIcon(QMessageBox.Warning)
+        msg.setWindowTitle("Verifica Codici Fiscali")
+        msg.setText(f"{len(invalid)} codici fiscali non validi su {len(rows)}.")
+        msg.setDetailedText("\n".join(f"{r.surname} {r.name}: {r.tax_code}" for r in invalid))
+        msg.exec()
 
     def save_all_settings(self):
         # Update theme based on combo (this is called from UI button)
         theme_idx = self.combo_theme.currentIndex()
         theme_name = 'dark_teal.xml' if theme_idx == 0 else 'light_blue.xml'
         self.settings["theme"] = theme_name
+        
+        # A different pragma profile requires new connections
+        profile = self.combo_db_profile.currentData()
+        if profile != self.db_manager.pragma_profile:
+            self.settings["db_profile"] = profile
+            self.db_manager.initialize(self.db_manager.db_path, profile)
+        self.settings["backup_interval_hours"] = self.combo_backup_interval.currentData()
+        self.settings["backup_retention"] = self.spin_backup_retention.value()
+        self.settings["backup_before_import"] = self.chk_backup_import.isChecked()
         self.save_settings_to_file()
-        apply_stylesheet(QApplication.instance(), theme=theme_name)
+        apply_theme(theme_name)
         QMessageBox.information(self, "Impostazioni", "Impostazioni salvate correttamente!")
 
     def save_settings_to_file(self):
@@ -204,7 +589,7 @@ class MainWindow(QMainWindow):
 
     def load_initial_theme(self):
         theme = self.settings.get('theme', 'dark_teal.xml')
-        apply_stylesheet(QApplication.instance(), theme=theme)
+        apply_theme(theme)
 
     def setup_dashboard_view(self):
         view = QWidget()
@@ -247,6 +632,10 @@ class MainWindow(QMainWindow):
         filter_layout.addWidget(self.combo_cert_filter)
         filter_layout.addStretch()
         
+        btn_export_certs = QPushButton("Esporta")
+        btn_export_certs.clicked.connect(self.export_certificates)
+        filter_layout.addWidget(btn_export_certs)
+        
         layout.addLayout(filter_layout)
         
         self.cert_table = QTableWidget()
@@ -286,10 +675,20 @@ class MainWindow(QMainWindow):
         
         header_layout = QHBoxLayout()
         self.search_bar = QLineEdit()
-        self.search_bar.setPlaceholderText("Cerca per nome, cognome o CF...")
-        self.search_bar.textChanged.connect(self.load_athletes)
+        self.search_bar.setPlaceholderText("Cerca per nome, cognome, CF, tessera ASC o note...")
         header_layout.addWidget(self.search_bar)
         
+        # Debounce: the query starts only after a pause in typing
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(250)
+        self.search_timer.timeout.connect(self.load_athletes)
+        self.search_bar.textChanged.connect(self.search_timer.start)
+        
+        self.lbl_searching = QLabel("Ricerca...")
+        self.lbl_searching.setVisible(False)
+        header_layout.addWidget(self.lbl_searching)
+        
         # New Column Visibility Button
         self.btn_columns = QPushButton("Colonne")
         self.btn_columns.setFixedWidth(100)
@@ -305,46 +704,38 @@ class MainWindow(QMainWindow):
         self.btn_import.clicked.connect(self.import_data)
         header_layout.addWidget(self.btn_import)
         
+        btn_export = QPushButton("Esporta")
+        btn_export.clicked.connect(self.export_athletes)
+        header_layout.addWidget(btn_export)
+        
         layout.addLayout(header_layout)
         
         # Table Configuration
-        self.table = QTableWidget()
+        self.athlete_model = AthleteTableModel(self)
+        self.athlete_model.loadingChanged.connect(self.lbl_searching.setVisible)
+        self.athlete_model.loadFailed.connect(self.on_athletes_load_failed)
+        self.table = QTableView()
+        self.table.setModel(self.athlete_model)
         self.table.horizontalHeader().setSectionsMovable(True)
         self.table.horizontalHeader().sectionMoved.connect(self.on_column_moved)
-        self.table.cellDoubleClicked.connect(self.on_row_double_clicked)
+        self.table.doubleClicked.connect(self.on_row_double_clicked)
         
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
         self.table.horizontalHeader().setStretchLastSection(True)
         self.table.setSortingEnabled(True)
-        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
-        self.table.setSelectionBehavior(QTableWidget.SelectRows)
-        self.table.setSelectionMode(QTableWidget.SingleSelection)
+        self.table.setEditTriggers(QTableView.NoEditTriggers)
+        self.table.setSelectionBehavior(QTableView.SelectRows)
+        self.table.setSelectionMode(QTableView.SingleSelection)
         
         layout.addWidget(self.table)
         
         # Default Columns Internal Metadata
-        self.all_columns = [
-            {"key": "id", "label": "#", "fixed": True},
-            {"key": "surname", "label": "Cognome", "fixed": True},
-            {"key": "name", "label": "Nome", "fixed": True},
-            {"key": "birth_date", "label": "Data Nascita"},
-            {"key": "birth_place", "label": "Luogo Nascita"},
-            {"key": "tax_code", "label": "Codice Fiscale"},
-            {"key": "current_belt", "label": "Cintura"},
-            {"key": "current_rank", "label": "Grado"},
-            {"key": "address", "label": "Indirizzo"},
-            {"key": "phone", "label": "Telefono"},
-            {"key": "email", "label": "Email"},
-            {"key": "asc_number", "label": "Numero ASC"},
-            {"key": "roles", "label": "Ruoli"},
-            {"key": "notes", "label": "Note"},
-            {"key": "scadenza", "label": "Scad. Cert."},
-        ]
+        self.all_columns = [dict(col) for col in ATHLETE_COLUMNS]
         
         # Load visibility settings
         self.visible_keys = self.settings.get("visible_columns")
         if not self.visible_keys:
-            self.visible_keys = ["id", "surname", "name", "current_belt", "current_rank", "scadenza"]
+            self.visible_keys = list(DEFAULT_VISIBLE_COLUMNS)
             
         # Load order settings
         self.col_order = self.settings.get("column_order")
@@ -382,94 +773,98 @@ class MainWindow(QMainWindow):
         new_order = []
         for i in range(count):
             logical_idx = header.logicalIndex(i)
-            # Find which key this matches
-            col_label = self.table.horizontalHeaderItem(logical_idx).text()
-            for col in self.all_columns:
-                if col["label"] == col_label:
-                    new_order.append(col["key"])
-                    break
+            key = self.athlete_model.column_key(logical_idx)
+            if key:
+                new_order.append(key)
         
         # Ensure # is always first if moved by user (actually header move doesn't force this easily, 
         # but we can check if index 0 changed)
         if new_order and new_order[0] != "id":
              # We could force it back or just let it be. User asked: "numero progressivo deve rimanere sempre la prima"
              # Let's force it back visually if it moved
-             visual_idx_of_id = header.visualIndex(0) # 0 is logical index for #
+             keys = [c["key"] for c in self.athlete_model.columns]
+             visual_idx_of_id = header.visualIndex(keys.index("id")) if "id" in keys else 0
              if visual_idx_of_id != 0:
                  header.moveSection(visual_idx_of_id, 0)
                  return # Recurse once
         
+        self.col_order = new_order
         self.settings["column_order"] = new_order
         self.save_settings_to_file()
 
-    def on_row_double_clicked(self, row, column):
-        # Dynamically find the index of the '#' (id) column to get the athlete ID
-        logical_index_of_id = -1
-        header = self.table.horizontalHeader()
-        for i in range(self.table.columnCount()):
-            if self.table.horizontalHeaderItem(i).text() == "#":
-                logical_index_of_id = i
-                break
-        
-        if logical_index_of_id != -1:
-            item = self.table.item(row, logical_index_of_id)
-            if item:
-                athlete_id = item.data(Qt.UserRole)
-                if athlete_id:
-                    self.edit_athlete(athlete_id)
+    def on_athletes_load_failed(self, error):
+        # La lista resta ferma alle righe già caricate: si può rileggere da capo
+        reply = QMessageBox.question(self, "Errore",
+                                     f"Impossibile caricare la lista atleti: {error}\n\nRiprovare?",
+                                     QMessageBox.Yes | QMessageBox.No)
+        if reply == QMessageBox.Yes:
+            self.athlete_model.reload()
+
+    def on_row_double_clicked(self, index):
+        # The real athlete ID is kept by the model, independent of the column order
+        athlete_id = self.athlete_model.athlete_id(index.row())
+        if athlete_id:
+            self.edit_athlete(athlete_id)
 
     # --- LOGIC METHODS ---
 
     def load_stats(self):
-        session = get_session()
-        total = session.query(Athlete).count()
-        agonisti = session.query(MedicalCertificate).filter(MedicalCertificate.cert_type == "Agonistico").count()
-        non_agonisti = session.query(MedicalCertificate).filter(MedicalCertificate.cert_type == "Non Agonistico").count()
-        
-        today = datetime.date.today()
-        next_30 = today + datetime.timedelta(days=30)
-        expiring = session.query(MedicalCertificate).filter(MedicalCertificate.expiry_date.between(today, next_30)).count()
-        
-        self.update_card_value(self.card_total, total)
-        self.update_card_value(self.card_agonisti, agonisti)
-        self.update_card_value(self.card_non_agonisti, non_agonisti)
-        self.update_card_value(self.card_expiring, expiring)
-        session.close()
+        # Single aggregate query, cached until athletes/certificates change
+        stats = get_dashboard_stats()
+        
+        self.update_card_value(self.card_total, stats["total"])
+        self.update_card_value(self.card_agonisti, stats["agonisti"])
+        self.update_card_value(self.card_non_agonisti, stats["non_agonisti"])
+        self.update_card_value(self.card_expiring, stats["expiring"])
 
     def add_athlete(self):
+        from athlete_dialog import AthleteDialog
+        before = athlete_snapshot(())
         dialog = AthleteDialog(self)
         if dialog.exec():
-            self.load_athletes()
-            self.load_stats()
+            self.apply_athlete_changes(dialog.changes, before)
 
     def import_data(self):
-        dialog = ImportDialog(self)
+        # Il primo caricamento di pandas richiede qualche centinaio di millisecondi
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            from import_dialog import ImportDialog
+        finally:
+            QApplication.restoreOverrideCursor()
+        backup_options = self.backup_options() if self.settings.get("backup_before_import", True) else None
+        dialog = ImportDialog(self, backup_options=backup_options)
         if dialog.exec():
-            self.load_athletes()
-            self.load_stats()
+            self.apply_athlete_changes(dialog.changes)
 
     def edit_athlete(self, athlete_id):
+        from athlete_dialog import AthleteDialog
+        before = athlete_snapshot([athlete_id])
         dialog = AthleteDialog(self, athlete_id=athlete_id)
         result = dialog.exec()
         if result:
-            self.load_athletes()
-            self.load_stats()
+            self.apply_athlete_changes(dialog.changes, before)
 
-    def load_athletes(self):
-        session = get_session()
-        query = session.query(Athlete)
-        
-        search_text = self.search_bar.text()
-        if search_text:
-            query = query.filter(
-                (Athlete.name.ilike(f"%{search_text}%")) | 
-                (Athlete.surname.ilike(f"%{search_text}%")) |
-                (Athlete.tax_code.ilike(f"%{search_text}%"))
-            )
-            
-        athletes = query.all()
-        
-        # Determine current visible columns in order
+    def apply_athlete_changes(self, changes, before=None):
+        """
+        Aggiorna viste e contatori dopo il salvataggio di un dialogo, senza rileggere le tabelle:
+        solo le righe degli atleti in 'changes' (created/updated/deleted) e, se 'before'
+        è lo snapshot precedente alla modifica, i contatori della dashboard per differenza.
+        """
+        changed = changes["created"] | changes["updated"]
+        affected = changed | changes["deleted"]
+        if not self.athlete_model.patch_rows(changed, changes["deleted"]):
+            self.athlete_model.reload()
+        if before is not None:
+            after = athlete_snapshot(affected)
+            cursor = snapshot_cursor(before, after)
+            adjust_dashboard_stats(before, after, cursor)
+            if cursor is not None:
+                self.patch_certificates(affected, before.cursor, cursor)
+        # Dalla cache se i contatori sono stati aggiornati, altrimenti con l'unica query aggregata
+        self.load_stats()
+
+    def current_columns(self):
+        """Colonne visibili nell'ordine salvato nelle impostazioni"""
         current_cols = []
         if self.col_order:
              # Follow saved order but filter for visibility
@@ -491,86 +886,222 @@ class MainWindow(QMainWindow):
             for col in self.all_columns:
                 if col["key"] in self.visible_keys:
                     current_cols.append(col)
+        return current_cols
 
-        # IMPORTANT: Disable sorting and clear table for data integrity
-        self.table.setSortingEnabled(False)
-        self.table.clearContents()
-        self.table.setRowCount(0)
-        
-        self.table.setColumnCount(len(current_cols))
-        self.table.setHorizontalHeaderLabels([c["label"] for c in current_cols])
-        self.table.setRowCount(len(athletes))
-        
-        for i, athlete in enumerate(athletes):
-            for col_idx, col_cfg in enumerate(current_cols):
-                key = col_cfg["key"]
-                
-                if key == "id":
-                    val = str(i + 1)
-                elif key == "scadenza":
-                    cert = athlete.latest_certificate
-                    val = cert.expiry_date.strftime("%d/%m/%Y") if cert else "Assente"
-                else:
-                    val = getattr(athlete, key, "")
-                
-                item = QTableWidgetItem(str(val if val is not None else ""))
-                
-                # Highlight Key Fields
-                if key in ["name", "surname"]:
-                    font = item.font()
-                    font.setBold(True)
-                    item.setFont(font)
-                    item.setForeground(Qt.cyan) # Aesthetic highlight
-                
-                # Scadenza Colors
-                if key == "scadenza" and athlete.latest_certificate:
-                    cert = athlete.latest_certificate
-                    if cert.expiry_date < datetime.date.today():
-                        item.setForeground(Qt.red)
-                    elif cert.expiry_date < datetime.date.today() + datetime.timedelta(days=30):
-                        item.setForeground(Qt.yellow)
-                
-                # Store Real ID for double click on the '#' column (key == "id")
-                if key == "id":
-                    item.setData(Qt.UserRole, athlete.id)
-                
-                self.table.setItem(i, col_idx, item)
-        
-        # Re-enable sorting after data is stable
-        self.table.setSortingEnabled(True)
-        session.close()
+    def load_athletes(self):
+        self.search_timer.stop()
+        # The model only reads the pages the view actually needs, on a worker thread
+        self.athlete_model.set_query(self.current_columns(), self.search_bar.text())
+        
+        # Columns already follow the saved order: reset any visual move left on the header
+        header = self.table.horizontalHeader()
+        header.blockSignals(True)
+        for visual in range(header.count()):
+            if header.logicalIndex(visual) != visual:
+                header.moveSection(header.visualIndex(visual), visual)
+        header.blockSignals(False)
+
+    def current_cert_view_key(self):
+        return (self.db_manager.db_path, self.combo_cert_filter.currentIndex(),
+                datetime.date.today(), self.db_manager.last_change())
 
     def load_certificates_filter(self):
         session = get_session()
-        today = datetime.date.today()
         idx = self.combo_cert_filter.currentIndex()
+        self.cert_view_key = self.current_cert_view_key()
         
-        query = session.query(MedicalCertificate).join(Athlete)
-        
-        if idx == 0: # 30 days
-            query = query.filter(MedicalCertificate.expiry_date.between(today, today + datetime.timedelta(days=30)))
-        elif idx == 1: # 60 days
-            query = query.filter(MedicalCertificate.expiry_date.between(today, today + datetime.timedelta(days=60)))
-        elif idx == 2: # 90 days
-            query = query.filter(MedicalCertificate.expiry_date.between(today, today + datetime.timedelta(days=90)))
-        elif idx == 3: # Expired
-            query = query.filter(MedicalCertificate.expiry_date < today)
-            
-        certs = query.order_by(MedicalCertificate.expiry_date).all()
+        # Single JOIN: no lazy load of cert.athlete per row
+        certs = session.execute(certificate_list_query(idx).add_columns(athletes.c.id)).all()
+        # With sorting enabled every setItem could move the row being filled
+        self.cert_table.setSortingEnabled(False)
         self.cert_table.setRowCount(len(certs))
-        
         for i, cert in enumerate(certs):
-            athlete = cert.athlete
-            self.cert_table.setItem(i, 0, QTableWidgetItem(f"{athlete.name} {athlete.surname}"))
-            self.cert_table.setItem(i, 1, QTableWidgetItem(cert.cert_type))
-            self.cert_table.setItem(i, 2, QTableWidgetItem(cert.expiry_date.strftime("%d/%m/%Y")))
-            self.cert_table.setItem(i, 3, QTableWidgetItem(athlete.phone or "-"))
-            self.cert_table.setItem(i, 4, QTableWidgetItem(athlete.email or "-"))
+            self.set_certificate_row(i, cert)
+        self.cert_table.setSortingEnabled(True)
         
         session.close()
 
-if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = MainWindow()
+    def set_certificate_row(self, i, cert):
+        name, surname, cert_type, expiry_date, phone, email, athlete_id = cert
+        item = QTableWidgetItem(f"{name} {surname}")
+        item.setData(Qt.UserRole, athlete_id)
+        self.cert_table.setItem(i, 0, item)
+        self.cert_table.setItem(i, 1, QTableWidgetItem(cert_type))
+        item = QTableWidgetItem(expiry_date.strftime("%d/%m/%Y"))
+        item.setData(Qt.UserRole, expiry_date)
+        self.cert_table.setItem(i, 2, item)
+        self.cert_table.setItem(i, 3, QTableWidgetItem(phone or "-"))
+        self.cert_table.setItem(i, 4, QTableWidgetItem(email or "-"))
+
+    def patch_certificates(self, athlete_ids, before_cursor, cursor):
+        """Sostituisce nella vista certificati solo le righe degli atleti indicati"""
+        idx = self.combo_cert_filter.currentIndex()
+        if self.cert_view_key != (self.db_manager.db_path, idx, datetime.date.today(), before_cursor):
+            return  # Not loaded or stale: reloaded when the view is shown
+        session = get_session()
+        try:
+            certs = session.execute(certificate_list_query(idx, athlete_ids=athlete_ids)
+                                    .add_columns(athletes.c.id)).all()
+        finally:
+            session.close()
+
+        table = self.cert_table
+        table.setSortingEnabled(False)
+        for i in reversed(range(table.rowCount())):
+            if table.item(i, 0).data(Qt.UserRole) in athlete_ids:
+                table.removeRow(i)
+        # Same position as the query order (expiry date); a column sort chosen by the user
+        # is applied again when sorting is re-enabled
+        expiries = [table.item(i, 2).data(Qt.UserRole) for i in range(table.rowCount())]
+        for cert in certs:
+            pos = bisect.bisect_right(expiries, cert[3])
+            expiries.insert(pos, cert[3])
+            table.insertRow(pos)
+            self.set_certificate_row(pos, cert)
+        table.setSortingEnabled(True)
+        self.cert_view_key = (self.db_manager.db_path, idx, datetime.date.today(), cursor)
+
+    def export_athletes(self):
+        from exporter import athlete_export
+        # Same rows, columns (in the saved order), search and sort as the table
+        model = self.athlete_model
+        spec = athlete_export([c["key"] for c in self.current_columns()], model.search_text,
+                              model.sort_key, model.sort_order == Qt.DescendingOrder)
+        self.start_export(spec, "atleti")
+
+    def export_certificates(self):
+        from exporter import certificate_export
+        self.start_export(certificate_export(self.combo_cert_filter.currentIndex()), "certificati")
+
+    def start_export(self, spec, default_name):
+        from PySide6.QtWidgets import QFileDialog, QProgressDialog
+        from exporter import parquet_available
+        from workers import ExportWorker
+        filters = {"Excel (*.xlsx)": ".xlsx", "CSV (*.csv)": ".csv"}
+        if parquet_available():
+            filters["Parquet (*.parquet)"] = ".parquet"
+        path, selected = QFileDialog.getSaveFileName(self, "Esporta", default_name, ";;".join(filters))
+        if not path:
+            return
+        if not os.path.splitext(path)[1]:
+            path += filters.get(selected, ".xlsx")
+
+        progress = QProgressDialog("Esportazione in corso...", "Annulla", 0, 0, self)
+        progress.setWindowTitle("Esporta")
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+
+        # Rows are streamed to the file on a worker thread with its own session
+        self.export_worker = ExportWorker(path, spec, self)
+        self.export_worker.totalRows.connect(progress.setMaximum)
+        self.export_worker.progressChanged.connect(progress.setValue)
+        progress.canceled.connect(self.export_worker.cancel)
+        self.export_worker.completed.connect(lambda rows: self.on_export_finished(progress, path, rows))
+        self.export_worker.failed.connect(lambda error: self.on_export_finished(progress, path, None, error))
+        self.export_worker.start()
+
+    def on_export_finished(self, progress, path, rows, error=None):
+        worker = self.export_worker
+        worker.wait()
+        self.export_worker = None
+        progress.close()
+        if error:
+            QMessageBox.critical(self, "Errore Esportazione", f"Impossibile esportare: {error}")
+        elif not worker.cancelled:
+            QMessageBox.information(self, "Esporta", f"Esportate {rows} righe in {path}")
+
+# --- PROFILO DI AVVIO ---
+
+class FirstPaintFilter(QObject):
+    """Chiama callback(millisecondi da STARTUP_T0) al primo disegno della finestra"""
+    def __init__(self, callback):
+        super().__init__()
+        self.callback = callback
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint and self.callback:
+            callback, self.callback = self.callback, None
+            callback((time.perf_counter() - STARTUP_T0) * 1000)
+        return False
+
+FIRST_PAINT_MARKER = "startup-first-paint"
+
+def parse_importtime(lines):
+    """Righe di -X importtime -> lista (modulo, microsecondi cumulativi) dei moduli di primo livello"""
+    result = []
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit() and not name[1:].startswith(" "):
+            result.append((name.strip(), int(cumulative)))
+    return result
+
+def measure_startup(db_path=None):
+    """
+    Avvia il programma in un nuovo processo con -X importtime e lo chiude al primo disegno.
+    Ritorna (millisecondi alla prima visualizzazione dall'avvio del processo,
+    millisecondi misurati dal programma, moduli di primo livello importati prima del disegno).
+    """
+    import subprocess
+    import tempfile
+    cmd = [sys.executable, "-X", "importtime", os.path.abspath(__file__), "--startup-probe"]
+    if db_path:
+        cmd += ["--db", db_path]
+    with tempfile.TemporaryFile("w+") as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=log, text=True)
+        in_process = None
+        for line in proc.stdout:
+            if line.startswith(FIRST_PAINT_MARKER):
+                wall = (time.perf_counter() - start) * 1000
+                in_process = float(line.split()[1])
+        proc.wait()
+        if in_process is None:
+            raise RuntimeError(f"Avvio non riuscito (codice {proc.returncode})")
+        log.seek(0)
+        lines = log.read().split(FIRST_PAINT_MARKER)[0].splitlines()
+    return wall, in_process, parse_importtime(lines)
+
+def print_startup_report(db_path=None, top=15):
+    wall, in_process, modules = measure_startup(db_path)
+    total = sum(us for _, us in modules)
+    print(f"Prima visualizzazione: {wall:.0f} ms dall'avvio del processo ({in_process:.0f} ms da main.py)")
+    print(f"Importazioni prima della visualizzazione: {total / 1000:.0f} ms")
+    print(f"  {'modulo':<32} {'ms':>8}")
+    for name, us in sorted(modules, key=lambda m: -m[1])[:top]:
+        print(f"  {name:<32} {us / 1000:8.1f}")
+    loaded = {name.split(".")[0] for name, _ in modules}
+    heavy = [m for m in ("pandas", "numpy", "openpyxl", "cf_utils", "qt_material") if m in loaded]
+    print(f"Moduli pesanti caricati all'avvio: {', '.join(heavy) or 'nessuno'}")
+    return wall
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Gestionale Karate ASD")
+    parser.add_argument("--db", help="File database da aprire in questa sessione")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Misura i tempi di avvio (importazioni e prima visualizzazione) ed esce")
+    parser.add_argument("--startup-probe", action="store_true", help=argparse.SUPPRESS)
+    args, qt_args = parser.parse_known_args(argv[1:])
+    if args.profile_startup:
+        print_startup_report(args.db)
+        return 0
+
+    app = QApplication(argv[:1] + qt_args)
+    window = MainWindow(args.db)
+    if args.startup_probe:
+        # Processo figlio di measure_startup: segnala la prima visualizzazione ed esce
+        def on_first_paint(ms):
+            print("import time: " + FIRST_PAINT_MARKER, file=sys.stderr, flush=True)
+            print(f"{FIRST_PAINT_MARKER} {ms:.1f}", flush=True)
+            QTimer.singleShot(0, app.quit)
+        window.first_paint_filter = FirstPaintFilter(on_first_paint)
+        window.installEventFilter(window.first_paint_filter)
     window.show()
-    sys.exit(app.exec())
+    return app.exec()
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
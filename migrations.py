@@ -0,0 +1,160 @@
+"""
+Migrazioni di schema versionate tramite PRAGMA user_version.
+
+Ogni migrazione è una funzione che riceve la connessione già in transazione.
+Per aggiungere una modifica di schema basta accodare una nuova voce a MIGRATIONS:
+i database esistenti la eseguiranno una sola volta al prossimo avvio.
+"""
+import sqlite3
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+from database import Base, FTS_SCHEMA, SYNC_SCHEMA, SYNC_TABLES, CHANGE_LOG_SCHEMA, VERSIONED_TABLES
+
+def get_user_version(conn):
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+def fts_supported():
+    """FTS5 con tokenizer trigram disponibile nella libreria SQLite in uso"""
+    try:
+        probe = sqlite3.connect(":memory:")
+        probe.execute("CREATE VIRTUAL TABLE probe USING fts5(a, tokenize='trigram')")
+        probe.close()
+        return True
+    except sqlite3.Error:
+        return False
+
+def table_exists(conn, name):
+    return conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": name}).first() is not None
+
+# --- MIGRAZIONI ---
+
+def _add_columns(conn, table, columns):
+    existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+    for name, ddl_type in columns:
+        if name not in existing:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {ddl_type}")
+            print(f"Aggiunta colonna '{name}' con successo.")
+
+def sync_indexes(conn):
+    """
+    Allinea gli indici gestiti (prefisso 'ix_') a quelli dichiarati nei modelli:
+    crea i mancanti, ricrea quelli con definizione diversa, elimina gli obsoleti.
+    """
+    declared = {}
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table.name})")}
+        for index in table.indexes:
+            # Colonne aggiunte da una migrazione successiva: l'indice verrà creato da quella
+            if index.name and index.name.startswith('ix_') and {c.name for c in index.columns} <= existing_columns:
+                declared[index.name] = index
+
+    existing = {name: sql for name, sql in conn.execute(text(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix\\_%' ESCAPE '\\'"))}
+
+    for name in existing.keys() - declared.keys():
+        conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+        print(f"Rimosso indice obsoleto '{name}'.")
+
+    for name, index in declared.items():
+        ddl = str(CreateIndex(index).compile(dialect=conn.dialect)).strip()
+        if name in existing and " ".join(existing[name].split()) == " ".join(ddl.split()):
+            continue
+        if name in existing:
+            conn.execute(text(f'DROP INDEX "{name}"'))
+        conn.execute(text(ddl))
+        print(f"Creato indice '{name}'.")
+
+def create_search_index(conn):
+    """Indice FTS5 degli atleti con i relativi trigger, popolato con le righe esistenti"""
+    for ddl in FTS_SCHEMA:
+        conn.execute(text(ddl))
+    conn.execute(text("INSERT INTO athletes_fts(athletes_fts) VALUES ('rebuild')"))
+
+def _m1_athlete_columns(conn):
+    _add_columns(conn, "athletes", [("asc_number", "VARCHAR"), ("roles", "VARCHAR"), ("notes", "VARCHAR")])
+
+def _m2_indexes(conn):
+    sync_indexes(conn)
+
+def _m3_search_index(conn):
+    if not fts_supported():
+        print("Ricerca full-text non disponibile (FTS5/trigram mancante): verrà usata la ricerca semplice.")
+        return
+    if not table_exists(conn, "athletes_fts"):
+        create_search_index(conn)
+
+def _m4_sync(conn):
+    sync_columns = [("sync_uid", "VARCHAR"), ("sync_seq", "INTEGER"), ("updated_at", "VARCHAR")]
+    for table in SYNC_TABLES:
+        _add_columns(conn, table, sync_columns)
+    if table_exists(conn, "athletes_fts"):
+        # Trigger FTS limitato alle colonne indicizzate (le colonne di sincronizzazione cambiano spesso)
+        conn.execute(text("DROP TRIGGER IF EXISTS athletes_fts_au"))
+        conn.execute(text(next(ddl for ddl in FTS_SCHEMA if "athletes_fts_au" in ddl)))
+    # Righe esistenti: identificativo globale e versione 1, inviate alla prima sincronizzazione
+    for table in SYNC_TABLES:
+        conn.execute(text(f"""UPDATE {table} SET sync_uid = lower(hex(randomblob(16))), sync_seq = 1,
+                              updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE sync_uid IS NULL"""))
+    conn.execute(text("INSERT INTO sync_state (id, replica_id, clock) "
+                      "SELECT 1, lower(hex(randomblob(16))), 1 WHERE NOT EXISTS (SELECT 1 FROM sync_state)"))
+    for ddl in SYNC_SCHEMA:
+        conn.execute(text(ddl))
+    sync_indexes(conn)
+
+def _m5_change_log(conn):
+    # Tabella change_log creata da create_all; i trigger partono da questa versione
+    _add_columns(conn, "sync_state", [("change_log_floor", "INTEGER NOT NULL DEFAULT 0")])
+    for ddl in CHANGE_LOG_SCHEMA:
+        conn.execute(text(ddl))
+    sync_indexes(conn)
+
+def _m6_row_versions(conn):
+    for table in VERSIONED_TABLES:
+        _add_columns(conn, table, [("version", "INTEGER NOT NULL DEFAULT 1")])
+        # Il trigger di sincronizzazione ora incrementa anche version
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {table}_sync_au"))
+        conn.execute(text(next(ddl for ddl in SYNC_SCHEMA if f"{table}_sync_au" in ddl)))
+
+# (versione, descrizione, funzione) in ordine crescente
+MIGRATIONS = [
+    (1, "Colonne asc_number, roles, notes su athletes", _m1_athlete_columns),
+    (2, "Indici su athletes e medical_certificates", _m2_indexes),
+    (3, "Indice full-text athletes_fts", _m3_search_index),
+    (4, "Colonne, trigger e tabelle di sincronizzazione", _m4_sync),
+    (5, "Registro modifiche change_log", _m5_change_log),
+    (6, "Colonna version per il blocco ottimistico", _m6_row_versions),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def migrate(engine):
+    """
+    Porta il database a SCHEMA_VERSION. Se è già aggiornato costa una sola PRAGMA;
+    altrimenti crea le tabelle mancanti ed esegue tutte le migrazioni pendenti
+    in un'unica transazione (in caso di errore nulla viene applicato).
+    Ritorna la lista delle versioni applicate.
+    """
+    with engine.connect() as conn:
+        version = get_user_version(conn)
+    if version == SCHEMA_VERSION:
+        return []
+    if version > SCHEMA_VERSION:
+        raise Exception(f"Il database ha versione di schema {version}, più recente di questa applicazione ({SCHEMA_VERSION}).")
+
+    applied = []
+    with engine.connect() as conn:
+        # BEGIN esplicito: il driver sqlite3 non apre transazioni per le istruzioni DDL
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            Base.metadata.create_all(conn)
+            for number, description, func in MIGRATIONS:
+                if number > version:
+                    func(conn)
+                    applied.append(number)
+                    print(f"Migrazione {number} applicata: {description}")
+            conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return applied
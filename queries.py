@@ -0,0 +1,152 @@
+from sqlalchemy import select, func, case, and_, or_, table, column, literal_column
+from database import Athlete, MedicalCertificate, DatabaseManager, FTS_COLUMNS
+import datetime
+
+athletes = Athlete.__table__
+certificates = MedicalCertificate.__table__
+athletes_fts = table("athletes_fts", column("rowid"), column("rank"))
+
+# Il tokenizer trigram non trova sottostringhe più corte di 3 caratteri
+FTS_MIN_TERM = 3
+
+# Colonne secondarie di ordinamento, allineate agli indici di 'athletes'
+SORT_TIEBREAKERS = {"surname": ["name"]}
+
+# Chiavi di colonna calcolate (non presenti come colonne in 'athletes')
+COMPUTED_KEYS = ("id", "scadenza")
+
+# Colonne della lista atleti (vista e esportazioni); "fixed" = sempre visibile
+ATHLETE_COLUMNS = [
+    {"key": "id", "label": "#", "fixed": True},
+    {"key": "surname", "label": "Cognome", "fixed": True},
+    {"key": "name", "label": "Nome", "fixed": True},
+    {"key": "birth_date", "label": "Data Nascita"},
+    {"key": "birth_place", "label": "Luogo Nascita"},
+    {"key": "tax_code", "label": "Codice Fiscale"},
+    {"key": "current_belt", "label": "Cintura"},
+    {"key": "current_rank", "label": "Grado"},
+    {"key": "address", "label": "Indirizzo"},
+    {"key": "phone", "label": "Telefono"},
+    {"key": "email", "label": "Email"},
+    {"key": "asc_number", "label": "Numero ASC"},
+    {"key": "roles", "label": "Ruoli"},
+    {"key": "notes", "label": "Note"},
+    {"key": "scadenza", "label": "Scad. Cert."},
+]
+DEFAULT_VISIBLE_COLUMNS = ["id", "surname", "name", "current_belt", "current_rank", "scadenza"]
+
+def latest_expiry():
+    """
+    Scadenza del certificato più recente dell'atleta come subquery correlata: una sola
+    ricerca nell'indice (athlete_id, expiry_date) per ogni riga restituita, così una
+    pagina della lista costa uguale qualunque sia il numero di certificati.
+    """
+    return (select(func.max(certificates.c.expiry_date))
+            .where(certificates.c.athlete_id == athletes.c.id)
+            .correlate(athletes).scalar_subquery().label("scadenza"))
+
+def search_terms(text):
+    return text.split()
+
+def fts_match_expression(terms):
+    """Ogni termine diventa una frase FTS5 (sottostringa), in AND tra loro"""
+    return " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+def use_fts(terms):
+    return (DatabaseManager().fts_available and bool(terms)
+            and all(len(t) >= FTS_MIN_TERM for t in terms))
+
+def search_filter(text):
+    """Filtro LIKE di ripiego: ogni termine deve comparire in almeno una colonna"""
+    return and_(*[or_(*[athletes.c[c].ilike(f"%{t}%") for c in FTS_COLUMNS])
+                  for t in search_terms(text)])
+
+def athlete_list_columns(keys):
+    """Colonne dati effettivamente selezionate per le chiavi visibili"""
+    return [k for k in keys if k not in COMPUTED_KEYS and k in athletes.c]
+
+def athlete_list_query(keys, search_text="", sort_key=None, descending=False, athlete_ids=None):
+    """
+    Query Core per la lista atleti con le sole colonne visibili.
+    Ogni riga è una tupla (id, scadenza, <colonne di athlete_list_columns(keys)>).
+    Con athlete_ids solo le righe di quegli atleti (aggiornamento di poche righe).
+    """
+    expiry = latest_expiry()
+    data_cols = [athletes.c[k] for k in athlete_list_columns(keys)]
+    stmt = select(athletes.c.id, expiry, *data_cols)
+    if athlete_ids is not None:
+        stmt = stmt.where(athletes.c.id.in_(athlete_ids))
+
+    # Ordine naturale ("#"): rilevanza della ricerca full-text, altrimenti inserimento
+    relevance = []
+    terms = search_terms(search_text or "")
+    if use_fts(terms):
+        stmt = (stmt.join(athletes_fts, athletes_fts.c.rowid == athletes.c.id)
+                .where(literal_column("athletes_fts").op("MATCH")(fts_match_expression(terms))))
+        relevance = [athletes_fts.c.rank]
+    elif terms:
+        stmt = stmt.where(search_filter(search_text))
+
+    if sort_key == "scadenza":
+        sort_col = expiry
+    elif sort_key and sort_key != "id" and sort_key in athletes.c:
+        sort_col = athletes.c[sort_key]
+    else:
+        sort_col = None
+
+    if sort_col is not None:
+        order = [sort_col] + [athletes.c[k] for k in SORT_TIEBREAKERS.get(sort_key, [])] + [athletes.c.id]
+        stmt = stmt.order_by(*[c.desc() if descending else c.asc() for c in order])
+    else:
+        # La rilevanza resta decrescente (rank crescente): l'inversione vale solo per l'id
+        stmt = stmt.order_by(*relevance, athletes.c.id.desc() if descending else athletes.c.id.asc())
+    return stmt
+
+# Filtri della vista certificati (indice combo -> giorni, None = già scaduti)
+CERT_FILTER_DAYS = [30, 60, 90, None]
+
+def certificate_list_query(filter_idx, today=None, athlete_ids=None):
+    """
+    Certificati in scadenza con i dati di contatto dell'atleta in un'unica JOIN.
+    Ogni riga è una tupla (name, surname, cert_type, expiry_date, phone, email).
+    Con athlete_ids solo i certificati di quegli atleti (aggiornamento di poche righe).
+    """
+    today = today or datetime.date.today()
+    stmt = (select(athletes.c.name, athletes.c.surname, certificates.c.cert_type,
+                   certificates.c.expiry_date, athletes.c.phone, athletes.c.email)
+            .join(athletes, certificates.c.athlete_id == athletes.c.id))
+    if athlete_ids is not None:
+        stmt = stmt.where(certificates.c.athlete_id.in_(athlete_ids))
+
+    days = CERT_FILTER_DAYS[filter_idx] if 0 <= filter_idx < len(CERT_FILTER_DAYS) else None
+    if days is not None:
+        stmt = stmt.where(certificates.c.expiry_date.between(today, today + datetime.timedelta(days=days)))
+    else: # Expired
+        stmt = stmt.where(certificates.c.expiry_date < today)
+    return stmt.order_by(certificates.c.expiry_date)
+
+def dashboard_stats_query(today=None, athlete_ids=None):
+    """
+    Tutti i contatori della dashboard in un'unica istruzione:
+    (totale atleti, certificati agonistici, non agonistici, in scadenza entro 30 giorni)
+    Con athlete_ids il contributo ai contatori dei soli atleti indicati.
+    """
+    today = today or datetime.date.today()
+    total = select(func.count()).select_from(athletes)
+    if athlete_ids is not None:
+        total = total.where(athletes.c.id.in_(athlete_ids))
+    stmt = select(
+        total.scalar_subquery().label("total"),
+        func.count(case((certificates.c.cert_type == "Agonistico", 1))).label("agonisti"),
+        func.count(case((certificates.c.cert_type == "Non Agonistico", 1))).label("non_agonisti"),
+        func.count(case((certificates.c.expiry_date.between(today, today + datetime.timedelta(days=30)), 1))).label("expiring"),
+    ).select_from(certificates)
+    if athlete_ids is not None:
+        stmt = stmt.where(certificates.c.athlete_id.in_(athlete_ids))
+    return stmt
+
+def tax_code_list_query():
+    """Codici fiscali presenti, per la verifica in blocco: tuple (id, name, surname, tax_code)"""
+    return (select(athletes.c.id, athletes.c.name, athletes.c.surname, athletes.c.tax_code)
+            .where(athletes.c.tax_code.is_not(None), athletes.c.tax_code != "")
+            .order_by(athletes.c.surname, athletes.c.name))
@@ -1,29 +1,184 @@
+"""
+Aggiornamento dell'archivio dei comuni (comuni.bin) usato per il Codice Fiscale.
+
+    python setup_comuni.py                         # scarica l'elenco attuale (URL predefinito)
+    python setup_comuni.py --file comuni.csv       # da un file locale, senza rete
+    python setup_comuni.py --compila               # da comuni_map.json (come --file comuni_map.json)
+    python setup_comuni.py --url https://...       # da un altro indirizzo
+    python setup_comuni.py --file x.csv --prova    # mostra solo le differenze
+
+Sono accettati file JSON (lista di comuni o mappatura codice -> nome) e CSV con
+date di validità (es. archivio storico ANPR: CODCATASTALE, DENOMINAZIONE_IT,
+DATAISTITUZIONE, DATACESSAZIONE). L'archivio esistente viene aggiornato solo nelle
+differenze e i comuni soppressi restano con il loro periodo di validità.
+"""
+import argparse
+import csv
+import datetime
+import io
 import json
 import urllib.request
 import os
+from cf_utils import (COMUNI_JSON, COMUNI_STORE, OPEN_START, OPEN_END, ComuniStore,
+                      write_comuni_store, reset_comuni_cache)
+
+DEFAULT_URL = "https://raw.githubusercontent.com/matteocontrini/comuni-json/master/comuni.json"
+
+# Nomi di colonna riconosciuti (minuscolo) nei diversi formati
+CODE_FIELDS = ("codcatastale", "codicecatastale", "codice_catastale", "codice_belfiore", "belfiore")
+NAME_FIELDS = ("denominazione_it", "denominazione", "denominazione_ita", "nome")
+FROM_FIELDS = ("dataistituzione", "data_inizio_validita", "data_inizio", "valido_dal")
+TO_FIELDS = ("datacessazione", "data_fine_validita", "data_fine", "valido_al")
+
+def _field(item, names):
+    for key, value in item.items():
+        if key and key.strip().lower() in names:
+            return value.strip() if isinstance(value, str) else value
+    return None
+
+def _parse_date(value, default):
+    """Date del dataset come ordinali; vuota o 9999-12-31 = estremo aperto"""
+    if not value:
+        return default
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            day = datetime.datetime.strptime(str(value)[:19], fmt).date()
+            return OPEN_END if day.year >= 9999 else day.toordinal()
+        except ValueError:
+            continue
+    raise ValueError(f"Data non valida nel dataset: {value}")
+
+def parse_dataset(content, name):
+    """
+    Record (codice, inizio, fine, nome) dal contenuto di un dataset.
+    Ritorna anche se il dataset riporta le date di validità (storico) o solo i comuni attuali.
+    """
+    if name.lower().endswith(".json"):
+        data = json.loads(content.decode("utf-8-sig"))
+        items = [{"codice_catastale": k, "nome": v} for k, v in data.items()] if isinstance(data, dict) else data
+    else:
+        try:
+            text = content.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            text = content.decode("latin-1")
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+        items = list(csv.DictReader(io.StringIO(text), dialect=dialect))
+
+    records = set()
+    has_history = False
+    for item in items:
+        code = _field(item, CODE_FIELDS)
+        name_value = _field(item, NAME_FIELDS)
+        if not code or not name_value:
+            continue
+        start = _field(item, FROM_FIELDS)
+        end = _field(item, TO_FIELDS)
+        has_history = has_history or bool(start or end)
+        records.add((code.upper(), _parse_date(start, OPEN_START), _parse_date(end, OPEN_END), name_value.upper()))
+    if not records:
+        raise ValueError("Nessun comune riconosciuto nel dataset (colonne codice catastale e nome mancanti?)")
+    return records, has_history
+
+def merge_records(current, incoming, has_history, today=None):
+    """
+    Nuovo insieme di record a partire da quello esistente.
+    - Dataset storico: per i codici presenti i periodi del dataset sostituiscono quelli salvati.
+    - Solo comuni attuali: un nome cambiato chiude il periodo in corso e ne apre uno nuovo,
+      un codice scomparso viene chiuso (soppresso) ma resta nell'archivio.
+    I codici assenti dal dataset non vengono mai cancellati.
+    """
+    today = (today or datetime.date.today()).toordinal()
+    if has_history:
+        codes = {r[0] for r in incoming}
+        return {r for r in current if r[0] not in codes} | set(incoming)
 
-def setup():
-    url = "https://raw.githubusercontent.com/matteocontrini/comuni-json/master/comuni.json"
-    target_path = os.path.join(os.path.dirname(__file__), 'comuni_map.json')
-    
+    result = set(current)
+    open_records = {r[0]: r for r in current if r[2] == OPEN_END}
+    known = {r[0] for r in current}
+    names = {code: name for code, _, _, name in incoming}
+    for code, record in open_records.items():
+        if names.get(code) == record[3]:
+            continue
+        # Rinominato o soppresso: il periodo attuale termina ieri
+        result.discard(record)
+        result.add((code, record[1], max(record[1], today - 1), record[3]))
+        if code in names:
+            result.add((code, today, OPEN_END, names[code]))
+    for code, name in names.items():
+        if code not in known:
+            result.add((code, OPEN_START, OPEN_END, name))
+        elif code not in open_records:
+            # Codice cessato che ricompare
+            result.add((code, today, OPEN_END, name))
+    return result
+
+def load_current_records():
+    if not os.path.exists(COMUNI_STORE):
+        return set()
+    with open(COMUNI_STORE, "rb") as f:
+        try:
+            return set(ComuniStore.from_bytes(f.read()).records())
+        except ValueError as e:
+            print(f"Archivio esistente non leggibile ({e}): verrà ricreato.")
+            return set()
+
+def read_source(path=None, url=None):
+    if path:
+        print(f"Lettura dati comuni da {path}...")
+        with open(path, "rb") as f:
+            return f.read(), path
+    url = url or DEFAULT_URL
     print(f"Scaricamento dati comuni da {url}...")
+    with urllib.request.urlopen(url) as response:
+        return response.read(), url
+
+def refresh(path=None, url=None, dry_run=False):
+    """Aggiorna comuni.bin con le sole differenze; ritorna (aggiunti, rimossi)"""
+    content, name = read_source(path, url)
+    incoming, has_history = parse_dataset(content, name)
+    current = load_current_records()
+    merged = merge_records(current, incoming, has_history)
+
+    added = merged - current
+    removed = current - merged
+    kind = "storico" if has_history else "solo comuni attuali"
+    print(f"Dataset {kind}: {len(incoming)} record. Archivio: {len(current)} -> {len(merged)} record.")
+    print(f"Periodi aggiunti o modificati: {len(added)}, sostituiti: {len(removed)}.")
+    for code, start, end, comune in sorted(added)[:20]:
+        since = datetime.date.fromordinal(start).isoformat() if start != OPEN_START else "..."
+        until = datetime.date.fromordinal(end).isoformat() if end != OPEN_END else "..."
+        print(f"  + {code} {comune} ({since} / {until})")
+    if len(added) > 20:
+        print(f"  ... e altri {len(added) - 20}")
+
+    if dry_run or not (added or removed):
+        if not (added or removed):
+            print("Nessuna modifica da applicare.")
+        return added, removed
+
+    write_comuni_store(ComuniStore.from_records(merged))
+    reset_comuni_cache()
+    print(f"Archivio aggiornato in {COMUNI_STORE} ({os.path.getsize(COMUNI_STORE)} byte).")
+
+    if not path and not url and not has_history:
+        # Elenco attuale scaricato: aggiorna anche il file JSON di ripiego
+        with open(COMUNI_JSON, "w", encoding="utf-8") as f:
+            json.dump({code: comune for code, _, _, comune in sorted(incoming, key=lambda r: r[3])}, f, ensure_ascii=False, indent=2)
+    return added, removed
+
+def setup(path=None, url=None, dry_run=False):
     try:
-        with urllib.request.urlopen(url) as response:
-            data = json.loads(response.read().decode('utf-8'))
-            
-        mapping = {}
-        for item in data:
-            code = item.get("codiceCatastale")
-            name = item.get("nome")
-            if code and name:
-                mapping[code] = name.upper()
-                
-        with open(target_path, 'w', encoding='utf-8') as f:
-            json.dump(mapping, f, ensure_ascii=False, indent=2)
-            
-        print(f"Mappatura salvata con successo in {target_path} ({len(mapping)} comuni).")
+        refresh(path, url, dry_run)
     except Exception as e:
         print(f"Errore durante il setup dei comuni: {e}")
 
 if __name__ == "__main__":
-    setup()
+    parser = argparse.ArgumentParser(description="Aggiorna l'elenco dei comuni usato per il Codice Fiscale")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--file", help="Dataset locale (JSON o CSV), nessun accesso alla rete")
+    source.add_argument("--compila", action="store_true",
+                        help="Compila comuni.bin da comuni_map.json, senza rete (come --file comuni_map.json)")
+    source.add_argument("--url", help=f"Indirizzo da cui scaricare il dataset (predefinito: {DEFAULT_URL})")
+    parser.add_argument("--prova", action="store_true", help="Mostra le differenze senza modificare l'archivio")
+    args = parser.parse_args()
+    setup(COMUNI_JSON if args.compila else args.file, args.url, args.prova)
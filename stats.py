@@ -0,0 +1,86 @@
+from collections import namedtuple
+from sqlalchemy import select
+from database import DatabaseManager, ChangeLogGap, get_session
+from queries import dashboard_stats_query, certificates
+import datetime
+
+# Contatori della dashboard memorizzati finché il registro modifiche (change_log) non avanza:
+# vale anche per le modifiche fatte da altri processi (cli.py, sincronizzazione).
+_stats_cache = None
+_stats_key = None
+
+def invalidate_stats():
+    global _stats_cache, _stats_key
+    _stats_cache = None
+    _stats_key = None
+
+def get_dashboard_stats():
+    """Ritorna dict con total, agonisti, non_agonisti, expiring (in cache se nulla è cambiato)"""
+    global _stats_cache, _stats_key
+    db = DatabaseManager()
+    today = datetime.date.today()
+    # La scadenza a 30 giorni dipende dalla data: la chiave include il giorno corrente
+    key = (db.db_path, today, db.last_change())
+    if _stats_cache is not None and _stats_key == key:
+        return _stats_cache
+
+    session = get_session()
+    try:
+        row = session.execute(dashboard_stats_query(today)).one()
+        _stats_cache = dict(row._mapping)
+        _stats_key = key
+    finally:
+        session.close()
+    return _stats_cache
+
+# Contributo di alcuni atleti ai contatori, letto prima e dopo una modifica nota (es. AthleteDialog)
+AthleteSnapshot = namedtuple("AthleteSnapshot", "athlete_ids counters cert_ids cursor today")
+
+def athlete_snapshot(athlete_ids):
+    """Contatori e certificati dei soli atleti indicati, con il cursore del registro modifiche"""
+    db = DatabaseManager()
+    ids = set(athlete_ids)
+    today = datetime.date.today()
+    cursor = db.last_change()
+    session = get_session()
+    try:
+        counters = dict(session.execute(dashboard_stats_query(today, ids)).one()._mapping)
+        cert_ids = set(session.execute(
+            select(certificates.c.id).where(certificates.c.athlete_id.in_(ids))).scalars())
+    finally:
+        session.close()
+    return AthleteSnapshot(ids, counters, cert_ids, cursor, today)
+
+def snapshot_cursor(before, after):
+    """
+    Nuovo cursore del registro modifiche se da 'before' sono cambiati solo gli atleti degli
+    snapshot e i loro certificati (e gradi); None se nel frattempo è cambiato altro
+    (altro processo, sincronizzazione) e le viste vanno rilette.
+    """
+    try:
+        changes, cursor = DatabaseManager().changes_since(before.cursor)
+    except ChangeLogGap:
+        return None
+    athlete_ids = before.athlete_ids | after.athlete_ids
+    cert_ids = before.cert_ids | after.cert_ids
+    for change in changes:
+        if change.table_name == "athletes" and change.row_id not in athlete_ids:
+            return None
+        if change.table_name == "medical_certificates" and change.row_id not in cert_ids:
+            return None
+    return cursor
+
+def adjust_dashboard_stats(before, after, cursor):
+    """
+    Applica ai contatori in cache la differenza tra due snapshot, senza rileggere le tabelle.
+    Se la cache non corrisponde allo stato di 'before' viene invalidata (ritorna False).
+    """
+    global _stats_cache, _stats_key
+    db = DatabaseManager()
+    if (_stats_cache is None or cursor is None or after.today != before.today
+            or _stats_key != (db.db_path, before.today, before.cursor)):
+        invalidate_stats()
+        return False
+    _stats_cache = {k: v + after.counters[k] - before.counters[k] for k, v in _stats_cache.items()}
+    _stats_key = (db.db_path, after.today, cursor)
+    return True
@@ -0,0 +1,447 @@
+"""
+Sincronizzazione incrementale tra copie del database (es. reception, ufficio, portatile).
+
+Ogni riga di athletes, medical_certificates e ranks ha un identificativo globale (sync_uid),
+una versione locale (sync_seq, dal contatore sync_state.clock) e l'ora dell'ultima modifica
+(updated_at), assegnati dai trigger; le cancellazioni lasciano una tombstone. Per ogni copia
+remota sync_peers ricorda fin dove sono già state scambiate le modifiche, così vengono lette
+e trasferite solo le righe cambiate nel frattempo: il tempo dipende dal numero di modifiche
+e non dalla dimensione del database.
+
+La copia remota è un oggetto con l'interfaccia di Replica (begin, changes_since, apply, ...):
+SqliteRemote usa un secondo file SQLite, anche in una cartella condivisa.
+
+Conflitti (riga modificata da entrambe le parti dall'ultima sincronizzazione):
+- atleti: confronto campo per campo come in ConflictDialog (maiuscole/minuscole e spazi
+  ignorati, un valore remoto vuoto non sovrascrive); strategia come in GlobalConflictDialog
+  e, in modalità manuale, scelta dei campi con resolve_conflict(atleta locale, dati remoti)
+- certificati e gradi: vince la copia remota, o quella locale con "keep_current"
+- una cancellazione prevale sulle modifiche dell'altra parte
+"""
+import datetime
+import os
+import random
+import time
+from sqlalchemy import create_engine, event, select, insert, update, delete, bindparam
+from sqlalchemy.exc import OperationalError
+from database import (Athlete, MedicalCertificate, Rank, SyncTombstone, SyncState, SyncPeer,
+                      DatabaseManager, apply_pragmas, is_busy_error, WRITE_RETRIES, WRITE_BACKOFF)
+
+# Stesse strategie dell'importazione (vedi GlobalConflictDialog)
+STRATEGY_MANUAL = "manual"
+STRATEGY_OVERWRITE_ALL = "overwrite_all"
+STRATEGY_KEEP_CURRENT = "keep_current"
+
+# Nome del file di sincronizzazione quando viene indicata una cartella condivisa
+REMOTE_FILE_NAME = "gestionale_sync.db"
+
+# Il file remoto può stare su una cartella di rete: niente WAL né mmap
+REMOTE_PRAGMA_PROFILE = "rete"
+
+# Parametri per ogni IN (...)
+CHUNK_SIZE = 500
+
+athletes = Athlete.__table__
+certificates = MedicalCertificate.__table__
+ranks = Rank.__table__
+tombstones = SyncTombstone.__table__
+CHILD_TABLES = [certificates, ranks]
+TABLES = {t.name: t for t in [athletes] + CHILD_TABLES}
+
+# Colonne locali, non trasferite (athlete_id diventa athlete_uid; version cresce ad ogni modifica locale)
+LOCAL_COLUMNS = ("id", "sync_seq", "athlete_id", "version")
+
+def data_columns(table):
+    return [c for c in table.c if c.name not in LOCAL_COLUMNS]
+
+def chunked(items, size=CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+# --- CONFRONTO (come ConflictDialog / importer.has_differences) ---
+
+def _norm(value):
+    return str(value or "").strip().lower()
+
+def differing_fields(local, remote):
+    """Campi in cui il dato remoto, non vuoto, è diverso da quello locale"""
+    return [k for k, v in remote.items()
+            if k not in ("sync_uid", "updated_at") and _norm(v) != "" and _norm(local.get(k)) != _norm(v)]
+
+class RowView:
+    """Accesso per attributo a un dict di valori (ConflictDialog usa getattr sull'atleta)"""
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+# --- COPIE ---
+
+class Replica:
+    """
+    Copia del database raggiungibile con un engine SQLAlchemy. Tutte le operazioni
+    avvengono nella transazione aperta da begin(): di sola lettura con immediate=False,
+    altrimenti BEGIN IMMEDIATE (nessun'altra scrittura nel frattempo) confermata da commit().
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.conn = None
+
+    def begin(self, immediate=True):
+        self.conn = self.engine.connect()
+        self.conn.exec_driver_sql("BEGIN IMMEDIATE" if immediate else "BEGIN")
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        if self.conn is not None:
+            self.conn.rollback()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    @property
+    def replica_id(self):
+        return self.conn.execute(select(SyncState.replica_id)).scalar()
+
+    def clock(self):
+        return self.conn.execute(select(SyncState.clock)).scalar()
+
+    def peer_state(self, peer_id):
+        """(ultimo clock locale inviato, ultimo clock remoto ricevuto) per la copia peer_id"""
+        row = self.conn.execute(select(SyncPeer.last_sent, SyncPeer.last_received)
+                                .where(SyncPeer.peer_id == peer_id)).first()
+        return tuple(row) if row else (0, 0)
+
+    def save_peer_state(self, peer_id, last_sent, last_received):
+        values = {"last_sent": last_sent, "last_received": last_received, "synced_at": _now()}
+        if self.conn.execute(update(SyncPeer).where(SyncPeer.peer_id == peer_id).values(**values)).rowcount == 0:
+            self.conn.execute(insert(SyncPeer).values(peer_id=peer_id, **values))
+
+    def _select(self, table):
+        columns = data_columns(table)
+        if table is athletes:
+            return select(*columns)
+        # Riferimento all'atleta tramite il suo identificativo globale
+        return (select(*columns, athletes.c.sync_uid.label("athlete_uid"))
+                .select_from(table.outerjoin(athletes, athletes.c.id == table.c.athlete_id)))
+
+    def changes_since(self, seq):
+        """
+        Righe modificate e cancellate con versione > seq: {tabella: {sync_uid: valori o None}}.
+        Usa gli indici su sync_seq: legge solo le righe cambiate.
+        """
+        changes = {name: {} for name in TABLES}
+        for table_name, uid in self.conn.execute(
+                select(tombstones.c.table_name, tombstones.c.sync_uid).where(tombstones.c.sync_seq > seq)):
+            if table_name in changes:
+                changes[table_name][uid] = None
+        for name, table in TABLES.items():
+            for row in self.conn.execute(self._select(table).where(table.c.sync_seq > seq)):
+                changes[name][row.sync_uid] = dict(row._mapping)
+        return changes
+
+    def athletes_by_tax_code(self, tax_codes):
+        """Atleti (tutti, non solo modificati) con i codici fiscali indicati"""
+        found = {}
+        for chunk in chunked(set(tax_codes)):
+            for row in self.conn.execute(self._select(athletes).where(athletes.c.tax_code.in_(chunk))):
+                found[row.tax_code] = dict(row._mapping)
+        return found
+
+    def _ids(self, table, uids):
+        ids = {}
+        for chunk in chunked(uids):
+            ids.update(self.conn.execute(select(table.c.sync_uid, table.c.id)
+                                         .where(table.c.sync_uid.in_(chunk))).all())
+        return ids
+
+    def _upsert(self, table, rows):
+        """rows: {sync_uid attuale: valori} (i valori possono contenere un nuovo sync_uid)"""
+        if not rows:
+            return 0
+        ids = self._ids(table, rows.keys())
+        columns = [c.name for c in data_columns(table)]
+        if table is not athletes:
+            columns.append("athlete_id")
+        updates = [dict(values, _id=ids[uid]) for uid, values in rows.items() if uid in ids]
+        inserts = [values for uid, values in rows.items() if uid not in ids]
+        if updates:
+            self.conn.execute(update(table).where(table.c.id == bindparam("_id"))
+                              .values({c: bindparam(c) for c in columns}),
+                              [{k: v for k, v in u.items() if k in columns or k == "_id"} for u in updates])
+        if inserts:
+            self.conn.execute(insert(table), [{k: v for k, v in i.items() if k in columns} for i in inserts])
+            # Riga ricreata con lo stesso identificativo: la vecchia tombstone non vale più
+            for chunk in chunked([i["sync_uid"] for i in inserts]):
+                self.conn.execute(delete(tombstones).where(tombstones.c.table_name == table.name,
+                                                           tombstones.c.sync_uid.in_(chunk)))
+        return len(updates) + len(inserts)
+
+    def _delete(self, table, uids):
+        ids = list(self._ids(table, uids).values())
+        for chunk in chunked(ids):
+            if table is athletes:
+                # Certificati e gradi dell'atleta (foreign key senza ON DELETE CASCADE)
+                for child in CHILD_TABLES:
+                    self.conn.execute(delete(child).where(child.c.athlete_id.in_(chunk)))
+            self.conn.execute(delete(table).where(table.c.id.in_(chunk)))
+        return len(ids)
+
+    def apply(self, changes):
+        """
+        Applica {tabella: {sync_uid: valori o None}}: prima gli atleti, poi certificati e gradi
+        (athlete_uid -> id locale), infine le cancellazioni. Ritorna il numero di righe scritte.
+        Certificati e gradi di un atleta non presente vengono ignorati.
+        """
+        written = self._upsert(athletes, {u: v for u, v in changes["athletes"].items() if v is not None})
+        for table in CHILD_TABLES:
+            rows = {u: v for u, v in changes[table.name].items() if v is not None}
+            athlete_ids = self._ids(athletes, {v["athlete_uid"] for v in rows.values() if v["athlete_uid"]})
+            for values in rows.values():
+                values["athlete_id"] = athlete_ids.get(values["athlete_uid"])
+            written += self._upsert(table, {u: v for u, v in rows.items() if v["athlete_id"] is not None})
+        for table in CHILD_TABLES + [athletes]:
+            written += self._delete(table, [u for u, v in changes[table.name].items() if v is None])
+        return written
+
+class SqliteRemote(Replica):
+    """Copia remota in un file SQLite (creato se manca); con una cartella usa REMOTE_FILE_NAME"""
+
+    def __init__(self, path):
+        if os.path.isdir(path):
+            path = os.path.join(path, REMOTE_FILE_NAME)
+        self.path = path
+        engine = create_engine(f"sqlite:///{path}")
+        event.listen(engine, "connect", lambda conn, record: apply_pragmas(conn, REMOTE_PRAGMA_PROFILE))
+        from migrations import migrate
+        migrate(engine)
+        super().__init__(engine)
+
+    def dispose(self):
+        self.close()
+        self.engine.dispose()
+
+# --- UNIONE ---
+
+def _merge_athlete(local, remote, strategy, resolve_conflict):
+    """Valori risultanti per un atleta modificato da entrambe le parti"""
+    fields = differing_fields(local, remote)
+    merged = dict(local)
+    if fields and strategy == STRATEGY_OVERWRITE_ALL:
+        merged.update({k: remote[k] for k in fields})
+    elif fields and strategy == STRATEGY_MANUAL and resolve_conflict:
+        chosen = resolve_conflict(RowView(local), remote) or {}
+        # ConflictDialog restituisce testi: si usano i valori tipizzati della copia remota
+        merged.update({k: remote[k] for k in chosen if k in fields})
+    merged["updated_at"] = max(local["updated_at"] or "", remote["updated_at"] or "") or None
+    return merged
+
+def _pair_athletes(local, remote, mine, theirs):
+    """
+    Coppie (uid locale, uid remoto) dello stesso atleta modificato da almeno una parte.
+    Oltre allo stesso sync_uid, lo stesso codice fiscale: atleta inserito su entrambe le copie.
+    """
+    pairs = {(uid, uid) for uid in mine.keys() & theirs.keys()}
+    rows = {}
+    for side, other, changed, other_changed in ((local, remote, mine, theirs), (remote, local, theirs, mine)):
+        codes = {v["tax_code"]: uid for uid, v in changed.items() if v is not None and uid not in other_changed}
+        for code, row in other.athletes_by_tax_code(codes).items():
+            if row["sync_uid"] != codes[code]:
+                pair = (codes[code], row["sync_uid"]) if side is local else (row["sync_uid"], codes[code])
+                pairs.add(pair)
+                rows[(other is local, row["sync_uid"])] = row
+    return pairs, rows
+
+def read_changes(local, remote):
+    """
+    Legge da ciascuna copia, in una transazione di sola lettura (nessun lock di scrittura),
+    le modifiche da scambiare e gli atleti da abbinare. Le transazioni vengono chiuse subito:
+    le domande all'utente arrivano dopo. Ritorna il dict usato da plan_changes e write_changes.
+    """
+    local.begin(immediate=False)
+    try:
+        remote.begin(immediate=False)
+        try:
+            local_id, remote_id = local.replica_id, remote.replica_id
+            if local_id == remote_id:
+                raise Exception("La copia remota è lo stesso database (o una sua copia del file): "
+                                "usare un file di sincronizzazione diverso.")
+            peer_state = local.peer_state(remote_id)
+            mine = local.changes_since(peer_state[0])
+            theirs = remote.changes_since(peer_state[1])
+            pairs, fetched = _pair_athletes(local, remote, mine["athletes"], theirs["athletes"])
+            return {"local_id": local_id, "remote_id": remote_id, "peer_state": peer_state,
+                    "local_clock": local.clock(), "remote_clock": remote.clock(),
+                    "mine": mine, "theirs": theirs, "pairs": pairs, "fetched": fetched}
+        finally:
+            remote.rollback()
+            remote.close()
+    finally:
+        local.rollback()
+        local.close()
+
+def _athlete_pairs(snapshot):
+    """(uid locale, uid remoto, valori locali, valori remoti) per ogni coppia; None se cancellato"""
+    mine, theirs, fetched = snapshot["mine"]["athletes"], snapshot["theirs"]["athletes"], snapshot["fetched"]
+    for a, b in snapshot["pairs"]:
+        l_row = mine.get(a) if a in mine else fetched.get((True, a))
+        r_row = theirs.get(b) if b in theirs else fetched.get((False, b))
+        yield a, b, l_row, r_row
+
+def plan_changes(snapshot, strategy, resolve_conflict=None):
+    """
+    Dalle modifiche lette con read_changes calcola cosa scrivere su ciascuna copia, senza
+    accedere ai database. Ritorna (per la copia locale, per la copia remota, numero di conflitti).
+    """
+    mine, theirs = snapshot["mine"], snapshot["theirs"]
+    to_local = {name: {} for name in TABLES}
+    to_remote = {name: {} for name in TABLES}
+    conflicts = 0
+
+    paired_local = {a for a, _ in snapshot["pairs"]}
+    paired_remote = {b for _, b in snapshot["pairs"]}
+    alias = {}
+    for a, b, l_row, r_row in _athlete_pairs(snapshot):
+        if l_row is None or r_row is None:
+            # Cancellato da una parte: la cancellazione prevale
+            if l_row is not None:
+                to_local["athletes"][a] = None
+            if r_row is not None:
+                to_remote["athletes"][b] = None
+            continue
+        if differing_fields(l_row, r_row):
+            conflicts += 1
+        merged = _merge_athlete(l_row, r_row, strategy, resolve_conflict)
+        # Stesso atleta con due identificativi: entrambe le copie adottano il minore
+        merged["sync_uid"] = min(a, b)
+        alias[a] = alias[b] = merged["sync_uid"]
+        if merged != l_row:
+            to_local["athletes"][a] = merged
+        if merged != r_row:
+            to_remote["athletes"][b] = merged
+
+    for uid, values in theirs["athletes"].items():
+        if uid not in paired_remote:
+            to_local["athletes"][uid] = values
+    for uid, values in mine["athletes"].items():
+        if uid not in paired_local:
+            to_remote["athletes"][uid] = values
+
+    for table in CHILD_TABLES:
+        name = table.name
+        for uid in mine[name].keys() | theirs[name].keys():
+            l_row = mine[name].get(uid, False)
+            r_row = theirs[name].get(uid, False)
+            for row in (l_row, r_row):
+                if row and row["athlete_uid"] in alias:
+                    row["athlete_uid"] = alias[row["athlete_uid"]]
+            if r_row is False:
+                to_remote[name][uid] = l_row
+            elif l_row is False:
+                to_local[name][uid] = r_row
+            elif l_row is None or r_row is None:
+                to_local[name][uid] = to_remote[name][uid] = None
+            elif l_row != r_row:
+                conflicts += 1
+                winner = l_row if strategy == STRATEGY_KEEP_CURRENT else r_row
+                to_local[name][uid] = to_remote[name][uid] = winner
+    return to_local, to_remote, conflicts
+
+def count_athlete_conflicts(snapshot):
+    """Atleti modificati da entrambe le parti con dati diversi (per chiedere la strategia)"""
+    return sum(1 for _, _, l_row, r_row in _athlete_pairs(snapshot)
+               if l_row is not None and r_row is not None and differing_fields(l_row, r_row))
+
+def write_changes(local, remote, snapshot, to_local, to_remote):
+    """
+    Applica to_local e to_remote con una transazione breve (BEGIN IMMEDIATE) per copia, dopo
+    aver verificato che nessuna delle due sia cambiata da read_changes (clock e stato del peer).
+    Ritorna (righe ricevute, righe inviate), o None senza scrivere nulla se qualcosa è cambiato.
+    """
+    local.begin()
+    try:
+        remote.begin()
+        try:
+            current = (local.clock(), remote.clock(), local.peer_state(snapshot["remote_id"]))
+            if current != (snapshot["local_clock"], snapshot["remote_clock"], snapshot["peer_state"]):
+                remote.rollback()
+                local.rollback()
+                return None
+            received = local.apply(to_local)
+            sent = remote.apply(to_remote)
+
+            # Le righe appena scambiate sono note a entrambe: non vanno rimandate indietro
+            local_clock, remote_clock = local.clock(), remote.clock()
+            local.save_peer_state(snapshot["remote_id"], local_clock, remote_clock)
+            remote.save_peer_state(snapshot["local_id"], remote_clock, local_clock)
+            remote.commit()
+        except Exception:
+            remote.rollback()
+            raise
+        finally:
+            remote.close()
+        local.commit()
+    except Exception:
+        local.rollback()
+        raise
+    finally:
+        local.close()
+    return received, sent
+
+def _remembered(resolve_conflict):
+    """resolve_conflict che, a un nuovo tentativo, non richiede la scelta per gli stessi dati"""
+    choices = {}
+    def resolve(local, remote):
+        key = (repr(sorted(vars(local).items())), repr(sorted(remote.items())))
+        if key not in choices:
+            choices[key] = resolve_conflict(local, remote)
+        return choices[key]
+    return resolve
+
+def synchronize(remote, strategy=None, ask_strategy=None, resolve_conflict=None, local=None,
+                retries=WRITE_RETRIES, backoff=WRITE_BACKOFF):
+    """
+    Scambia con la copia remota le modifiche avvenute dall'ultima sincronizzazione.
+    strategy: strategia per i conflitti; se None e ci sono conflitti sugli atleti viene
+    chiesta con ask_strategy(numero di conflitti), che ritorna None per annullare
+    (senza ask_strategy la sincronizzazione viene annullata).
+    Lettura, domande all'utente e scrittura sono fasi separate: nessun lock resta aperto
+    mentre si attende una risposta. Se una copia cambia prima della scrittura, o resta
+    occupata, si rilegge e si riprova (fino a 'retries' volte, con la strategia già scelta).
+    Le due copie vengono aggiornate insieme: in caso di errore nessuna modifica viene applicata.
+    Ritorna un dict con righe ricevute/inviate, conflitti e "cancelled".
+    """
+    local = local or Replica(DatabaseManager().engine)
+    resolve_conflict = _remembered(resolve_conflict) if resolve_conflict else None
+    result = {"received": 0, "sent": 0, "conflicts": 0, "cancelled": False}
+    for attempt in range(retries + 1):
+        snapshot = read_changes(local, remote)
+        if strategy is None:
+            conflict_count = count_athlete_conflicts(snapshot)
+            if conflict_count:
+                strategy = ask_strategy(conflict_count) if ask_strategy else None
+                if strategy is None:
+                    result["cancelled"] = True
+                    return result
+
+        to_local, to_remote, result["conflicts"] = plan_changes(
+            snapshot, strategy or STRATEGY_MANUAL, resolve_conflict)
+        try:
+            written = write_changes(local, remote, snapshot, to_local, to_remote)
+        except OperationalError as e:
+            if not is_busy_error(e) or attempt == retries:
+                raise
+            written = None
+        if written is not None:
+            result["received"], result["sent"] = written
+            return result
+        if attempt < retries:
+            time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+    raise Exception("Le copie sono state modificate durante la sincronizzazione: riprovare.")
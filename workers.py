@@ -0,0 +1,250 @@
+from PySide6.QtCore import QObject, QRunnable, QThread, Signal
+from database import DatabaseManager
+import threading
+import time
+
+class QuerySignals(QObject):
+    finished = Signal(int, object)   # generation, lista di tuple
+    failed = Signal(int, str)        # generation, messaggio di errore
+
+class QueryTask(QRunnable):
+    """
+    Esegue una SELECT su un thread del QThreadPool con una sessione propria.
+    La generation permette al chiamante di scartare i risultati superati;
+    cancel() interrompe la query SQLite ancora in esecuzione.
+    """
+
+    def __init__(self, generation, stmt):
+        super().__init__()
+        self.generation = generation
+        self.stmt = stmt
+        self.signals = QuerySignals()
+        self.cancelled = False
+        # Connessione della query in corso; il lock impedisce di interromperla dopo che
+        # è tornata al pool (e magari è già usata da un altro thread)
+        self._dbapi_conn = None
+        self._conn_lock = threading.Lock()
+
+    def cancel(self):
+        self.cancelled = True
+        with self._conn_lock:
+            if self._dbapi_conn is not None:
+                try:
+                    self._dbapi_conn.interrupt()  # La query in corso fallisce con "interrupted"
+                except Exception:
+                    pass
+
+    def run(self):
+        db = DatabaseManager()
+        # scoped_session: ogni thread del pool ottiene la propria sessione
+        session = db.get_session()
+        try:
+            if self.cancelled:
+                return
+            with self._conn_lock:
+                self._dbapi_conn = session.connection().connection.driver_connection
+            if self.cancelled:
+                return
+            rows = [tuple(r) for r in session.execute(self.stmt)]
+            if not self.cancelled:
+                self.signals.finished.emit(self.generation, rows)
+        except Exception as e:
+            if not self.cancelled:
+                self.signals.failed.emit(self.generation, str(e))
+        finally:
+            with self._conn_lock:
+                self._dbapi_conn = None
+            session.close()
+            db.SessionFactory.remove()
+
+class InteractiveWorker(QThread):
+    """
+    Base dei worker che durante l'elaborazione chiedono all'utente una strategia
+    globale per i conflitti o la risoluzione di un singolo conflitto.
+
+    I segnali vanno collegati con Qt.BlockingQueuedConnection: lo slot gira nel thread
+    GUI, imposta self.answer e il worker riprende solo dopo la risposta.
+    """
+    strategyRequested = Signal(int)                   # numero di conflitti
+    conflictRequested = Signal(object, object)        # atleta esistente, dati nuovi
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.answer = None
+        self._paused = 0.0       # tempo passato in attesa dell'utente
+
+    def _ask(self, signal, *args):
+        self.answer = None
+        start = time.perf_counter()
+        signal.emit(*args)
+        self._paused += time.perf_counter() - start
+        return self.answer
+
+    def _ask_strategy(self, conflict_count):
+        return self._ask(self.strategyRequested, conflict_count)
+
+    def _resolve_conflict(self, athlete, row_data):
+        return self._ask(self.conflictRequested, athlete, row_data)
+
+class ImportWorker(InteractiveWorker):
+    """
+    Esegue importer.run_import su un thread separato con una sessione propria.
+    Strategia e conflitti manuali vengono chiesti solo quando servono (vedi InteractiveWorker).
+    """
+    progressChanged = Signal(int, int, float, float)  # righe elaborate, totale stimato, righe/s, secondi rimanenti (-1 = n/d)
+    completed = Signal(object)                        # dict dei risultati di run_import
+    failed = Signal(str, object)                      # errore, risultati dei blocchi già salvati (o None)
+
+    PROGRESS_INTERVAL = 0.1  # secondi tra due aggiornamenti dell'avanzamento
+
+    def __init__(self, path, mapping, total_rows=0, chunksize=None, backup_options=None, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.mapping = mapping
+        self.total_rows = total_rows
+        self.chunksize = chunksize
+        self.backup_options = backup_options  # None: nessun backup prima dell'importazione
+        self._stop = False
+        self._started = 0.0
+        self._last_emit = 0.0
+
+    def cancel(self):
+        self._stop = True
+
+    def is_cancelled(self):
+        return self._stop
+
+    def _progress(self, done, force=False):
+        now = time.perf_counter()
+        if not force and now - self._last_emit < self.PROGRESS_INTERVAL:
+            return
+        self._last_emit = now
+        elapsed = now - self._started - self._paused
+        rate = done / elapsed if elapsed > 0 else 0.0
+        total = max(self.total_rows, done)
+        eta = (total - done) / rate if rate > 0 else -1.0
+        self.progressChanged.emit(done, total, rate, eta)
+
+    def run(self):
+        from importer import run_import, STREAM_CHUNK_ROWS
+        db = DatabaseManager()
+        session = db.get_session()
+        self._started = time.perf_counter()
+        done = 0
+        def progress(line):
+            nonlocal done
+            done = line
+            self._progress(line)
+        try:
+            if self.backup_options is not None:
+                from backup import create_backup, REASON_IMPORT
+                try:
+                    create_backup(db.db_path, reason=REASON_IMPORT, **self.backup_options)
+                except Exception as e:
+                    raise Exception(f"Backup prima dell'importazione non riuscito, nessun dato importato: {e}")
+                self._started = time.perf_counter()
+            result = run_import(session, self.path, self.mapping, self._ask_strategy,
+                                resolve_conflict=self._resolve_conflict, progress=progress,
+                                chunksize=self.chunksize or STREAM_CHUNK_ROWS, should_stop=self.is_cancelled)
+            self._progress(done, force=True)
+            self.completed.emit(result)
+        except Exception as e:
+            session.rollback()
+            self.failed.emit(str(e), getattr(e, "partial", None))
+        finally:
+            session.close()
+            db.SessionFactory.remove()
+
+class ExportWorker(QThread):
+    """
+    Esegue exporter.run_export su un thread separato con una sessione propria.
+    Il conteggio iniziale delle righe permette di mostrare l'avanzamento in percentuale.
+    """
+    totalRows = Signal(int)         # righe totali da esportare
+    progressChanged = Signal(int)   # righe scritte
+    completed = Signal(int)         # righe scritte (0 se annullata: vedi cancelled)
+    failed = Signal(str)
+
+    def __init__(self, path, spec, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.spec = spec
+        self.cancelled = False
+        self._stop = False
+
+    def cancel(self):
+        self._stop = True
+
+    def run(self):
+        from exporter import run_export, count_rows, ExportCancelled
+        db = DatabaseManager()
+        session = db.get_session()
+        try:
+            self.totalRows.emit(count_rows(session, self.spec.stmt))
+            rows = run_export(session, self.path, self.spec, progress=self.progressChanged.emit,
+                              should_stop=lambda: self._stop)
+            self.completed.emit(rows)
+        except ExportCancelled:
+            self.cancelled = True
+            self.completed.emit(0)
+        except Exception as e:
+            self.failed.emit(str(e))
+        finally:
+            session.close()
+            db.SessionFactory.remove()
+
+class SyncWorker(InteractiveWorker):
+    """Esegue DatabaseManager.sync_manual su un thread separato (vedi InteractiveWorker)"""
+    completed = Signal(object)      # dict dei risultati di sync.synchronize
+    failed = Signal(str)
+
+    def __init__(self, remote_path, parent=None):
+        super().__init__(parent)
+        self.remote_path = remote_path
+
+    def run(self):
+        try:
+            result = DatabaseManager().sync_manual(self.remote_path, ask_strategy=self._ask_strategy,
+                                                   resolve_conflict=self._resolve_conflict)
+            self.completed.emit(result)
+        except Exception as e:
+            self.failed.emit(str(e))
+
+class BackupWorker(QThread):
+    """
+    Esegue backup.create_backup (o, con restore_from, backup.restore_backup) su un thread
+    separato: la copia a blocchi non blocca né l'interfaccia né chi scrive nel database.
+    """
+    progressChanged = Signal(int, int)  # pagine copiate, pagine totali
+    completed = Signal(object)          # BackupResult (ripristino: la copia di sicurezza; None se annullato)
+    failed = Signal(str)
+
+    def __init__(self, db_path, reason, options=None, restore_from=None, parent=None):
+        super().__init__(parent)
+        self.db_path = db_path
+        self.reason = reason
+        self.options = options or {}    # backup_dir, retention
+        self.restore_from = restore_from
+        self._stop = False
+
+    def cancel(self):
+        self._stop = True
+
+    def run(self):
+        from backup import create_backup, restore_backup, BackupCancelled, BackupBusy, REASON_SCHEDULED
+        try:
+            if self.restore_from:
+                result = restore_backup(self.restore_from, self.db_path, **self.options)
+            else:
+                result = create_backup(self.db_path, reason=self.reason, progress=self.progressChanged.emit,
+                                       should_stop=lambda: self._stop, **self.options)
+            self.completed.emit(result)
+        except BackupCancelled:
+            self.completed.emit(None)
+        except BackupBusy as e:
+            if self.reason != REASON_SCHEDULED or self.restore_from:
+                self.failed.emit(str(e))
+            else:
+                self.completed.emit(None)  # Backup pianificato: riprovato al prossimo controllo
+        except Exception as e:
+            self.failed.emit(str(e))